@@ -0,0 +1,96 @@
+"""
+An archive of the raw HTML the scraper saw. With a CaptureArchive, the driver saves the expanded HTML of every chunk
+of entries it scrapes, so that the posts can be extracted again later (see reextract.py), e.g. after facebook changed
+its markup or to pick up a field the extraction did not have yet, without scraping anything again.
+"""
+
+import gzip
+import json
+import os
+import re
+from datetime import datetime
+from threading import Lock
+
+
+def _slug(page: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", re.sub(r"^\w+://", "", page)).strip("_") or "page"
+
+
+class CaptureArchive:
+    def __init__(self, root: str = "archive"):
+        """
+        Gzipped JSON lines, one line per chunk with the page, the layout, the offset of the chunk in the feed, the
+        capture time and the outerHTML of each entry. The chunks of a page go to one file per day,
+        root/<page>/<date>.jsonl.gz, each chunk as a gzip member of its own, so that a crash loses at most the chunk
+        being written.
+        :param root: Folder of the archive.
+        """
+        self.root = root
+        self.chunks = 0
+        self.entries = 0
+        # Gallery tabs and parallel drivers may share an archive.
+        self._lock = Lock()
+
+    def path(self, page: str, captured: datetime) -> str:
+        return os.path.join(self.root, _slug(page), f"{captured.date().isoformat()}.jsonl.gz")
+
+    def write(self, page: str, _type: str, offset: int, htmls: list, captured: datetime = None, max_comments=None):
+        """
+        Add a chunk of entries to the archive.
+        :param page: Link to the page the entries are from.
+        :param _type: "group" or "page".
+        :param offset: Position of the first entry in the feed, as scraped.
+        :param htmls: The outerHTML of each entry.
+        :param captured: When the entries were captured, by default now.
+        :param max_comments: The comment limit of the scrape, so that re-extraction keeps as many comments.
+        """
+        if not htmls:
+            return
+        captured = captured or datetime.now()
+        record = {"page": page, "type": _type, "offset": offset, "captured": captured.isoformat(timespec="seconds"),
+                  "max_comments": max_comments, "entries": htmls}
+        path = self.path(page, captured)
+        data = gzip.compress(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+        with self._lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "ab") as file:
+                file.write(data)
+            self.chunks += 1
+            self.entries += len(htmls)
+
+    def files(self, page: str = None, since: datetime = None) -> list:
+        """
+        The files of the archive, oldest first.
+        :param page: Only the files of this page (its link).
+        :param since: Only files from this day on.
+        """
+        return archive_files(self.root, page=page, since=since)
+
+
+def archive_files(root: str, page: str = None, since: datetime = None) -> list:
+    """
+    The files of an archive, by page and oldest first. See CaptureArchive.files.
+    """
+    folders = [os.path.join(root, _slug(page))] if page else \
+        sorted(os.path.join(root, name) for name in os.listdir(root) if os.path.isdir(os.path.join(root, name)))
+    files = []
+    for folder in folders:
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            if name.endswith(".jsonl.gz") and (since is None or name[:10] >= since.date().isoformat()):
+                files.append(os.path.join(folder, name))
+    return files
+
+
+def read_chunks(path: str):
+    """
+    Read the chunks of an archive file. A chunk that was cut off (e.g. by a crash while it was written) ends the file.
+    :return: Generator of the chunk records, as written by CaptureArchive.write.
+    """
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            for line in file:
+                yield json.loads(line)
+    except (EOFError, gzip.BadGzipFile, json.JSONDecodeError):
+        return
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of the scraper against the synthetic feeds of fixtures.py: posts per second, webdriver commands (round trips
+to chromedriver) per post, peak browser and python memory, and time per phase, for each scrape mode and feed size.
+With --facebook, compares the round trips per post of the live and the snapshot extraction on a real page instead.
+"""
+
+import json
+import tracemalloc
+from time import time
+
+from instrument import Instrumentation
+from scrape import FaceBookDriver, chrome_options, page_url
+
+BROWSER_MEMORY = "return window.performance && performance.memory ? performance.memory.usedJSHeapSize : 0;"
+
+
+def measure(driver: FaceBookDriver, page: str, _type: str, mode: str, chunk_size: int = 25,
+            sample_every: int = 25, profile: bool = False) -> dict:
+    """
+    Scrape a whole page and measure it.
+    :param driver: Logged in FaceBookDriver.
+    :param page: Link to the feed.
+    :param _type: "group" or "page".
+    :param mode: "easy", "stable" or "prune".
+    :param chunk_size: Chunk size of the stable and prune modes.
+    :param sample_every: Sample the browser memory every this many posts.
+    :param profile: Run the sampling profiler, and report the functions most time was spent in.
+    :return: Dictionary with the measurements.
+    """
+    instrumentation = Instrumentation(profile=profile).attach(driver)
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    commands, samples, browser_peak, posts = driver.command_count, 0, 0, 0
+    start = time()
+    try:
+        for _ in driver.iter_page(page=page, _type=_type, chunk_size=chunk_size if mode != "easy" else None,
+                                  mode=mode):
+            posts += 1
+            if posts % sample_every == 0:
+                browser_peak = max(browser_peak, driver.execute_script(BROWSER_MEMORY))
+                samples += 1
+        browser_peak = max(browser_peak, driver.execute_script(BROWSER_MEMORY))
+        samples += 1
+    finally:
+        seconds = time() - start
+        python_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        instrumentation.detach()
+    report = instrumentation.report()
+
+    return {"mode": mode,
+            "extraction": driver.extraction,
+            "posts": posts,
+            "seconds": round(seconds, 2),
+            "posts_per_second": round(posts / seconds, 2) if seconds else None,
+            "commands_per_post": round((driver.command_count - commands - samples) / posts, 1) if posts else None,
+            "browser_peak_mb": round(browser_peak / 2 ** 20, 1),
+            "python_peak_mb": round(python_peak / 2 ** 20, 1),
+            "phases": report["phases"],
+            "commands": report["commands"],
+            "per_post": report.get("per_post"),
+            "profile": report.get("profile")}
+
+
+def count_round_trips(driver: FaceBookDriver, page: str, _type: str, n_posts: int, extraction: str):
+    """
+    Scrape the first posts of a page and count the commands sent to chromedriver during extraction.
+    :param driver: Logged in FaceBookDriver.
+    :param page: Link to the facebook group or page.
+    :param _type: Whether the link is a group or a page.
+    :param n_posts: How many posts to scrape.
+    :param extraction: "live" or "snapshot".
+    :return: Tuple of posts scraped, commands sent and seconds spent.
+    """
+    driver._type = _type
+    driver.extraction = extraction
+    driver.load_page(page=page)
+    driver.load_entries(m=n_posts)
+    entries = driver.find_elements_by_xpath(driver.entries_xpath)[:n_posts]
+
+    commands = driver.command_count
+    start = time()
+    contents = list(driver.scrape_entries(entries))
+    return len(contents), driver.command_count - commands, time() - start
+
+
+def run_facebook():
+    import parameters
+    from acct import username, password
+
+    driver = FaceBookDriver(executable_path=parameters.chrome_location, chrome_options=chrome_options(),
+                            username=username, password=password)
+
+    page = parameters.pages[3]
+    for extraction in ["live", "snapshot"]:
+        posts, commands, seconds = count_round_trips(driver, page=page_url(page), _type=page['type'], n_posts=25,
+                                                     extraction=extraction)
+        print(f"{extraction:<9} {posts} posts, {commands / posts:.1f} round trips per post, "
+              f"{seconds / posts:.2f}s per post")
+
+    driver.quit()
+
+
+def run_fixtures(sizes: list, modes: list, extractions: list, _type: str, chunk_size: int, delay: float,
+                 batch: int, profile: bool = False, gallery_tabs: int = 0, lean: bool = False) -> list:
+    """
+    Run the benchmark against the stand-in server, for every combination of feed size, mode and extraction.
+    :return: List of the measurements.
+    """
+    import parameters
+    from tempfile import mkdtemp
+    from fixtures import serve
+
+    server = serve(batch=batch, delay=delay)
+    folder = mkdtemp(prefix="benchmark_")
+    # The lean driver downloads images instead of taking screenshots, so that they need not load in the page.
+    driver = FaceBookDriver(executable_path=parameters.chrome_location, chrome_options=chrome_options(lean=lean),
+                            username="benchmark", password="benchmark", base_url=server.url,
+                            images_folder=folder, thumbnails_folder=folder, gallery_tabs=gallery_tabs,
+                            blocked=parameters.blocked if lean else None, download_images=lean)
+    results = []
+    try:
+        for size in sizes:
+            for mode in modes:
+                for extraction in extractions:
+                    driver.extraction = extraction
+                    result = measure(driver, page=page_url({"type": _type, "id": size}, base_url=server.url),
+                                     _type=_type, mode=mode, chunk_size=chunk_size, profile=profile)
+                    result["size"] = size
+                    results.append(result)
+                    print(f"{size:>6} {mode:<7} {extraction:<9} {result['posts_per_second']:>7} posts/s "
+                          f"{result['commands_per_post']:>6} cmd/post {result['browser_peak_mb']:>7} MB browser "
+                          f"{result['python_peak_mb']:>6} MB python")
+    finally:
+        driver.quit()
+        server.shutdown()
+    return results
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the scraper against synthetic feeds.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 200, 1000], help="Numbers of posts per feed.")
+    parser.add_argument("--modes", nargs="+", default=["easy", "stable"], choices=["easy", "stable", "prune"])
+    parser.add_argument("--extraction", nargs="+", default=["live"], choices=["live", "snapshot"])
+    parser.add_argument("--type", default="group", choices=["group", "page"])
+    parser.add_argument("--chunk-size", type=int, default=25)
+    parser.add_argument("--batch", type=int, default=10, help="Posts the stand-in server loads per scroll.")
+    parser.add_argument("--delay", type=float, default=0.05, help="Seconds the stand-in server adds per response.")
+    parser.add_argument("--json", help="Write the results (including the time per phase) to this file.")
+    parser.add_argument("--profile", action="store_true", help="Run the sampling profiler during each measurement.")
+    parser.add_argument("--gallery-tabs", type=int, default=0, help="Go through galleries in this many tabs.")
+    parser.add_argument("--lean", action="store_true", help="Block videos, fonts, images and trackers.")
+    parser.add_argument("--facebook", action="store_true",
+                        help="Compare live and snapshot extraction on parameters.pages[3] instead.")
+    args = parser.parse_args()
+
+    if args.facebook:
+        run_facebook()
+        return
+
+    results = run_fixtures(args.sizes, args.modes, args.extraction, args.type, args.chunk_size, args.delay,
+                           args.batch, profile=args.profile, gallery_tabs=args.gallery_tabs, lean=args.lean)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
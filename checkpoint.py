@@ -0,0 +1,112 @@
+"""
+Durable progress of a scrape, so that stable_scrape can resume mid-page after a crash and only scrape the posts that
+are new since the last successful run.
+"""
+
+import json
+import os
+from datetime import datetime
+
+
+class Checkpoint:
+    def __init__(self, path: str):
+        """
+        Progress of the scrape of one page, kept in a JSON file. The file is rewritten atomically after every chunk.
+        :param path: File the checkpoint is kept in. Created on the first save.
+        """
+        self.path = path
+        # Sink the scraped posts are written to. Flushed before each save, so the checkpoint never gets ahead of the
+        # posts that are actually on disk.
+        self.sink = None
+        # Key of the post the chunks are counted from (see scrape.ENTRY_KEYS), how many posts past it have been scraped,
+        # and the keys of the last few of those, which the next chunk looks at again.
+        self.first_post = None
+        self.n = 0
+        self.seen = []
+        # Newest post collected in the current run, and in the last run that went all the way through.
+        self.newest = None
+        self.since = None
+        self.last_run = None
+
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as file:
+                state = json.load(file)
+            self.first_post = state.get("first_post")
+            self.n = state.get("n", 0)
+            self.seen = state.get("seen", [])
+            self.newest = _parse(state.get("newest"))
+            self.since = _parse(state.get("since"))
+            self.last_run = _parse(state.get("last_run"))
+
+    @classmethod
+    def for_page(cls, folder: str, page_id: str):
+        """
+        The checkpoint of a page from parameters.pages.
+        :param folder: Folder the checkpoints are kept in.
+        :param page_id: The id of the page or group.
+        """
+        os.makedirs(folder, exist_ok=True)
+        return cls(f"{folder}/{page_id}.json")
+
+    @property
+    def in_progress(self) -> bool:
+        """
+        Whether a previous run stopped partway through the page.
+        """
+        return bool(self.first_post)
+
+    def update(self, timestamp: datetime):
+        """
+        Record a collected post.
+        :param timestamp: Timestamp of the post.
+        """
+        if timestamp and (self.newest is None or timestamp > self.newest):
+            self.newest = timestamp
+
+    def advance(self, first_post: str, n: int, seen: list = None):
+        """
+        Record that all posts up to n past first_post have been scraped, and save.
+        :param seen: Keys of the last posts scraped.
+        """
+        self.first_post = first_post
+        self.n = n
+        self.seen = list(seen or [])
+        self.save()
+
+    def complete(self):
+        """
+        Record that the page has been scraped all the way through (or up to the last run), and save. The next
+        incremental run will stop at the newest post collected so far.
+        """
+        if self.newest and (self.since is None or self.newest > self.since):
+            self.since = self.newest
+        self.first_post = None
+        self.n = 0
+        self.seen = []
+        self.newest = None
+        self.last_run = datetime.now()
+        self.save()
+
+    def save(self):
+        if self.sink:
+            self.sink.flush()
+        state = {"first_post": self.first_post,
+                 "n": self.n,
+                 "seen": self.seen,
+                 "newest": _format(self.newest),
+                 "since": _format(self.since),
+                 "last_run": _format(self.last_run)}
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as file:
+            json.dump(state, file, indent=2)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, self.path)
+
+
+def _format(timestamp):
+    return timestamp.isoformat() if timestamp else None
+
+
+def _parse(timestamp):
+    return datetime.fromisoformat(timestamp) if timestamp else None
@@ -0,0 +1,547 @@
+#!/usr/bin/env python3
+"""
+A long-running scheduler that keeps scraping the pages of parameters.pages. The pages are jobs in a persistent queue
+(an SQLite file), and each page is visited again after an interval that follows how many new posts it had in its
+recent runs: busy groups are checked often, dormant pages rarely. A failed run is retried after a delay that doubles
+with each failure. The workers keep their logged in drivers between jobs, so a job does not start a browser or log in.
+
+    python daemon.py start --workers 2     # Run the scheduler.
+    python daemon.py status                # The jobs, and what the workers are doing.
+    python daemon.py run <page>            # Visit a page now. Also add, remove, pause, resume and stop.
+
+The commands go to the running scheduler over a local socket, or straight to the queue when it does not run.
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+from datetime import datetime
+from random import random
+from time import time
+
+from selenium.common.exceptions import WebDriverException
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, name TEXT, type TEXT, interval REAL, next_run REAL,
+                                     last_run REAL, rate REAL, failures INTEGER DEFAULT 0, last_error TEXT,
+                                     running INTEGER DEFAULT 0, paused INTEGER DEFAULT 0, runs INTEGER DEFAULT 0,
+                                     new_posts INTEGER DEFAULT 0);
+    CREATE TABLE IF NOT EXISTS runs (id TEXT, started REAL, seconds REAL, new_posts INTEGER, error TEXT);
+"""
+
+HOUR = 3600
+
+
+class SchedulerRunningError(Exception):
+    pass
+
+
+def _iso(timestamp: float):
+    return datetime.fromtimestamp(timestamp).isoformat(timespec="seconds") if timestamp else None
+
+
+def count_new_posts(file_name: str, since: float) -> int:
+    """
+    How many posts in the results of a run are newer than a time, for the intervals when there is no store to count
+    the new posts.
+    :param file_name: The results of the run, without extension, as scrape_to_file returns it.
+    :param since: When the page was visited before, as a timestamp.
+    """
+    from sinks import read_jsonl
+
+    if since is None or not os.path.exists(file_name + ".jsonl"):
+        return 0
+    since = datetime.fromtimestamp(since)
+    # The file of the day also has the posts of the earlier runs of the day, some of them more than once.
+    return sum(datetime.fromisoformat(post['timestamp']) > since
+               for post in read_jsonl(file_name + ".jsonl", latest=True))
+
+
+class JobQueue:
+    def __init__(self, path: str = "scheduler.sqlite", interval: float = 6 * HOUR, min_interval: float = HOUR / 2,
+                 max_interval: float = 7 * 24 * HOUR, target: float = 5, smoothing: float = 0.5,
+                 retry: float = 300, max_retry: float = 6 * HOUR):
+        """
+        Persistent queue of the pages to scrape, with when to visit each of them next.
+        :param path: The SQLite file of the queue. Created if it does not exist.
+        :param interval: Seconds between the visits of a page that was not visited twice yet.
+        :param min_interval: Shortest interval between the visits of a page, however busy it is.
+        :param max_interval: Longest interval between the visits of a page, however dormant it is.
+        :param target: How many new posts a visit should find, on average. The interval of a page is the time it takes
+        to get that many posts at the rate the page has new posts.
+        :param smoothing: Weight of the latest run in the running average of the rate of new posts.
+        :param retry: Seconds to wait before retrying a page after its first failure, doubled with each failure.
+        :param max_retry: Longest wait before retrying a page.
+        """
+        self.path = path
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target = target
+        self.smoothing = smoothing
+        self.retry = retry
+        self.max_retry = max_retry
+        # The workers and the control socket use the queue from their own threads.
+        self._lock = threading.Lock()
+        # Held by the scheduler that runs the jobs of the queue, see acquire.
+        self._owner = None
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript(SCHEMA)
+
+    def add(self, page: dict, interval: float = None) -> bool:
+        """
+        Add a page (an entry of parameters.pages) to the queue, to be visited right away.
+        :return: Whether the page was new to the queue.
+        """
+        with self._lock, self._db:
+            cursor = self._db.execute("INSERT OR IGNORE INTO jobs (id, name, type, interval, next_run) "
+                                      "VALUES (?, ?, ?, ?, ?)",
+                                      (page['id'], page['name'], page['type'], interval or self.interval, time()))
+        return cursor.rowcount > 0
+
+    def sync(self, pages: list) -> int:
+        """
+        Add the pages that are not in the queue yet.
+        :return: Number of pages added.
+        """
+        return sum(self.add(page) for page in pages)
+
+    def remove(self, page_id: str) -> bool:
+        with self._lock, self._db:
+            return self._db.execute("DELETE FROM jobs WHERE id = ?", (page_id,)).rowcount > 0
+
+    def _set(self, page_id: str, **values) -> bool:
+        with self._lock, self._db:
+            return self._db.execute(f"UPDATE jobs SET {', '.join(f'{key} = ?' for key in values)} WHERE id = ?",
+                                    list(values.values()) + [page_id]).rowcount > 0
+
+    def run_now(self, page_id: str) -> bool:
+        """
+        Visit a page as soon as a worker is free, whenever it was due.
+        """
+        return self._set(page_id, next_run=time())
+
+    def pause(self, page_id: str) -> bool:
+        return self._set(page_id, paused=1)
+
+    def resume(self, page_id: str) -> bool:
+        return self._set(page_id, paused=0)
+
+    def acquire(self):
+        """
+        Take the queue for this scheduler, with an exclusive lock on a file next to it, held until close. There can only
+        be one scheduler per queue: a second one would release and run the jobs the first one is running.
+        :raises SchedulerRunningError: If another scheduler holds the queue.
+        """
+        if self._owner:
+            return
+        owner = open(self.path + ".lock", "a+")
+        try:
+            try:
+                import fcntl
+                fcntl.flock(owner.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except ImportError:
+                import msvcrt
+                msvcrt.locking(owner.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            owner.close()
+            raise SchedulerRunningError(f"Another scheduler is running the jobs of {self.path}.")
+        self._owner = owner
+
+    def recover(self):
+        """
+        Release the jobs that were running when the scheduler stopped (or crashed), so they are run again. Only with the
+        queue acquired.
+        """
+        with self._lock, self._db:
+            self._db.execute("UPDATE jobs SET running = 0")
+
+    def claim(self):
+        """
+        Take the page that is most overdue, if any, and mark it as running.
+        :return: The page, as an entry of parameters.pages, or None if no page is due.
+        """
+        with self._lock, self._db:
+            row = self._db.execute("SELECT id, name, type FROM jobs WHERE running = 0 AND paused = 0 AND next_run <= ? "
+                                   "ORDER BY next_run LIMIT 1", (time(),)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE jobs SET running = 1 WHERE id = ?", (row['id'],))
+        return dict(row)
+
+    def last_run(self, page_id: str):
+        """
+        When the page was last visited successfully, as a timestamp, or None.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT last_run FROM jobs WHERE id = ?", (page_id,)).fetchone()
+        return row[0] if row else None
+
+    def next_due(self):
+        """
+        Seconds until the next page is due (0 if one is due already), or None if there are no pages to wait for.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT MIN(next_run) FROM jobs WHERE running = 0 AND paused = 0").fetchone()
+        return None if row[0] is None else max(row[0] - time(), 0)
+
+    def next_interval(self, job: dict, new_posts: int, now: float):
+        """
+        The rate of new posts of a page (per hour) after a run, and the interval until its next visit.
+        """
+        if job['last_run'] is None:
+            # The first run finds everything that was posted so far, which says nothing about the rate.
+            return job['rate'], job['interval']
+        observed = new_posts / max((now - job['last_run']) / HOUR, 1 / 60)
+        rate = observed if job['rate'] is None else self.smoothing * observed + (1 - self.smoothing) * job['rate']
+        interval = self.target / rate * HOUR if rate > 0 else job['interval'] * 2
+        return rate, min(max(interval, self.min_interval), self.max_interval)
+
+    def done(self, page_id: str, started: float, new_posts: int):
+        """
+        Record a successful run, and schedule the next visit of the page.
+        """
+        now = time()
+        with self._lock, self._db:
+            job = self._db.execute("SELECT * FROM jobs WHERE id = ?", (page_id,)).fetchone()
+            if job is None:
+                return
+            rate, interval = self.next_interval(dict(job), new_posts, started)
+            self._db.execute("UPDATE jobs SET running = 0, failures = 0, last_error = NULL, last_run = ?, rate = ?, "
+                             "interval = ?, next_run = ?, runs = runs + 1, new_posts = new_posts + ? WHERE id = ?",
+                             (started, rate, interval, started + interval, new_posts, page_id))
+            self._db.execute("INSERT INTO runs VALUES (?, ?, ?, ?, NULL)", (page_id, started, now - started, new_posts))
+
+    def failed(self, page_id: str, started: float, error: str):
+        """
+        Record a failed run, and retry the page after a delay that doubles with each failure in a row.
+        """
+        now = time()
+        with self._lock, self._db:
+            job = self._db.execute("SELECT failures FROM jobs WHERE id = ?", (page_id,)).fetchone()
+            if job is None:
+                return
+            delay = min(self.retry * 2 ** job['failures'], self.max_retry) * (1 + 0.1 * random())
+            self._db.execute("UPDATE jobs SET running = 0, failures = failures + 1, last_error = ?, next_run = ? "
+                             "WHERE id = ?", (error, now + delay, page_id))
+            self._db.execute("INSERT INTO runs VALUES (?, ?, ?, 0, ?)", (page_id, started, now - started, error))
+
+    def status(self) -> list:
+        """
+        The jobs in the queue, in the order they are due.
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM jobs ORDER BY next_run").fetchall()
+        now = time()
+        jobs = []
+        for row in map(dict, rows):
+            state = "running" if row['running'] else "paused" if row['paused'] else \
+                "backing off" if row['failures'] else "due" if row['next_run'] <= now else "waiting"
+            jobs.append({"id": row['id'], "name": row['name'], "type": row['type'], "state": state,
+                         "interval_hours": round(row['interval'] / HOUR, 2),
+                         "new_posts_per_hour": None if row['rate'] is None else round(row['rate'], 3),
+                         "next_run": _iso(row['next_run']), "last_run": _iso(row['last_run']), "runs": row['runs'],
+                         "new_posts": row['new_posts'], "failures": row['failures'], "last_error": row['last_error']})
+        return jobs
+
+    def close(self):
+        self._db.close()
+        if self._owner:
+            self._owner.close()
+            self._owner = None
+
+
+class Scheduler:
+    def __init__(self, queue: JobQueue, login, workers: int = 1, rate: float = 1, destination: str = "results",
+                 checkpoints: str = "checkpoints", store: str = None, formats: list = ("csv", "xlsx"),
+                 session_cache=None, **driver_kwargs):
+        """
+        Runs the jobs of the queue as they become due, with a number of workers that each keep a logged in
+        FaceBookDriver between jobs.
+        :param queue: The job queue.
+        :param login: Function that returns the cookies of a logged in session, with no arguments. Called once at the
+        start, and again when the session expired.
+        :param workers: Number of worker threads, each with its own chrome.
+        :param rate: Maximum number of requests per second, across all workers.
+        :param destination: Folder to write the results to.
+        :param checkpoints: Folder to keep the checkpoints in.
+        :param store: SQLite file of a ResultStore to write the posts to. The new posts it counts set the intervals;
+        without a store, the posts of a run that are newer than the last visit are counted.
+        :param formats: Outputs to derive from the Parquet export of each run, "csv" and/or "xlsx".
+        :param session_cache: The SessionCache login uses, to clear when the session expired.
+        :param driver_kwargs: Further arguments to FaceBookDriver.
+        """
+        from parallel import RateLimiter
+
+        self.queue = queue
+        self.login = login
+        self.workers = workers
+        self.limiter = RateLimiter(rate)
+        self.destination = destination
+        self.checkpoints = checkpoints
+        self.store = store
+        self.formats = formats
+        self.session_cache = session_cache
+        self.driver_kwargs = driver_kwargs
+        self.cookies = None
+        self.started = None
+        # What each worker is doing, for the status.
+        self.activity = {}
+        self._stop = threading.Event()
+        # Set to wake up idle workers, e.g. when a page is to be run now.
+        self._wake = threading.Event()
+        self._cookie_lock = threading.Lock()
+        self._threads = []
+
+    def _session(self, expired: list = None) -> list:
+        # The first worker to notice that the session expired logs in again, the others take the new cookies.
+        with self._cookie_lock:
+            if expired is not None and self.cookies is expired and self.session_cache:
+                self.session_cache.clear()
+            if self.cookies is None or self.cookies is expired:
+                self.cookies = self.login()
+            return self.cookies
+
+    def _work(self, number: int):
+        from parallel import _start_driver
+        from scrape import scrape_to_file
+        from store import ResultStore
+
+        name = f"worker-{number}"
+        driver, cookies = None, None
+        store = ResultStore(self.store) if self.store else None
+        while not self._stop.is_set():
+            page = self.queue.claim()
+            if page is None:
+                self.activity[name] = "idle"
+                wait = self.queue.next_due()
+                self._wake.wait(60 if wait is None else min(wait, 60))
+                self._wake.clear()
+                continue
+
+            started = time()
+            self.activity[name] = f"{page['name']} since {_iso(started)}"
+            try:
+                if driver is None:
+                    cookies = self._session()
+                    driver = _start_driver(cookies, self.limiter, self.driver_kwargs)
+                added, last_run = store.added if store else 0, self.queue.last_run(page['id'])
+                file_name, _ = scrape_to_file(driver, page=page, destination=self.destination,
+                                              checkpoints=self.checkpoints, formats=self.formats, store=store)
+                new_posts = store.added - added if store else count_new_posts(file_name, last_run)
+                self.queue.done(page['id'], started, new_posts)
+            except Exception as e:
+                self.queue.failed(page['id'], started, f"{type(e).__name__}: {e}")
+                if driver is not None and isinstance(e, WebDriverException):
+                    try:
+                        logged_in = driver.logged_in()
+                    except WebDriverException:
+                        logged_in = False
+                    if not logged_in:
+                        # A broken browser, or an expired session: start over with a new driver (and login).
+                        self._quit(driver)
+                        driver = None
+                        self._session(expired=cookies)
+
+        self.activity[name] = "stopped"
+        if driver is not None:
+            self._quit(driver)
+        if store:
+            store.close()
+
+    @staticmethod
+    def _quit(driver):
+        try:
+            driver.quit()
+        except WebDriverException:
+            pass
+
+    def start(self):
+        """
+        Start the workers, in the background.
+        :raises SchedulerRunningError: If another scheduler runs the jobs of the queue already.
+        """
+        self.queue.acquire()
+        self.queue.recover()
+        self.started = time()
+        self._stop.clear()
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work, args=(number,), name=f"worker-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self, wait: bool = True):
+        """
+        Stop the workers once they are done with their current job.
+        """
+        self._stop.set()
+        self._wake.set()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
+
+    def wait(self):
+        """
+        Block until the scheduler is stopped.
+        """
+        while not self._stop.wait(1):
+            pass
+        self.stop()
+
+    def status(self) -> dict:
+        return {"started": _iso(self.started), "workers": dict(self.activity), "jobs": self.queue.status()}
+
+    def handle(self, request: dict) -> dict:
+        """
+        Carry out a command of the control socket, see command.
+        """
+        if request.get("command") == "status":
+            return self.status()
+        if request.get("command") == "stop":
+            self._stop.set()
+            self._wake.set()
+            return {"ok": True}
+        result = command(self.queue, request)
+        if result.get("ok"):
+            self.wake()
+        return result
+
+
+def command(queue: JobQueue, request: dict) -> dict:
+    """
+    Carry out a command on the queue: status, add (with a page), remove, run, pause or resume (with a page id).
+    :param request: The command, as {"command": ..., "page": ...}.
+    :return: The answer, with "ok" False for commands that did not apply.
+    """
+    import parameters
+    from scrape import find_page
+
+    name, argument = request.get("command"), request.get("page")
+    if name == "status":
+        return {"jobs": queue.status()}
+    if name == "add":
+        page = argument if isinstance(argument, dict) else find_page(parameters.pages, argument)
+        return {"ok": queue.add(page)}
+    actions = {"remove": queue.remove, "run": queue.run_now, "pause": queue.pause, "resume": queue.resume}
+    if name in actions:
+        return {"ok": actions[name](argument)}
+    return {"ok": False, "error": f"Unknown command {name}."}
+
+
+def serve(scheduler: Scheduler, path: str):
+    """
+    Answer commands on a unix socket, one JSON object per line. Not available on Windows, where the commands go to the
+    queue file instead.
+    :return: The socket server, running in a background thread.
+    """
+    import socketserver
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                try:
+                    answer = scheduler.handle(json.loads(line))
+                except Exception as e:
+                    answer = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+                self.wfile.write(json.dumps(answer).encode() + b"\n")
+
+    if os.path.exists(path):
+        # A socket that still answers belongs to a scheduler that is running; only a stale one is replaced.
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                pass
+            else:
+                raise SchedulerRunningError(f"A scheduler is listening on {path}.")
+        if os.path.exists(path):
+            os.remove(path)
+    server = socketserver.ThreadingUnixStreamServer(path, Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="control", daemon=True).start()
+    return server
+
+
+def send(path: str, request: dict, timeout: float = 10):
+    """
+    Send a command to a running scheduler.
+    :return: The answer, or None if no scheduler listens on the socket.
+    """
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(path):
+        return None
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(timeout)
+        try:
+            connection.connect(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            return None
+        connection.sendall(json.dumps(request).encode() + b"\n")
+        return json.loads(connection.makefile().readline())
+
+
+def main():
+    import argparse
+    import signal
+    from functools import partial
+
+    import parameters
+
+    parser = argparse.ArgumentParser(description="Keep scraping the pages of parameters.pages on a schedule.")
+    parser.add_argument("command", choices=["start", "status", "add", "remove", "run", "pause", "resume", "stop"])
+    parser.add_argument("page", nargs="?", help="Name or id of the page, for the commands on a page.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of chrome instances.")
+    parser.add_argument("--rate", type=float, default=1, help="Maximum requests per second across all workers.")
+    args = parser.parse_args()
+
+    if args.command != "start":
+        request = {"command": args.command, "page": args.page}
+        answer = send(parameters.scheduler_socket, request)
+        if answer is None:
+            if args.command == "stop":
+                print("The scheduler is not running.")
+                return
+            # The queue is persistent; a scheduler that is started later picks the change up.
+            queue = JobQueue(parameters.scheduler)
+            answer = command(queue, request)
+            queue.close()
+        print(json.dumps(answer, indent=2))
+        return
+
+    from acct import username, password
+    from parallel import login
+    from scrape import SessionCache
+
+    queue = JobQueue(parameters.scheduler)
+    queue.sync(parameters.pages)
+    scheduler = Scheduler(queue, login=partial(login, username, password), workers=args.workers, rate=args.rate,
+                          destination=parameters.destination, checkpoints=parameters.checkpoints,
+                          store=parameters.store, formats=parameters.export_formats,
+                          session_cache=SessionCache(parameters.session))
+    try:
+        queue.acquire()
+        server = serve(scheduler, parameters.scheduler_socket) if hasattr(socket, "AF_UNIX") else None
+    except SchedulerRunningError as e:
+        queue.close()
+        print(f"{e} Use status, stop and the other commands to control it.")
+        return
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: scheduler.stop(wait=False))
+
+    scheduler.start()
+    print(f"Scheduler started with {args.workers} worker(s), {len(queue.status())} pages.")
+    scheduler.wait()
+    if server:
+        server.shutdown()
+        os.remove(parameters.scheduler_socket)
+    queue.close()
+
+
+if __name__ == "__main__":
+    main()
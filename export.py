@@ -0,0 +1,187 @@
+"""
+Export of scraped posts as three normalized tables, keyed by post_id: the posts themselves, their comments and their
+images. The tables are written to Parquet in row groups while the posts are streamed from the .jsonl file of the
+scrape, so memory does not grow with the size of the group. CSV and XLSX files are derived from the Parquet files.
+"""
+
+import re
+
+# Columns of the posts table. The comments and images of a post go to tables of their own.
+POST_COLUMNS = ["post_id", "page", "author", "timestamp", "text", "link", "unavailable"]
+COMMENT_COLUMNS = ["post_id", "position", "comment_id", "author", "text", "likes", "timestamp", "depth", "parent"]
+MEDIA_COLUMNS = ["post_id", "position", "path"]
+TABLES = {"posts": POST_COLUMNS, "comments": COMMENT_COLUMNS, "media": MEDIA_COLUMNS}
+
+IMAGE_KEY = re.compile(r"image_(\d+)$")
+
+
+def schemas() -> dict:
+    """
+    The Arrow schemas of the tables. Timestamps are read as strings (ISO format, as in the .jsonl files) and converted
+    a whole column at a time.
+    """
+    import pyarrow as pa
+
+    return {"posts": pa.schema([("post_id", pa.string()), ("page", pa.string()), ("author", pa.string()),
+                                ("timestamp", pa.timestamp("s")), ("text", pa.string()), ("link", pa.string()),
+                                ("unavailable", pa.bool_())]),
+            "comments": pa.schema([("post_id", pa.string()), ("position", pa.int32()), ("comment_id", pa.string()),
+                                   ("author", pa.string()), ("text", pa.string()), ("likes", pa.int64()),
+                                   ("timestamp", pa.timestamp("s")), ("depth", pa.int32()), ("parent", pa.int32())]),
+            "media": pa.schema([("post_id", pa.string()), ("position", pa.int32()), ("path", pa.string())])}
+
+
+def split_post(post: dict):
+    """
+    Split a post (as scraped, or as read back from a .jsonl file) into its rows of the posts, comments and media
+    tables.
+    :return: Dictionary of the rows by table.
+    """
+    post_id = post.get('post_id')
+    row = {column: post.get(column) for column in POST_COLUMNS}
+    comments = [dict({column: comment.get(column) for column in COMMENT_COLUMNS}, post_id=post_id, position=position)
+                for position, comment in enumerate(post.get('comments') or [])]
+    media = sorted(({"post_id": post_id, "position": int(match.group(1)), "path": value}
+                    for key, value in post.items() for match in [IMAGE_KEY.match(key)] if match),
+                   key=lambda image: image['position'])
+    return {"posts": [row], "comments": comments, "media": media}
+
+
+def _to_table(rows: list, schema):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    columns = {}
+    for field in schema:
+        values = [row.get(field.name) for row in rows]
+        if pa.types.is_timestamp(field.type):
+            # Parse the whole column at once instead of each timestamp on its own.
+            strings = pa.array([value.isoformat() if hasattr(value, "isoformat") else value for value in values],
+                               type=pa.string())
+            columns[field.name] = pc.cast(strings, field.type)
+        else:
+            columns[field.name] = pa.array(values, type=field.type)
+    return pa.table(columns, schema=schema)
+
+
+class ParquetExport:
+    def __init__(self, file_name: str, row_group_size: int = 10000, compression: str = "zstd"):
+        """
+        Writes posts to file_name + "_posts.parquet", "_comments.parquet" and "_media.parquet", one row group at a
+        time.
+        :param file_name: File name of the results, without extension.
+        :param row_group_size: How many rows of a table to buffer before writing them out as a row group.
+        :param compression: Compression of the Parquet files.
+        """
+        import pyarrow.parquet as pq
+
+        self.file_name = file_name
+        self.row_group_size = row_group_size
+        self.schemas = schemas()
+        self.rows = {table: 0 for table in TABLES}
+        self._buffers = {table: [] for table in TABLES}
+        self._writers = {table: pq.ParquetWriter(self.path(table), self.schemas[table], compression=compression)
+                         for table in TABLES}
+
+    def path(self, table: str) -> str:
+        return f"{self.file_name}_{table}.parquet"
+
+    def write(self, post: dict):
+        for table, rows in split_post(post).items():
+            self._buffers[table].extend(rows)
+            if len(self._buffers[table]) >= self.row_group_size:
+                self._flush(table)
+
+    def _flush(self, table: str):
+        if self._buffers[table]:
+            self._writers[table].write_table(_to_table(self._buffers[table], self.schemas[table]))
+            self.rows[table] += len(self._buffers[table])
+            self._buffers[table] = []
+
+    def close(self):
+        for table, writer in self._writers.items():
+            self._flush(table)
+            writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def escape_text(df):
+    """
+    Escape the non-ASCII characters in the text columns of a data frame (as \\u escapes), which Excel cannot always
+    take. Works on a whole column at a time.
+    """
+    for column in df.columns:
+        if df[column].dtype == object or str(df[column].dtype) in ("string", "str"):
+            strings = df[column].astype("string")
+            df[column] = strings.str.encode("unicode_escape").str.decode("utf-8")
+    return df
+
+
+def write_csv(parquet: str, path: str, batch_size: int = 10000):
+    """
+    Derive a CSV file (UTF-16, as the earlier exports) from a Parquet file, a batch of rows at a time.
+    """
+    import pyarrow.parquet as pq
+
+    with open(path, "w", encoding="utf-16", newline="") as file:
+        for number, batch in enumerate(pq.ParquetFile(parquet).iter_batches(batch_size=batch_size)):
+            batch.to_pandas().to_csv(file, index=False, header=number == 0)
+
+
+def write_xlsx(parquet: str, path: str, batch_size: int = 10000):
+    """
+    Derive an XLSX file from a Parquet file, a batch of rows at a time (with openpyxl's write-only mode).
+    """
+    import pyarrow.parquet as pq
+    from openpyxl import Workbook
+
+    parquet_file = pq.ParquetFile(parquet)
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(parquet_file.schema_arrow.names)
+    for batch in parquet_file.iter_batches(batch_size=batch_size):
+        df = escape_text(batch.to_pandas()).astype(object)
+        df = df.where(df.notna(), None)
+        for row in df.itertuples(index=False, name=None):
+            sheet.append(row)
+    workbook.save(path)
+
+
+def export_posts(posts, file_name: str, formats: list = ("csv", "xlsx"), row_group_size: int = 10000) -> dict:
+    """
+    Export posts to Parquet files of the posts, comments and media tables, and derive CSV and/or XLSX files of each
+    table from them (e.g. file_name + "_comments.csv").
+    :param posts: Iterable of post dictionaries, e.g. read_jsonl or ResultStore.posts.
+    :param file_name: File name of the results, without extension.
+    :param formats: Derived outputs to write besides Parquet, "csv" and/or "xlsx".
+    :param row_group_size: Rows per row group of the Parquet files.
+    :return: Number of rows of each table.
+    """
+    with ParquetExport(file_name, row_group_size=row_group_size) as export:
+        for post in posts:
+            export.write(post)
+
+    for table in TABLES:
+        # The posts table keeps the name of the earlier exports, without suffix.
+        name = file_name if table == "posts" else f"{file_name}_{table}"
+        if "csv" in formats:
+            write_csv(export.path(table), name + ".csv")
+        if "xlsx" in formats:
+            write_xlsx(export.path(table), name + ".xlsx")
+    return export.rows
+
+
+def export_results(file_name: str, formats: list = ("csv", "xlsx"), row_group_size: int = 10000) -> dict:
+    """
+    Export the posts collected in file_name + ".jsonl", see export_posts. Posts that were written to it more than once
+    are exported as they were last written.
+    """
+    from sinks import read_jsonl
+
+    return export_posts(read_jsonl(file_name + ".jsonl", latest=True), file_name, formats=formats,
+                        row_group_size=row_group_size)
@@ -0,0 +1,392 @@
+"""
+Offline extraction of facebook posts. The functions in this module work on HTML snapshots of the feed (parsed with
+lxml) rather than on live selenium elements, so that a whole chunk of posts can be pulled from the browser in a single
+call and then be taken apart without any further round trips to the webdriver.
+"""
+
+import hashlib
+import re
+from datetime import datetime
+from urllib.parse import parse_qs, urljoin, urlparse
+
+# Selectors for the entries of the feed and the fallbacks for video thumbnails, by type of the scraped site.
+XPATHS = {"group": {"entries": "//div[starts-with(@id, 'mall_post_')]",
+                    "thumbnail": [".//img[starts-with(@class, '_1445')]",
+                                  ".//img[@class = 'scaledImageFitWidth img']",
+                                  ".//a/div/img"]},
+          "page": {"entries": "//div[@id = 'pagelet_timeline_main_column']//div[@class = '_4-u2 _4-u8']",
+                   "thumbnail": [".//img[@class = 'scaledImageFitWidth img']",
+                                 ".//a/div/img"]}
+          }
+
+# Selectors relative to an individual entry, shared by the live and the snapshot extraction.
+AUTHOR = ".//span[starts-with(@class, 'fwb')]/a"
+TIMESTAMP = ".//*[starts-with(@class, '_5ptz')]"
+# The link around the timestamp of a post, to the post itself.
+PERMALINK = TIMESTAMP + "/ancestor-or-self::a[@href][1]"
+# Facebook's number of a post, in the id of its element (groups) or in its permalink.
+POST_NUMBER = re.compile(r"^mall_post_(\d+)|[?&]story_fbid=(\d+)|/(?:permalink|posts)/(\d+)")
+TEXT = ".//*[@data-testid='post_message']"
+SEE_MORE = ".//*[text()='See More']"
+# The comment tree: top level comments are the items of the _7791 lists, replies are in a list below each of them.
+COMMENT_LISTS = ".//ul[@class='_7791'][not(ancestor::ul[@class='_7791'])]"
+COMMENT_REPLIES = "./div/ul"
+COMMENT_ARTICLE = "./div[@role='article']"
+COMMENT_AUTHOR = ".//a[contains(concat(' ', @class, ' '), ' _6qw4 ')]"
+COMMENT_BODY = ".//span[contains(concat(' ', @class, ' '), ' _3l3x ')]"
+COMMENT_TIME = ".//abbr[@data-utime]"
+COMMENT_LIKES = ".//span[contains(concat(' ', @class, ' '), ' _1lld ')]"
+MORE_COMMENTS = ".//*[contains(text(), 'more comments')]"
+REPLY_PAGER = ".//*[@data-testid = 'UFI2CommentsPagerRenderer/pager_depth_1' and @role = 'button']"
+THEATER = ".//*[@rel = 'theater']"
+# The items of a gallery in the markup of a post (or of the page of a photo set): photos open in the theater, videos
+# are links to /videos/ or video elements.
+GALLERY_ITEMS = ".//*[@rel = 'theater'] | .//a[contains(@href, '/videos/')] | .//video"
+# The "+N" overlay on the last photo of a gallery, for the photos that are not shown.
+HIDDEN_ITEMS = ".//*[@class='_52db']"
+MEDIA_ID = re.compile(r"fbid=(\d+)|/photos/(?:[^/]+/)*(\d+)|/videos/(?:[^/]+/)*(\d+)")
+LINK = {"group": ".//div[@class='mtm']//a",
+        "page": ".//a[@class = '_52c6']"}
+
+TIMESTAMP_FORMAT = "%m/%d/%y, %H:%M %p"
+
+# Elements that selenium renders on a line of their own when reading the .text of an element.
+BLOCK_TAGS = {"address", "article", "blockquote", "br", "div", "dl", "dt", "dd", "fieldset", "figcaption", "figure",
+              "footer", "form", "h1", "h2", "h3", "h4", "h5", "h6", "header", "hr", "li", "main", "nav", "ol", "p",
+              "pre", "section", "table", "tr", "ul"}
+SKIP_TAGS = {"script", "style", "noscript", "template"}
+
+
+class ExtractionError(LookupError):
+    pass
+
+
+def parse_html(html: str):
+    """
+    Parse a snippet of HTML (e.g. the outerHTML of an entry).
+    :param html: The HTML as a string.
+    :return: The root lxml element.
+    """
+    from lxml import html as lxml_html
+    return lxml_html.fromstring(html)
+
+
+def first(element, xpath: str):
+    """
+    Return the first match of an xpath, or None. The offline equivalent to find_element_by_xpath.
+    """
+    matches = element.xpath(xpath)
+    return matches[0] if matches else None
+
+
+def element_text(element) -> str:
+    """
+    Approximate the rendered text of an element the way selenium's .text reports it, i.e. with block level elements
+    on lines of their own.
+    :param element: lxml element.
+    :return: The text, as a string.
+    """
+    if element is None:
+        return ""
+    parts = []
+
+    def walk(node, root=False):
+        if not isinstance(node.tag, str) or node.tag in SKIP_TAGS:
+            if node.tail and not root:
+                parts.append(node.tail)
+            return
+        block = node.tag in BLOCK_TAGS
+        if block:
+            parts.append("\n")
+        if node.text:
+            parts.append(node.text)
+        for child in node:
+            walk(child)
+        if block:
+            parts.append("\n")
+        if node.tail and not root:
+            parts.append(node.tail)
+
+    walk(element, root=True)
+    text = "".join(parts).replace("\xa0", " ")
+    text = re.sub(r"[ \t\r\f\v]+", " ", text)
+    text = re.sub(r" ?\n[\s]*", "\n", text)
+    return text.strip()
+
+
+def clean_comment(comment: str) -> str:
+    """
+    Remove the like/reply footer from the text of a comment.
+    """
+    comment = re.sub(r"\nLike\n ?· Reply ·.*", "", comment, flags=re.DOTALL)
+    comment = re.sub(r"\n\d$", "", comment, flags=re.DOTALL)
+    comment = re.sub(r"\n?Hide or report this$", "", comment.strip())
+    return comment.strip()
+
+
+def parse_count(count: str) -> int:
+    """
+    Parse a count as facebook displays it, e.g. "12" or "1.2K".
+    """
+    count = (count or "").strip().replace(",", "")
+    if not count:
+        return 0
+    factor = {"K": 1000, "M": 1000000}.get(count[-1].upper(), 1)
+    if factor > 1:
+        count = count[:-1]
+    try:
+        return int(float(count) * factor)
+    except ValueError:
+        return 0
+
+
+def comment_record(raw: dict) -> dict:
+    """
+    Normalize a comment as collected from the comment tree (in the browser or offline).
+    :param raw: Dictionary with author, text, likes (as displayed), utime (unix time), depth, parent and, if the
+    author and text could not be told apart, the whole text of the comment as full_text.
+    :return: Dictionary with author, text, likes, timestamp, depth and parent of the comment.
+    """
+    text = raw.get('text')
+    if text is None:
+        text = clean_comment(raw.get('full_text') or "")
+    utime = raw.get('utime')
+    return {'comment_id': raw.get('comment_id'),
+            'author': raw.get('author') or "",
+            'text': text,
+            'likes': parse_count(raw.get('likes')),
+            'timestamp': datetime.fromtimestamp(int(utime)) if utime else None,
+            'depth': raw.get('depth', 0),
+            'parent': raw.get('parent')}
+
+
+def comment_id(article):
+    """
+    The id of a comment, from the link of its timestamp.
+    """
+    link = first(article, ".//a[contains(@href, 'comment_id=')]/@href")
+    match = re.search(r"reply_comment_id=(\d+)", link or "") or re.search(r"comment_id=(\d+)", link or "")
+    return match.group(1) if match else None
+
+
+def parse_comments(entry) -> list:
+    """
+    Extract the comments of an (already expanded) entry, with their replies. Works like the COMMENT_TREE script of
+    the driver.
+    :param entry: lxml element of the entry.
+    :return: List of comment dictionaries (see comment_record), replies following the comment they reply to.
+    """
+    records = []
+
+    def walk(comment_list, depth, parent):
+        for item in comment_list.xpath("./li"):
+            article = first(item, COMMENT_ARTICLE)
+            article = article if article is not None else item
+            author, body = first(article, COMMENT_AUTHOR), first(article, COMMENT_BODY)
+            time, likes = first(article, COMMENT_TIME), first(article, COMMENT_LIKES)
+            raw = {'comment_id': comment_id(article),
+                   'author': element_text(author) if author is not None else None,
+                   'text': element_text(body) if body is not None else None,
+                   'likes': element_text(likes) if likes is not None else None,
+                   'utime': time.get('data-utime') if time is not None else None,
+                   'depth': depth,
+                   'parent': parent}
+            if body is None:
+                raw['full_text'] = element_text(article)
+            records.append(comment_record(raw))
+            position = len(records) - 1
+            for replies in item.xpath(COMMENT_REPLIES):
+                walk(replies, depth + 1, position)
+
+    for comment_list in entry.xpath(COMMENT_LISTS):
+        walk(comment_list, 0, None)
+    return records
+
+
+def parse_link(entry, _type: str):
+    """
+    Extract the link shared in an entry.
+    :param entry: lxml element of the entry.
+    :param _type: Whether the entry is from a group or a page.
+    :return: The link, or None.
+    """
+    link = first(entry, LINK[_type])
+    return link.get("href") if link is not None else None
+
+
+def gallery_items(entry, base_url: str = None) -> list:
+    """
+    All photos and videos of a gallery, from the markup of a post, in order.
+    :param entry: lxml element of the entry, or of the page of a photo set.
+    :param base_url: Address of the page, to resolve relative links against.
+    :return: List of the items, as dictionaries with the kind ("photo" or "video"), the facebook id (if the link has
+    one), the link, and the image source (the full size image where the markup has it, else the preview).
+    """
+    items, links = [], set()
+    for element in entry.xpath(GALLERY_ITEMS):
+        url = element.get("href") or element.get("src") or ""
+        if base_url:
+            url = urljoin(base_url, url)
+        if url in links:
+            continue
+        links.add(url)
+        video = element.tag == "video" or "/videos/" in url or element.get("data-video-id") is not None
+        image = element if element.tag == "img" else first(element, ".//img")
+        source = element.get("data-ploi") or (image.get("src") if image is not None else None)
+        match = MEDIA_ID.search(url)
+        items.append({"kind": "video" if video else "photo",
+                      "id": next((group for group in match.groups() if group), None) if match else None,
+                      "url": url,
+                      "src": urljoin(base_url, source) if source and base_url else source})
+    return items
+
+
+def hidden_items(entry) -> int:
+    """
+    How many items of a gallery the markup of the post does not show (the "+N" on the last photo).
+    """
+    overlay = first(entry, HIDDEN_ITEMS)
+    if overlay is None:
+        return 0
+    digits = re.sub(r"\D", "", overlay.text_content())
+    return int(digits) if digits else 0
+
+
+def photo_set(items: list):
+    """
+    The photo set (album, or the photos of a post) the items of a gallery belong to, from the set parameter of their
+    links, or None.
+    """
+    for item in items:
+        sets = parse_qs(urlparse(item['url']).query).get("set")
+        if sets:
+            return sets[0]
+    return None
+
+
+def parse_permalink(entry):
+    """
+    The link of a post to itself (around its timestamp), or None.
+    :param entry: lxml element of the entry.
+    """
+    link = first(entry, PERMALINK)
+    if link is None or link.get("href") == "#":
+        return None
+    return link.get("href")
+
+
+def post_number(entry_id: str = None, permalink: str = None):
+    """
+    Facebook's number of a post, from the id of its element (groups) or from its permalink, or None.
+    """
+    for text in (entry_id, permalink):
+        match = POST_NUMBER.search(text or "")
+        if match:
+            return next(group for group in match.groups() if group)
+    return None
+
+
+def post_identity(entry_id: str, author: str, timestamp: datetime, page: str = None, permalink: str = None,
+                  number: str = None) -> str:
+    """
+    Stable identity of a post, the same for both the browser and the basic mobile site (http_backend.py): facebook's
+    number of the post where it is known, else a hash of the page and the permalink, else of the page, author and
+    timestamp (to the minute, as the browser shows it).
+    :param entry_id: The id attribute of the entry element.
+    :param permalink: The link of the post to itself.
+    :param number: Facebook's number of the post, if it is known otherwise.
+    """
+    number = number or post_number(entry_id, permalink)
+    if number:
+        return number
+    if permalink:
+        # Without the tracking parameters, which change from one view to the next.
+        url = urlparse(permalink)
+        query = parse_qs(url.query)
+        key = f"{page}|{url.path}|" + "&".join(f"{name}={query[name][0]}" for name in ("fbid", "id") if name in query)
+    else:
+        key = f"{page}|{author}|{timestamp.replace(second=0, microsecond=0).isoformat()}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]
+
+
+def _fnv1a(text: str) -> str:
+    # 32 bit FNV-1a over UTF-16 code units, like the hash of ENTRY_KEYS in scrape.py.
+    data = text.encode("utf-16-le", "surrogatepass")
+    h = 0x811c9dc5
+    for i in range(0, len(data), 2):
+        h = ((h ^ (data[i] | data[i + 1] << 8)) * 0x01000193) & 0xffffffff
+    return f"{h:08x}"
+
+
+def entry_key(entry) -> str:
+    """
+    Stable key of an entry of the feed, for telling the entries apart while scrolling: the mall_post_ id of the element
+    (groups), else the permalink of the post, else a hash of its author, timestamp and the start of its text. The same
+    key as scrape.ENTRY_KEYS gives in the browser (without the suffix of keys that occur more than once).
+    :param entry: lxml element of the entry.
+    """
+    entry_id = entry.get("id") or ""
+    if entry_id.startswith("mall_post_"):
+        return entry_id
+    permalink = parse_permalink(entry)
+    if permalink:
+        return "link:" + permalink.split("?")[0]
+    stamp, author, text = first(entry, TIMESTAMP), first(entry, AUTHOR), first(entry, TEXT)
+    # The first 80 UTF-16 code units of the text, as the browser slices it.
+    start = text.text_content().encode("utf-16-le")[:160].decode("utf-16-le", "surrogatepass") if text is not None \
+        else ""
+    return "hash:" + _fnv1a("|".join([author.text_content() if author is not None else "",
+                                      (stamp.get("title") or "") if stamp is not None else "", start]))
+
+
+def parse_entry(entry, _type: str, max_comments: int = None, page: str = None) -> dict:
+    """
+    Extract the contents of one individual post from its HTML. Produces the same fields as
+    FaceBookDriver.scrape_entry, except for the images, which need the browser.
+    :param entry: lxml element of the entry, or its HTML as a string.
+    :param _type: Whether the entry is from a group or a page.
+    :param max_comments: Maximum numbers of comments to be extracted.
+    :param page: Link to the page the post is from, for its identity.
+    :return: Dictionary with the contents of the post.
+    """
+    if isinstance(entry, str):
+        entry = parse_html(entry)
+    text = element_text(entry)
+
+    content = {}
+
+    content['unavailable'] = bool("This content isn't available right now" in text)
+
+    author = first(entry, AUTHOR)
+    timestamp = first(entry, TIMESTAMP)
+    if author is None or timestamp is None:
+        raise ExtractionError("Entry has no author or timestamp.")
+    content['author'] = element_text(author)
+    content['timestamp'] = datetime.strptime(timestamp.get('title'), TIMESTAMP_FORMAT)
+    content['post_id'] = post_identity(entry.get('id'), content['author'], content['timestamp'], page,
+                                       permalink=parse_permalink(entry))
+
+    content['comments'] = parse_comments(entry)[: max_comments] if 'Reply' in text else []
+    content['text'] = element_text(first(entry, TEXT))
+
+    content['link'] = ""
+    if ("shared a link" in text) or (_type == "page"):
+        content['link'] = parse_link(entry, _type)
+
+    return content
+
+
+def needs_expansion(entry) -> bool:
+    """
+    Check whether an entry still has collapsed text or comments that need to be clicked open in the browser.
+    """
+    return bool(entry.xpath(SEE_MORE) or entry.xpath(MORE_COMMENTS) or entry.xpath(REPLY_PAGER))
+
+
+def has_media(entry, _type: str, thumbnails: list = None) -> bool:
+    """
+    Check whether an entry has images or a video thumbnail, which need the browser to be saved.
+    :param thumbnails: Selectors of the video thumbnail, by default those of XPATHS.
+    """
+    thumbnails = thumbnails or XPATHS[_type]["thumbnail"]
+    return bool(entry.xpath(THEATER) or any(entry.xpath(xpath) for xpath in thumbnails))
@@ -0,0 +1,484 @@
+#!/usr/bin/env python3
+"""
+Synthetic facebook-like feeds, with the markup that FaceBookDriver expects, and a local stand-in server for them. Used
+by benchmark.py to measure the scraper without a facebook account, and without touching facebook.
+
+The stand-in server has a fake login, group feeds at /groups/<n> and page feeds at /<n>/posts/, where n is the number
+of posts in the feed. Further posts are loaded as the feed is scrolled, comments and replies are loaded when "more
+comments" or the reply pager are clicked, and galleries open in a photo theater that can be stepped through with Next.
+
+Below /m, it serves the same feeds as static pages in the style of facebook's basic mobile site, for the browser-free
+backend (http_backend.py): feeds are paged with "See More Posts" links, and each post has a full story page with its
+comments, paged with "View more comments", and a page of replies per comment.
+"""
+
+import json
+import random
+import struct
+import zlib
+from datetime import datetime, timedelta
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from time import sleep
+from urllib.parse import parse_qs, quote, urlparse
+
+import extract
+
+WORDS = ("river water fish bank flood bridge trout salmon otter heron clean up walk weir meeting photo spring "
+         "summer autumn winter rain level high low callan folly wildlife group friends volunteers litter").split()
+
+START = datetime(2019, 11, 1, 12, 0)
+
+
+def png(width: int = 4, height: int = 4, color: tuple = (90, 140, 200)) -> bytes:
+    """
+    A plain PNG image of one color.
+    """
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    rows = b"".join(b"\x00" + bytes(color) * width for _ in range(height))
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)) +
+            chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b""))
+
+
+def _sentence(rng: random.Random, n: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(n)).capitalize() + "."
+
+
+class Post:
+    def __init__(self, index: int, seed: int = 0):
+        """
+        One synthetic post. What it contains (comments, gallery, link, video, long text) is drawn at random, but the
+        same index and seed always give the same post.
+        :param index: Position of the post in the feed, the newest being 0.
+        """
+        rng = random.Random(seed * 1000003 + index)
+        self.index = index
+        self.author = f"{rng.choice(['Anne', 'Brian', 'Ciara', 'Declan', 'Eimear', 'Fergal'])} " \
+                      f"{rng.choice(['Byrne', 'Doyle', 'Kelly', 'Murphy', 'Walsh'])}"
+        self.timestamp = START - timedelta(hours=3 * index, minutes=rng.randrange(60))
+        self.text = " ".join(_sentence(rng, rng.randrange(5, 15)) for _ in range(rng.randrange(1, 4)))
+        self.more_text = " ".join(_sentence(rng, 12) for _ in range(3)) if rng.random() < 0.2 else ""
+        self.n_comments = rng.choice([0, 0, 0, 1, 2, 3, 5, 8, 20])
+        self.n_replies = [rng.choice([0, 0, 0, 1, 2]) for _ in range(self.n_comments)]
+        kind = rng.random()
+        self.n_images = 0
+        self.video = False
+        self.link = None
+        if kind < 0.3:
+            self.n_images = 1
+        elif kind < 0.4:
+            self.n_images = rng.randrange(2, 12)
+        elif kind < 0.5:
+            self.video = True
+        elif kind < 0.6:
+            self.link = f"https://example.org/news/{index}"
+
+    @property
+    def id(self):
+        return f"mall_post_{1000000 + self.index}"
+
+    def comment(self, number: int, reply: int = None) -> str:
+        """
+        Markup of a comment (or a reply to it).
+        """
+        rng = random.Random(self.index * 7919 + number * 31 + (reply or 0))
+        comment_id = 5000000 + self.index * 1000 + number
+        href = f"/permalink/{1000000 + self.index}/?comment_id={comment_id}"
+        if reply is not None:
+            href += f"&reply_comment_id={comment_id * 100 + reply}"
+        likes = rng.choice(["", "", "1", "2", "7", "1.2K"])
+        utime = int((self.timestamp + timedelta(minutes=10 * (number + 1))).timestamp())
+        return (f'<li><div role="article" aria-label="Comment"><div><a class="_6qw4" href="/profile/{number}">'
+                f'{rng.choice(["Gerry", "Helen", "Ivan", "Joan"])} Commenter</a> '
+                f'<span class="_3l3x">{escape(_sentence(rng, rng.randrange(3, 12)))}</span></div>'
+                f'<div><span class="_1lld">{likes}</span></div>'
+                f'<div>Like<br/> · Reply · <a href="{href}"><abbr data-utime="{utime}">1h</abbr></a></div></div>'
+                + (self.replies(number) if reply is None else "") + '</li>')
+
+    def replies(self, number: int) -> str:
+        if not self.n_replies[number]:
+            return ""
+        return (f'<div><ul></ul><div data-testid="UFI2CommentsPagerRenderer/pager_depth_1" role="button" '
+                f'onclick="loadReplies(this, {self.index}, {number})">View {self.n_replies[number]} replies</div>'
+                f'</div>')
+
+    def html(self, _type: str) -> str:
+        """
+        Markup of the post, as an entry of a group or page feed.
+        """
+        attributes = f'id="{self.id}"' if _type == "group" else 'class="_4-u2 _4-u8"'
+        parts = [f'<div {attributes} data-index="{self.index}">',
+                 f'<h5><span class="fwb fcg"><a href="/profile/{self.index}">{escape(self.author)}</a></span>'
+                 + (' shared a link.' if self.link else '') + '</h5>',
+                 f'<a href="/permalink/{1000000 + self.index}/"><abbr class="_5ptz" '
+                 f'title="{self.timestamp.strftime(extract.TIMESTAMP_FORMAT)}" '
+                 f'data-utime="{int(self.timestamp.timestamp())}">{self.timestamp:%d %b}</abbr></a>',
+                 f'<div data-testid="post_message"><p>{escape(self.text)}']
+        if self.more_text:
+            parts.append(f'<span class="text_exposed_hide" style="display:none"> {escape(self.more_text)}</span>'
+                         f'<a onclick="seeMore(this)"><span>See More</span></a>')
+        parts.append('</p></div>')
+
+        if self.link and _type == "group":
+            parts.append(f'<div class="mtm"><a href="{self.link}">{self.link}</a></div>')
+        elif self.link:
+            parts.append(f'<a class="_52c6" href="{self.link}">{self.link}</a>')
+        if self.n_images:
+            shown = min(self.n_images, 5)
+            for image in range(shown):
+                parts.append(f'<a rel="theater" href="/photo/{self.index}/{image}?set=pcb.{self.index}" '
+                             f'onclick="openTheater({self.index}, {image}, {self.n_images}); return false;">'
+                             f'<img src="/images/{self.index}_{image}.png" width="200" height="150"/></a>')
+            if self.n_images > shown:
+                parts.append(f'<div class="_52db">+{self.n_images - shown}</div>')
+        if self.video:
+            parts.append(f'<div><img class="scaledImageFitWidth img" src="/images/{self.index}_video.png" '
+                         f'width="200" height="150"/><video autoplay muted src="/videos/{self.index}.mp4" '
+                         f'width="200" height="150"></video></div>')
+
+        if self.n_comments:
+            shown = min(self.n_comments, 2)
+            parts.append('<div><ul class="_7791">' + "".join(self.comment(number) for number in range(shown)) +
+                         '</ul>')
+            if self.n_comments > shown:
+                parts.append(f'<a role="button" onclick="loadComments(this, {self.index}, {shown})">'
+                             f'View {self.n_comments - shown} more comments</a>')
+            parts.append('</div>')
+        parts.append('</div>')
+        return "".join(parts)
+
+    def mbasic_html(self, prefix: str = "/m", full: bool = False) -> str:
+        """
+        Markup of the post on the basic mobile site, in a feed or (with full) on its full story page.
+        """
+        data_ft = json.dumps({"top_level_post_id": str(1000000 + self.index),
+                              "page_insights": {"1": {"post_context": {
+                                  "publish_time": int(self.timestamp.timestamp())}}}})
+        parts = [f"<article data-ft='{escape(data_ft, quote=True)}'>",
+                 f'<header><h3><strong><a href="/profile/{self.index}">{escape(self.author)}</a></strong>'
+                 + (' shared a link.' if self.link else '') + '</h3></header>',
+                 '<div data-ft=\'{"tn":"*s"}\'><p>' + escape(self.text)]
+        if self.more_text and full:
+            parts.append(" " + escape(self.more_text))
+        elif self.more_text:
+            parts.append(f'... <a href="{prefix}/story/{self.index}">More</a>')
+        parts.append('</p></div>')
+        if self.link:
+            parts.append(f'<a href="https://lm.facebook.com/l.php?u={quote(self.link, safe="")}">{self.link}</a>')
+        shown = self.n_images if full else min(self.n_images, 4)
+        for image in range(shown):
+            parts.append(f'<a href="/photo.php?fbid={self.index}{image:02d}">'
+                         f'<img src="/images/{self.index}_{image}.png" width="200" height="150"/></a>')
+        if self.n_images > shown:
+            parts.append(f'<a href="{prefix}/story/{self.index}">+{self.n_images - shown}</a>')
+        if self.video:
+            parts.append(f'<a href="/video_redirect/?src={self.index}"><img src="/images/{self.index}_video.png" '
+                         f'width="200" height="150"/></a>')
+        n_comments = self.n_comments + sum(self.n_replies)
+        parts.append(f'<footer><abbr>{self.timestamp:%B %d at %I:%M %p}</abbr> · '
+                     f'<a href="{prefix}/story/{self.index}">{n_comments} Comments</a> · '
+                     f'<a href="{prefix}/story/{self.index}">Full Story</a></footer></article>')
+        return "".join(parts)
+
+    def mbasic_comment(self, number: int, reply: int = None, prefix: str = "/m") -> str:
+        """
+        Markup of a comment (or reply) on the basic mobile site.
+        """
+        rng = random.Random(self.index * 7919 + number * 31 + (reply or 0))
+        comment_id = 5000000 + self.index * 1000 + number
+        if reply is not None:
+            comment_id = comment_id * 100 + reply
+        likes = rng.choice(["", "", "1", "2", "7", "1.2K"])
+        utime = int((self.timestamp + timedelta(minutes=10 * (number + 1))).timestamp())
+        html = (f'<div id="{comment_id}" data-sigil="comment"><div><h3><a href="/profile/{number}">'
+                f'{rng.choice(["Gerry", "Helen", "Ivan", "Joan"])} Commenter</a></h3>'
+                f'<div data-sigil="comment-body">{escape(_sentence(rng, rng.randrange(3, 12)))}</div>'
+                f'<div><abbr data-utime="{utime}">1h</abbr> · <span class="_1lld">{likes}</span> · Like · '
+                f'Reply</div>')
+        if reply is None and self.n_replies[number]:
+            html += (f'<div id="comment_replies_more_1:{comment_id}"><a href="{prefix}/replies/{self.index}/{number}">'
+                     f'{self.n_replies[number]} replies</a></div>')
+        return html + '</div></div>'
+
+
+def feed_html(posts: list, _type: str) -> str:
+    return "".join(post.html(_type) for post in posts)
+
+
+SCRIPT = """
+function seeMore(link) {
+    link.parentNode.querySelector('.text_exposed_hide').style.display = 'inline';
+    link.remove();
+}
+function loadComments(link, post, offset) {
+    fetch('/comments/' + post + '?offset=' + offset).then(function (r) { return r.text(); }).then(function (html) {
+        link.parentNode.querySelector('ul._7791').insertAdjacentHTML('beforeend', html);
+        link.remove();
+    });
+}
+function loadReplies(pager, post, comment) {
+    fetch('/replies/' + post + '/' + comment).then(function (r) { return r.text(); }).then(function (html) {
+        pager.parentNode.querySelector('ul').insertAdjacentHTML('beforeend', html);
+        pager.remove();
+    });
+}
+var theater = null;
+function openTheater(post, image, count) {
+    fetch('/theater/' + post + '/' + image).then(function (r) { return r.text(); }).then(function (html) {
+        if (!theater) {
+            theater = document.createElement('div');
+            theater.id = 'theater';
+            theater.style = 'position:fixed;top:0;left:0;width:100%;height:100%;background:#000;z-index:10';
+            document.body.appendChild(theater);
+        }
+        theater.innerHTML = html;
+    });
+}
+document.addEventListener('keydown', function (e) {
+    if (e.key == 'Escape' && theater) { theater.remove(); theater = null; }
+});
+var loading = false;
+window.addEventListener('scroll', function () {
+    var feed = document.getElementById('feed');
+    if (!feed || loading || feed.dataset.offset >= feed.dataset.total) { return; }
+    if (window.innerHeight + window.scrollY < document.body.scrollHeight - 300) { return; }
+    loading = true;
+    fetch('/feed/' + feed.dataset.type + '/' + feed.dataset.total + '?offset=' + feed.dataset.offset)
+        .then(function (r) { return r.text(); }).then(function (html) {
+            feed.insertAdjacentHTML('beforeend', html);
+            feed.dataset.offset = Math.min(+feed.dataset.offset + BATCH, +feed.dataset.total);
+            loading = false;
+        });
+});
+"""
+
+
+# A web font and videos as heavy as on facebook, but empty.
+FONT = "@font-face { font-family: Feed; src: url(/fonts/feed.woff2); } body { font-family: Feed, sans-serif; }"
+FONT_SIZE = 2 ** 16
+VIDEO_SIZE = 2 ** 20
+
+
+def page_html(body: str, script: str = "") -> str:
+    return (f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>Facebook</title><style>{FONT}</style></head>'
+            f'<body><div><a href="/">Facebook</a></div>{body}<script>{script}</script></body></html>')
+
+
+def feed_page(total: int, _type: str, batch: int, seed: int = 0) -> str:
+    """
+    Feed page with the first batch of posts, that loads the rest as it is scrolled.
+    :param total: Number of posts in the feed.
+    :param _type: "group" or "page".
+    :param batch: Number of posts loaded per scroll.
+    """
+    posts = feed_html([Post(index, seed) for index in range(min(batch, total))], _type)
+    feed = f'<div id="feed" data-type="{_type}" data-total="{total}" data-offset="{min(batch, total)}">{posts}</div>'
+    if _type == "group":
+        body = f'<h2 id="newsFeedHeading">Discussion</h2>{feed}'
+    else:
+        body = f'<div id="pagelet_timeline_main_column">{feed}</div>'
+    return page_html(body, SCRIPT.replace("BATCH", str(batch)))
+
+
+def mbasic_feed_page(total: int, batch: int, offset: int, path: str, seed: int = 0, prefix: str = "/m") -> str:
+    """
+    A page of a feed on the basic mobile site, with a link to the next page.
+    :param path: Path of the feed, for the link to the next page.
+    """
+    end = min(offset + batch, total)
+    posts = "".join(Post(index, seed).mbasic_html(prefix) for index in range(offset, end))
+    more = f'<div id="m_more_item"><a href="{path}?cursor={end}">See More Posts</a></div>' if end < total else ""
+    return page_html(f'<div id="m_group_stories_container"><section>{posts}</section>{more}</div>')
+
+
+def mbasic_story_page(post: Post, offset: int = 0, per_page: int = 10, prefix: str = "/m") -> str:
+    """
+    The full story page of a post on the basic mobile site, with a page of its comments.
+    """
+    end = min(offset + per_page, post.n_comments)
+    comments = "".join(post.mbasic_comment(number, prefix=prefix) for number in range(offset, end))
+    more = (f'<div id="see_next_{1000000 + post.index}"><a href="{prefix}/story/{post.index}?offset={end}">'
+            f'View more comments…</a></div>') if end < post.n_comments else ""
+    return page_html(f'{post.mbasic_html(prefix, full=True)}<div id="ufi_{post.index}">{comments}{more}</div>')
+
+
+def theater_html(post: Post, image: int) -> str:
+    """
+    The photo theater on one image of a gallery.
+    """
+    title = post.timestamp.strftime("%A, %B %d, %Y at %I:%M %p")
+    html = (f'<div id="fbPhotoSnowliftAuthorName"><a title="{escape(post.author)}" href="/profile/{post.index}">'
+            f'{escape(post.author)}</a></div>'
+            f'<span id="fbPhotoSnowliftTimestamp"><abbr title="{title}">{post.timestamp:%d %b}</abbr></span>'
+            f'<img class="spotlight" src="/images/{post.index}_{image}.png" width="600" height="400"/>')
+    if image + 1 < post.n_images:
+        html += (f'<a title="Next" href="#" onclick="openTheater({post.index}, {image + 1}, {post.n_images});'
+                 f' return false;">Next</a>')
+    return html
+
+
+def write_feed(path: str, n_posts: int, _type: str = "group", seed: int = 0):
+    """
+    Write a static feed with all posts on it, e.g. for the snapshot extraction.
+    :param path: HTML file to write.
+    :param n_posts: Number of posts.
+    :param _type: "group" or "page".
+    """
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(feed_page(n_posts, _type, batch=n_posts, seed=seed))
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # Set on the server: seed, batch and delay (seconds added to every response, to simulate the network).
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, body, content_type="text/html; charset=utf-8", status=200, headers=None):
+        body = body.encode("utf-8") if isinstance(body, str) else body
+        sleep(self.server.delay)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    @property
+    def logged_in(self):
+        return "c_user=" in (self.headers.get("Cookie") or "")
+
+    def do_POST(self):
+        if urlparse(self.path).path == "/login":
+            self._send("", status=302, headers={"Location": "/", "Set-Cookie": "c_user=100001; Path=/"})
+        else:
+            self._send("Not found", status=404)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        query = parse_qs(url.query)
+        seed, batch = self.server.seed, self.server.batch
+
+        if not parts:
+            if self.logged_in:
+                self._send(page_html('<div role="feed">Welcome</div>'))
+            else:
+                self._send(page_html('<form method="post" action="/login"><input id="email" name="email"/>'
+                                     '<input id="pass" name="pass" type="password"/>'
+                                     '<button id="loginbutton" type="submit">Log In</button></form>'))
+        elif parts[0] == "m":
+            self.mbasic(parts[1:], query)
+        elif parts[0] == "groups" and len(parts) == 2:
+            self._send(feed_page(int(parts[1]), "group", batch, seed))
+        elif len(parts) == 2 and parts[1] == "posts":
+            self._send(feed_page(int(parts[0]), "page", batch, seed))
+        elif parts[0] == "feed":
+            _type, total = parts[1], int(parts[2])
+            offset = int(query.get("offset", ["0"])[0])
+            self._send(feed_html([Post(index, seed) for index in range(offset, min(offset + batch, total))], _type))
+        elif parts[0] == "comments":
+            post = Post(int(parts[1]), seed)
+            offset = int(query.get("offset", ["0"])[0])
+            self._send("".join(post.comment(number) for number in range(offset, post.n_comments)))
+        elif parts[0] == "replies":
+            post, number = Post(int(parts[1]), seed), int(parts[2])
+            self._send("".join(post.comment(number, reply) for reply in range(post.n_replies[number])))
+        elif parts[0] == "photo":
+            # The link of a gallery image, opened on a page of its own (e.g. in a tab).
+            post = Post(int(parts[1]), seed)
+            self._send(page_html(f'<div id="theater">{theater_html(post, int(parts[2]))}</div>',
+                                 SCRIPT.replace("BATCH", str(batch)) + "theater = document.getElementById('theater');"))
+        elif parts[0] == "media" and parts[1:] == ["set"]:
+            # The page of a photo set, with all images of a post (pcb.<post>).
+            post = Post(int(query.get("set", ["pcb.0"])[0].split(".")[-1]), seed)
+            self._send(page_html("".join(f'<a rel="theater" href="/photo/{post.index}/{image}?set=pcb.{post.index}">'
+                                         f'<img src="/images/{post.index}_{image}.png"/></a>'
+                                         for image in range(post.n_images))))
+        elif parts[0] == "theater":
+            self._send(theater_html(Post(int(parts[1]), seed), int(parts[2])))
+        elif parts[0] in ("videos", "fonts"):
+            # Dead weight for the lean driver to block (see scrape.BLOCKS).
+            self._send(bytes(VIDEO_SIZE if parts[0] == "videos" else FONT_SIZE),
+                       content_type="video/mp4" if parts[0] == "videos" else "font/woff2")
+        elif parts[0] == "images":
+            index = int(parts[1].split("_")[0])
+            self._send(png(color=((index * 37) % 256, (index * 91) % 256, 160)), content_type="image/png")
+        elif parts[0] == "posts.json":
+            # The ground truth, for checking what the scraper extracted.
+            total = int(query.get("n", ["10"])[0])
+            self._send(json.dumps([{"post_id": post.id, "author": post.author, "timestamp": post.timestamp.isoformat(),
+                                    "comments": post.n_comments + sum(post.n_replies), "images": post.n_images}
+                                   for post in (Post(index, seed) for index in range(total))]),
+                       content_type="application/json")
+        else:
+            self._send("Not found", status=404)
+
+    def mbasic(self, parts: list, query: dict):
+        """
+        The static pages of the basic mobile site, below /m.
+        """
+        seed, batch = self.server.seed, self.server.batch
+        offset = int(query.get("cursor", query.get("offset", ["0"]))[0])
+        if not self.logged_in:
+            self._send("", status=302, headers={"Location": "/login.php"})
+        elif parts[0] == "groups" and len(parts) == 2:
+            self._send(mbasic_feed_page(int(parts[1]), batch, offset, urlparse(self.path).path, seed))
+        elif len(parts) == 2 and parts[1] == "posts":
+            self._send(mbasic_feed_page(int(parts[0]), batch, offset, urlparse(self.path).path, seed))
+        elif parts[0] == "story":
+            self._send(mbasic_story_page(Post(int(parts[1]), seed), offset))
+        elif parts[0] == "replies":
+            post, number = Post(int(parts[1]), seed), int(parts[2])
+            replies = range(post.n_replies[number])
+            self._send(page_html("".join(post.mbasic_comment(number, reply) for reply in replies)))
+        else:
+            self._send("Not found", status=404)
+
+
+def serve(port: int = 0, batch: int = 10, delay: float = 0.0, seed: int = 0):
+    """
+    Start the stand-in server in a background thread.
+    :param port: Port to listen on; 0 picks a free one.
+    :param batch: Number of posts loaded per scroll.
+    :param delay: Seconds added to every response.
+    :return: The server, with its address in server.url. Stop it with server.shutdown().
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), StandInHandler)
+    server.daemon_threads = True
+    server.seed, server.batch, server.delay = seed, batch, delay
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve synthetic facebook feeds, or write one to a file.")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--batch", type=int, default=10, help="Posts loaded per scroll.")
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds added to every response.")
+    parser.add_argument("--write", help="Write a static feed to this file instead of serving.")
+    parser.add_argument("--posts", type=int, default=100, help="Number of posts of the written feed.")
+    parser.add_argument("--type", default="group", choices=["group", "page"])
+    args = parser.parse_args()
+
+    if args.write:
+        write_feed(args.write, args.posts, args.type)
+        return
+
+    server = serve(port=args.port, batch=args.batch, delay=args.delay)
+    print(f"Serving on {server.url} (groups at /groups/<posts>, pages at /<posts>/posts/, static pages below /m)")
+    try:
+        while True:
+            sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Going through the galleries of posts in tabs of their own, while the feed tab carries on. Webdriver commands to one
+browser are handled one at a time, so the tabs are not driven by threads, but in turns: each gallery tab is stepped
+forward (save the image, click Next) whenever the wait after its last step is over, in between the posts of the feed.
+The waits for the theater to load and for the next image overlap with each other and with the feed, instead of adding
+up.
+"""
+
+from concurrent.futures import Future
+from datetime import datetime
+from random import random
+from time import sleep, time
+
+from selenium.common.exceptions import WebDriverException
+
+import extract
+import media
+
+THEATER_TIMESTAMP_FORMAT = "%A, %B %d, %Y at %I:%M %p"
+
+
+class Gallery:
+    def __init__(self, url: str, n_images: int, post_id: str, handle: str = None):
+        """
+        The state of one gallery being gone through in a tab.
+        :param url: Link of the first image of the gallery.
+        :param n_images: How many images the post says it has.
+        :param post_id: Post the images belong to.
+        :param handle: Window handle of the tab.
+        """
+        self.url = url
+        self.n_images = n_images
+        self.post_id = post_id
+        self.handle = handle
+        self.future = Future()
+        self.files = []
+        self.steps = 0
+        self.post_date = None
+        self.last_image = None
+        # When the tab can be stepped next, and until when to wait for the theater to show the image.
+        self.ready_at = 0
+        self.deadline = 0
+
+
+class GalleryTabs:
+    def __init__(self, driver, tabs: int = 3, load_timeout: float = 15):
+        """
+        Up to `tabs` galleries gone through at the same time, each in a tab of the driver's browser.
+        :param driver: The FaceBookDriver. Its feed tab is the one that is active when a gallery is submitted.
+        :param tabs: Number of gallery tabs.
+        :param load_timeout: How long to wait for the theater to show an image.
+        """
+        self.driver = driver
+        self.tabs = tabs
+        self.load_timeout = load_timeout
+        self.jobs = []
+        self.idle = []
+
+    def _delay(self, kind: str) -> float:
+        pacing = self.driver.pacing
+        return pacing.delays[kind] * (1 + random() * pacing.jitter)
+
+    def submit(self, entry, post_id: str = None) -> Future:
+        """
+        Start going through the gallery of a post in a tab. Waits for a tab to become free if all are busy.
+        :param entry: Web element of the entry, in the feed tab.
+        :param post_id: Post the images belong to, for the media store.
+        :return: A future of the image_0, image_1, ... entries of the post.
+        """
+        n_images = self.driver.gallery_size(entry)
+        links = [link.get_attribute("href") for link in entry.find_elements_by_xpath(extract.THEATER)]
+        links = [link for link in links if link]
+        if not links:
+            future = Future()
+            future.set_result({})
+            return future
+
+        while len(self.jobs) >= self.tabs:
+            self.pump()
+
+        job = Gallery(links[0], n_images, post_id, handle=self.idle.pop() if self.idle else None)
+        self.driver.pacing.throttle()
+        if job.handle is None:
+            handles = set(self.driver.window_handles)
+            self.driver.execute_script("window.open(arguments[0]);", job.url)
+            job.handle = (set(self.driver.window_handles) - handles).pop()
+        else:
+            feed = self.driver.current_window_handle
+            self.driver.switch_to.window(job.handle)
+            self.driver.get(job.url)
+            self.driver.switch_to.window(feed)
+        job.ready_at = time() + self._delay("theater")
+        job.deadline = job.ready_at + self.load_timeout
+        self.jobs.append(job)
+        return job.future
+
+    def step(self) -> bool:
+        """
+        Step forward every gallery whose tab is ready, and return to the feed tab.
+        :return: Whether any galleries are still in progress.
+        """
+        now = time()
+        ready = [job for job in self.jobs if job.ready_at <= now]
+        if ready:
+            feed = self.driver.current_window_handle
+            for job in ready:
+                self.driver.switch_to.window(job.handle)
+                try:
+                    done = self._advance(job)
+                except WebDriverException:
+                    self.driver.screenshot_error += 1
+                    done = True
+                if done:
+                    self._finish(job)
+            self.driver.switch_to.window(feed)
+        return bool(self.jobs)
+
+    def pump(self) -> bool:
+        """
+        Wait until the next gallery tab is ready, and step it. For when the feed has nothing else to do.
+        :return: Whether any galleries are still in progress.
+        """
+        if not self.jobs:
+            return False
+        wait = min(job.ready_at for job in self.jobs) - time()
+        if wait > 0:
+            sleep(wait)
+        return self.step()
+
+    def _advance(self, job: Gallery) -> bool:
+        """
+        Save the image the theater of a tab shows and click on to the next one.
+        :return: Whether the gallery is done.
+        """
+        driver = self.driver
+        # Any selector of the chain tells whether the theater is there, without counting misses while it loads.
+        loaded = driver.find_elements_by_xpath(" | ".join(driver.selectors.chain(driver._type, "theater_timestamp")))
+        image = driver.find_elements_by_class_name("spotlight")
+        source = image[0].get_attribute("src") if image else None
+        if not loaded or (source and source == job.last_image):
+            # The theater (or the next image) has not loaded yet.
+            if time() < job.deadline:
+                job.ready_at = time() + self._delay("hover")
+                return False
+            if not loaded:
+                driver.image_issue += 1
+            return True
+
+        timestamp = driver.find_selector(driver, "theater_timestamp").get_attribute('title')
+        image_time = datetime.strptime(timestamp, THEATER_TIMESTAMP_FORMAT)
+        # In some cases, facebook allows users to click through galeries and access previous image posts. Prevent!
+        if job.post_date is None:
+            job.post_date = image_time.date()
+        elif image_time.date() != job.post_date:
+            return True
+
+        author_link = driver.find_selector(driver, "theater_author")
+        author = author_link.get_attribute('title') or author_link.text
+        job.steps += 1
+        if image:
+            stem = media.file_stem(driver.images_folder, author, image_time)
+            try:
+                job.files.append(driver.save_image(image[0], stem, post_id=job.post_id, position=len(job.files)))
+            except WebDriverException:
+                driver.screenshot_error += 1
+            job.last_image = source
+        else:
+            driver.no_screenshot += 1
+
+        if (driver.max_images is not None and len(job.files) >= driver.max_images) or job.steps >= job.n_images:
+            return True
+        next_button = driver.selectors.find(driver, driver._type, "theater_next")
+        if next_button is None or not next_button.is_displayed():
+            return True
+        driver.pacing.throttle()
+        next_button.click()
+        job.ready_at = time() + self._delay("gallery")
+        job.deadline = job.ready_at + self.load_timeout
+        return False
+
+    def _finish(self, job: Gallery):
+        self.jobs.remove(job)
+        self.idle.append(job.handle)
+        job.future.set_result({f"image_{position}": filename for position, filename in enumerate(job.files)})
+
+    def close(self):
+        """
+        Hand on what the unfinished galleries have so far, and close the gallery tabs.
+        """
+        for job in list(self.jobs):
+            self._finish(job)
+        if not self.idle:
+            return
+        feed = self.driver.current_window_handle
+        for handle in self.idle:
+            try:
+                self.driver.switch_to.window(handle)
+                self.driver.close()
+            except WebDriverException:
+                pass
+        self.idle = []
+        self.driver.switch_to.window(feed)
@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""
+Scraping without a browser. Instead of rendering the feed in chrome and scrolling it, the static pages of facebook's
+basic mobile site are fetched over a pooled HTTP session with the cookies of a logged in session, the "See More Posts"
+links are followed from page to page, and the posts are taken apart with lxml. HttpScraper has the same scrape_page as
+FaceBookDriver and produces the same fields, so it works with scrape_to_file. Since it needs no chrome, one process
+can scrape many pages at once (see scrape_pages).
+"""
+
+import asyncio
+import os
+import re
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from threading import Lock
+from time import sleep
+from urllib.parse import parse_qs, urljoin, urlparse
+
+import extract
+import media
+from registry import SelectorRegistry
+from scrape import ERROR_COUNTERS, Pacing
+
+# The layout of the selector chains for the basic mobile site, see registry.DEFAULTS.
+LAYOUT = "mbasic"
+
+PUBLISH_TIME = re.compile(r'"publish_time"\s*:\s*(\d+)')
+TOP_LEVEL_POST_ID = re.compile(r'"top_level_post_id"\s*:\s*"?(\d+)')
+
+
+class SessionExpiredError(Exception):
+    pass
+
+
+def publish_time(entry):
+    """
+    Time of a post, from the data-ft attribute of its article.
+    """
+    match = PUBLISH_TIME.search(entry.get("data-ft") or "")
+    return datetime.fromtimestamp(int(match.group(1))) if match else None
+
+
+def top_level_post_id(entry):
+    """
+    Facebook's number of a post, from the data-ft attribute of its article, for extract.post_identity.
+    """
+    match = TOP_LEVEL_POST_ID.search(entry.get("data-ft") or "")
+    return match.group(1) if match else None
+
+
+def unwrap_link(href: str):
+    """
+    The target of a link that goes through facebook's link shim (l.php?u=...).
+    """
+    if not href:
+        return href
+    target = parse_qs(urlparse(href).query).get("u")
+    return target[0] if target else href
+
+
+class HttpScraper:
+    def __init__(self, cookies: list, base_url: str = "https://mbasic.facebook.com", workers: int = 4,
+                 pacing: Pacing = None, selectors: SelectorRegistry = None, max_comments=25, max_images=10,
+                 max_pages: int = None, max_attempts: int = 3, timeout: float = 30, images_folder: str = "./images",
+                 thumbnails_folder: str = "./thumbnails", media_store: media.MediaStore = None,
+                 stale_limit: int = 3):
+        """
+        Browser-free scraper for the basic mobile site. Safe to use for several pages at once from different threads.
+        :param cookies: Cookies of a logged in session (from get_cookies, or SessionCache.load).
+        :param base_url: Where the basic mobile site is, e.g. a local stand-in server for testing (see fixtures.py).
+        :param workers: Number of threads that fetch full stories and download images.
+        :param pacing: Pacing with the rate limiter to keep to. Only its limiter and its "load" delay (between retries)
+        are used.
+        :param selectors: Registry of the selectors, see registry.py.
+        :param max_comments: Maximum numbers of comments to be extracted per post.
+        :param max_images: Maximum of numbers to be scraped per post.
+        :param max_pages: How many pages of the feed to follow at most.
+        :param max_attempts: How often to try fetching a page.
+        :param timeout: Timeout of each request in seconds.
+        :param media_store: Save images and thumbnails to a content addressed store, instead of the folders.
+        :param stale_limit: How many posts in a row may be older than the last run before an incremental scrape stops.
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.base_url = base_url.rstrip("/")
+        self.pacing = pacing or Pacing()
+        self.selectors = selectors or SelectorRegistry()
+        self.max_comments = max_comments
+        self.max_images = max_images
+        self.max_pages = max_pages
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.images_folder = images_folder
+        self.thumbnails_folder = thumbnails_folder
+        self.stale_limit = stale_limit
+        self.fetch_issue = 0
+        self.fetches = 0
+        # Entries without an author or timestamp.
+        self.extraction_issue = 0
+        # The counters are also kept by page, since several pages are scraped at once from the threads of the pools.
+        self._counter_lock = Lock()
+        self._page_counts = {}
+
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = "Mozilla/5.0 (Linux; Android 10) AppleWebKit/537.36 (KHTML, like Gecko)"
+        self.downloader = media.ImageDownloader(cookies=cookies, workers=workers, timeout=timeout,
+                                                session=self.session, store=media_store)
+        # Full stories and images are fetched by separate pools over the same connections.
+        adapter = HTTPAdapter(pool_connections=2 * workers, pool_maxsize=2 * workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.media_store = media_store
+        if not media_store:
+            os.makedirs(images_folder, exist_ok=True)
+            os.makedirs(thumbnails_folder, exist_ok=True)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="story")
+
+    @property
+    def download_issue(self) -> int:
+        return self.downloader.failed
+
+    def errors(self) -> dict:
+        """
+        The error counters, as those of FaceBookDriver, and the pages that could not be fetched.
+        """
+        errors = {counter: getattr(self, counter, 0) for counter in ERROR_COUNTERS}
+        errors["fetch_issue"] = self.fetch_issue
+        errors["extraction_issue"] = self.extraction_issue
+        return errors
+
+    def page_errors(self, page: str) -> dict:
+        """
+        The error counters of one page (as in errors), for when other pages are scraped at the same time.
+        :param page: Link to the page, as given to scrape_page.
+        """
+        with self._counter_lock:
+            counts = Counter(self._page_counts.get(page))
+        return {counter: counts[counter] for counter in self.errors()}
+
+    def _count(self, counter: str, page: str = None):
+        with self._counter_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+            if page:
+                self._page_counts.setdefault(page, Counter())[counter] += 1
+
+    def quit(self):
+        """
+        Finish the downloads and stop the threads. Named like FaceBookDriver.quit, so both can be used alike.
+        """
+        self._pool.shutdown()
+        self.downloader.close()
+        self.selectors.save()
+
+    def url(self, page: str) -> str:
+        """
+        The address of a page on the basic mobile site, e.g. from a link to the desktop site (see scrape.page_url).
+        """
+        if page.startswith(self.base_url):
+            return page
+        parsed = urlparse(page)
+        return self.base_url + parsed.path + (f"?{parsed.query}" if parsed.query else "")
+
+    def fetch(self, url: str, page: str = None):
+        """
+        Fetch and parse a page, with retries.
+        :param page: The facebook page or group this is for, to count the errors of.
+        :return: The root lxml element of the page.
+        """
+        import requests
+
+        for attempt in range(self.max_attempts):
+            self.pacing.throttle()
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+                if "login" in urlparse(response.url).path:
+                    raise SessionExpiredError("Redirected to the login, the cookies are no longer valid.")
+                response.raise_for_status()
+            except requests.RequestException:
+                self._count("fetch_issue", page)
+                if attempt + 1 == self.max_attempts:
+                    raise
+                sleep(self.pacing.backoff(attempt + 1))
+                continue
+            self._count("fetches")
+            return extract.parse_html(response.text)
+
+    def scrape_page(self, page: str, _type: str, chunk_size: int = None, stream: bool = False, checkpoint=None,
+                    incremental: bool = False, mode: str = None):
+        """
+        Scrape a facebook group or page. Takes the same arguments as FaceBookDriver.scrape_page; the chunk size and
+        mode do not apply, since the feed is paged anyway.
+        :param page: Link to the facebook group or page to be scraped.
+        :param _type: Whether the link to be scraped is a group or a page.
+        :param stream: Return a generator that yields each post as soon as it is extracted, instead of a list.
+        :param checkpoint: Checkpoint to record the newest post in. Scrapes are not resumed halfway, since the links
+        to further pages of the feed expire.
+        :param incremental: Stop at the posts collected in the last complete run of the checkpoint.
+        :return: List (or generator) with the contents of the page.
+        """
+        contents = self.iter_page(page=page, _type=_type, checkpoint=checkpoint, incremental=incremental)
+        if stream:
+            return contents
+        return list(contents)
+
+    def iter_page(self, page: str, _type: str, checkpoint=None, incremental: bool = False):
+        """
+        Generator version of scrape_page. Follows the links to further pages of the feed, while the full stories of
+        the posts on each page are fetched in parallel.
+        """
+        since = checkpoint.since if (incremental and checkpoint) else None
+        url, pages, stale = self.url(page), 0, 0
+        with self._counter_lock:
+            self._page_counts[page] = Counter()
+        while url:
+            tree = self.fetch(url, page)
+            entries = self.selectors.find_all(tree, LAYOUT, "entries")
+            scrape_entry = partial(self._scrape_entry, _type=_type, page=page, url=url)
+            # Posts are handed on in order as their full stories and images come in.
+            posts = (content for content in self._pool.map(scrape_entry, entries) if content is not None)
+            for content in media.resolve_in_order(posts):
+                # Failed downloads resolve to None; the total of all pages is kept by the downloader.
+                failed = sum(key.startswith("image_") and value is None for key, value in content.items())
+                if failed:
+                    with self._counter_lock:
+                        self._page_counts[page]["download_issue"] += failed
+                if since and content['timestamp'] <= since:
+                    stale += 1
+                    if stale >= self.stale_limit:
+                        url = None
+                        break
+                    continue
+                stale = 0
+                if checkpoint:
+                    checkpoint.update(content['timestamp'])
+                yield content
+            else:
+                pages += 1
+                more = self.selectors.find(tree, LAYOUT, "more_posts")
+                url = urljoin(url, more) if more and not (self.max_pages and pages >= self.max_pages) else None
+
+        if checkpoint:
+            checkpoint.complete()
+
+    def _scrape_entry(self, entry, _type: str, page: str, url: str):
+        # An entry that cannot be extracted is counted and skipped, instead of ending the whole page.
+        try:
+            return self.scrape_entry(entry, _type=_type, page=page, url=url)
+        except extract.ExtractionError:
+            self._count("extraction_issue", page)
+            return None
+
+    def scrape_entry(self, entry, _type: str, page: str, url: str) -> dict:
+        """
+        Extract the contents of one post. The full story page is only fetched if the post has more text, images or
+        comments than the feed shows.
+        :param entry: lxml element of the post in the feed.
+        :param _type: Whether the post is from a group or a page.
+        :param page: Link to the page the post is from, for its identity.
+        :param url: Address of the feed page, to resolve relative links against.
+        :return: Dictionary with the contents of the post, with the same fields as FaceBookDriver.scrape_entry.
+        """
+        content = {}
+        text = extract.element_text(entry)
+        content['unavailable'] = bool("This content isn't available right now" in text)
+
+        author = self.selectors.find(entry, LAYOUT, "author")
+        timestamp = publish_time(entry)
+        if author is None or timestamp is None:
+            raise extract.ExtractionError("Entry has no author or timestamp.")
+        content['author'] = extract.element_text(author)
+        content['timestamp'] = timestamp
+        # The same identity as the browser gives the post, see extract.post_identity.
+        content['post_id'] = extract.post_identity(None, content['author'], timestamp, page,
+                                                   number=top_level_post_id(entry))
+
+        comments = []
+        story = self.selectors.find(entry, LAYOUT, "full_story")
+        truncated = re.search(r"\.\.\. More\b|(^|\s)\+\d+\b|\b[1-9]\d* Comments?\b", text)
+        if story and truncated:
+            story_url = urljoin(url, story)
+            story_tree = self.fetch(story_url, page)
+            entry = self.selectors.find(story_tree, LAYOUT, "entries")
+            entry = entry if entry is not None else story_tree
+            comments = self.scrape_comments(story_tree, story_url, page)
+        content['comments'] = comments[: self.max_comments]
+        content['text'] = extract.element_text(self.selectors.find(entry, LAYOUT, "text"))
+        content['link'] = unwrap_link(self.selectors.find(entry, LAYOUT, "link")) or ""
+
+        images_stem = media.file_stem(self.images_folder, content['author'], timestamp)
+        thumbnail_stem = media.file_stem(self.thumbnails_folder, content['author'], timestamp)
+        images = self.selectors.find_all(entry, LAYOUT, "images")
+        for position, src in enumerate(images[: self.max_images]):
+            content[f'image_{position}'] = self.save_image(urljoin(url, src), f"{images_stem}_{position}",
+                                                           post_id=content['post_id'], position=position)
+        if not images:
+            thumbnail = self.selectors.find(entry, LAYOUT, "thumbnail")
+            if thumbnail:
+                content['image_0'] = self.save_image(urljoin(url, thumbnail), thumbnail_stem,
+                                                     post_id=content['post_id'])
+        return content
+
+    def save_image(self, url: str, stem: str, post_id: str = None, position: int = 0):
+        """
+        Download an image in the background, as FaceBookDriver.save_image_url does.
+        :return: A future of the file path (None if the download fails, see media.resolve).
+        """
+        if self.media_store:
+            return self.downloader.submit(url, post_id=post_id, position=position)
+        return self.downloader.submit(url, stem + media.extension(url))
+
+    def scrape_comments(self, tree, url: str, page: str = None) -> list:
+        """
+        Collect the comments of a full story, following the "View more comments" pages, and the replies of each.
+        :param tree: lxml element of the full story page.
+        :param url: Its address.
+        :param page: The facebook page or group, to count the errors of.
+        :return: List of comment dictionaries (see extract.comment_record), replies following their comment.
+        """
+        records = []
+        while True:
+            for comment in self.selectors.find_all(tree, LAYOUT, "comments"):
+                records.append(self.comment(comment, depth=0, parent=None))
+                position = len(records) - 1
+                replies = self.selectors.find(comment, LAYOUT, "replies")
+                if replies:
+                    reply_tree = self.fetch(urljoin(url, replies), page)
+                    records += [self.comment(reply, depth=1, parent=position)
+                                for reply in self.selectors.find_all(reply_tree, LAYOUT, "comments")]
+            more = self.selectors.find(tree, LAYOUT, "more_comments")
+            if not more or (self.max_comments is not None and len(records) >= self.max_comments):
+                return records
+            url = urljoin(url, more)
+            tree = self.fetch(url, page)
+
+    def comment(self, element, depth: int, parent):
+        author = self.selectors.find(element, LAYOUT, "comment_author")
+        body = self.selectors.find(element, LAYOUT, "comment_body")
+        likes = self.selectors.find(element, LAYOUT, "comment_likes")
+        comment_id = element.get("id")
+        return extract.comment_record({'comment_id': comment_id if comment_id and comment_id.isdigit() else None,
+                                       'author': extract.element_text(author) if author is not None else None,
+                                       'text': extract.element_text(body) if body is not None else None,
+                                       'full_text': extract.element_text(element),
+                                       'likes': extract.element_text(likes) if likes is not None else None,
+                                       'utime': self.selectors.find(element, LAYOUT, "comment_time"),
+                                       'depth': depth,
+                                       'parent': parent})
+
+
+def _scrape_to_file(scraper: HttpScraper, page: dict, destination: str, checkpoints: str, store: str,
+                    formats: list) -> dict:
+    from scrape import page_url, scrape_to_file
+    from store import ResultStore
+
+    # The store's connection cannot be shared between threads, so each page has its own.
+    store = ResultStore(store) if store else None
+    try:
+        file_name, _ = scrape_to_file(scraper, page=page, destination=destination, checkpoints=checkpoints,
+                                      formats=formats, store=store)
+        # The differences of the scraper's counters would include the other pages scraped meanwhile.
+        return {"name": page['name'], "file": file_name, "errors": scraper.page_errors(page_url(page)),
+                "new_posts": store.added if store else None}
+    finally:
+        if store:
+            store.close()
+
+
+async def scrape_pages(scraper: HttpScraper, pages: list, concurrency: int = 8, destination: str = "results",
+                       checkpoints: str = "checkpoints", store: str = None, formats: list = ("csv", "xlsx")) -> list:
+    """
+    Scrape several pages at once with one scraper, and write the results of each as scrape_to_file does.
+    :param scraper: The HttpScraper.
+    :param pages: Entries of parameters.pages.
+    :param concurrency: How many pages to scrape at the same time.
+    :param store: SQLite file of a ResultStore to also write the posts to.
+    :return: Summary of each page.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def scrape(page):
+        async with semaphore:
+            try:
+                return await asyncio.to_thread(_scrape_to_file, scraper, page, destination, checkpoints, store,
+                                               formats)
+            except Exception as e:
+                return {"name": page['name'], "failed": f"{type(e).__name__}: {e}"}
+
+    return await asyncio.gather(*(scrape(page) for page in pages))
+
+
+def main():
+    import argparse
+    import parameters
+    from acct import username, password
+    from parallel import RateLimiter, login
+
+    parser = argparse.ArgumentParser(description="Scrape all pages in parameters.pages without a browser.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Pages scraped at the same time.")
+    parser.add_argument("--workers", type=int, default=4, help="Threads fetching full stories and images.")
+    parser.add_argument("--rate", type=float, default=1, help="Maximum requests per second.")
+    parser.add_argument("--base-url", default="https://mbasic.facebook.com")
+    args = parser.parse_args()
+
+    # The login itself still needs the browser (once, then the session is cached).
+    scraper = HttpScraper(cookies=login(username, password), base_url=args.base_url, workers=args.workers,
+                          pacing=Pacing(limiter=RateLimiter(args.rate)),
+                          selectors=SelectorRegistry(parameters.selectors, parameters.selector_stats))
+    try:
+        summaries = asyncio.run(scrape_pages(scraper, parameters.pages, concurrency=args.concurrency,
+                                             destination=parameters.destination, checkpoints=parameters.checkpoints,
+                                             store=parameters.store, formats=parameters.export_formats))
+    finally:
+        scraper.quit()
+
+    for page in summaries:
+        status = page.get('failed') or ", ".join(f"{counter}: {count}" for counter, count in page['errors'].items())
+        print(f"{page['name']}: {status}")
+    print(f"{scraper.fetches} pages fetched.")
+
+
+if __name__ == "__main__":
+    main()
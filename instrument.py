@@ -0,0 +1,284 @@
+"""
+Instrumentation of a FaceBookDriver: counts and times every webdriver command by type, times the phases of a scrape
+(loading, scrolling, and the steps of extracting each post) overall and per post, and optionally samples the python
+stack to show where the rest of the time goes. Reports are written as JSON and in the Prometheus text format.
+"""
+
+import json
+import os
+import sys
+import threading
+from collections import Counter, defaultdict
+from time import perf_counter, time
+
+# Methods of FaceBookDriver that are timed. Phases are nested, e.g. show_all_comments runs within scrape_entry, so
+# their times are inclusive. Only regular methods can be timed, not generators like easy_scrape.
+PHASES = ["load_page", "load_entries", "scroll_to_bottom", "scroll_and_wait", "expand_entries", "snapshot_entries",
+          "scrape_entry", "scrape_entry_snapshot", "scrape_comments", "show_all_comments", "scrape_text", "scrape_link",
+          "scrape_media", "scrape_images", "scrape_thumbnail", "save_image"]
+# Phases that extract one post each. Everything that happens within them is attributed to that post.
+POST_PHASES = {"scrape_entry", "scrape_entry_snapshot"}
+# Methods of Pacing that are timed, i.e. the time spent sleeping on purpose.
+PACING = ["pause", "throttle"]
+
+
+def _percentile(values: list, q: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _escape(label: str) -> str:
+    return str(label).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = 0.005, thread_id: int = None):
+        """
+        Samples the stack of a thread in regular intervals, from a background thread. Slow, but only adds overhead to
+        the sampling thread, so it can be left running during a whole scrape.
+        :param interval: Seconds between samples.
+        :param thread_id: Thread to sample, by default the one that creates the profiler.
+        """
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                # Leave out the timing wrappers, which would otherwise show up between every two phases.
+                if code.co_filename != __file__:
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def top(self, n: int = 20) -> list:
+        """
+        The functions the sampled thread spent most time in (at the top of the stack), with their share of samples.
+        """
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return [(function, round(count / self.samples, 4)) for function, count in leaves.most_common(n)]
+
+    def write_folded(self, path: str):
+        """
+        Write the samples as folded stacks, the input format of flamegraph.pl and speedscope.
+        """
+        with open(path, "w") as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
+
+
+class Instrumentation:
+    def __init__(self, phases: list = PHASES, profile: bool = False, profile_interval: float = 0.005,
+                 keep_posts: bool = True):
+        """
+        Timing hooks for a FaceBookDriver. Attach it to a driver before the scrape and write a report afterwards (or
+        in between, e.g. every few hundred posts).
+        :param phases: Methods of the driver to time.
+        :param profile: Also run a sampling profiler on the scraping thread.
+        :param profile_interval: Seconds between samples of the profiler.
+        :param keep_posts: Keep the timings of every single post for the report, not only the totals.
+        """
+        self.phases = phases
+        self.keep_posts = keep_posts
+        self.profiler = SamplingProfiler(interval=profile_interval) if profile else None
+
+        self.started = None
+        self.command_calls = Counter()
+        self.command_seconds = defaultdict(float)
+        self.phase_calls = Counter()
+        self.phase_seconds = defaultdict(float)
+        # Commands sent while a phase was the innermost one running.
+        self.phase_commands = Counter()
+        self.posts = []
+        self.post_count = 0
+        self._stack = []
+        self._post = None
+        self._driver = None
+        self._wrapped = []
+
+    def attach(self, driver):
+        """
+        Start timing the commands and phases of a driver, by wrapping its methods on the instance.
+        """
+        self._driver = driver
+        self._wrap(driver, "execute", self._timed_command(driver.execute))
+        for name in self.phases:
+            self._wrap(driver, name, self._timed_phase(name, getattr(driver, name)))
+        for name in PACING:
+            self._wrap(driver.pacing, name, self._timed_phase(name, getattr(driver.pacing, name)))
+        self.started = time()
+        if self.profiler:
+            self.profiler.start()
+        return self
+
+    def detach(self):
+        """
+        Stop timing and restore the methods of the driver.
+        """
+        if self.profiler:
+            self.profiler.stop()
+        for obj, name in self._wrapped:
+            delattr(obj, name)
+        self._wrapped = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.detach()
+
+    def _wrap(self, obj, name: str, method):
+        setattr(obj, name, method)
+        self._wrapped.append((obj, name))
+
+    def _timed_command(self, execute):
+        def timed(driver_command, params=None):
+            start = perf_counter()
+            try:
+                return execute(driver_command, params)
+            finally:
+                seconds = perf_counter() - start
+                self.command_calls[driver_command] += 1
+                self.command_seconds[driver_command] += seconds
+                if self._stack:
+                    self.phase_commands[self._stack[-1]] += 1
+                if self._post is not None:
+                    self._post["commands"] += 1
+                    self._post["command_seconds"] += seconds
+        return timed
+
+    def _timed_phase(self, name: str, method):
+        def timed(*args, **kwargs):
+            post = name in POST_PHASES and self._post is None
+            if post:
+                self._post = {"commands": 0, "command_seconds": 0.0, "phases": defaultdict(float)}
+            self._stack.append(name)
+            start = perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                seconds = perf_counter() - start
+                self._stack.pop()
+                self.phase_calls[name] += 1
+                self.phase_seconds[name] += seconds
+                if self._post is not None:
+                    self._post["phases"][name] += seconds
+                if post:
+                    self._end_post(seconds)
+        return timed
+
+    def _end_post(self, seconds: float):
+        record, self._post = self._post, None
+        self.post_count += 1
+        if self.keep_posts:
+            self.posts.append({"seconds": round(seconds, 4),
+                               "commands": record["commands"],
+                               "command_seconds": round(record["command_seconds"], 4),
+                               "phases": {name: round(value, 4) for name, value in record["phases"].items()}})
+
+    def report(self) -> dict:
+        """
+        Summary of the timings so far.
+        :return: Dictionary with the wall time, the commands and phases by total time, and statistics per post.
+        """
+        wall = time() - self.started if self.started else 0
+        report = {"started": self.started,
+                  "seconds": round(wall, 2),
+                  "posts": self.post_count,
+                  "commands": {command: {"calls": self.command_calls[command],
+                                         "seconds": round(seconds, 3),
+                                         "mean_ms": round(1000 * seconds / self.command_calls[command], 2)}
+                               for command, seconds in sorted(self.command_seconds.items(), key=lambda item: -item[1])},
+                  "phases": {name: {"calls": self.phase_calls[name],
+                                    "seconds": round(seconds, 3),
+                                    "share": round(seconds / wall, 4) if wall else None,
+                                    "commands": self.phase_commands[name]}
+                             for name, seconds in sorted(self.phase_seconds.items(), key=lambda item: -item[1])}}
+        if self._driver is not None:
+            report["errors"] = self._driver.errors()
+        if self.posts:
+            seconds = [post["seconds"] for post in self.posts]
+            commands = [post["commands"] for post in self.posts]
+            report["per_post"] = {"seconds": {"mean": round(sum(seconds) / len(seconds), 3),
+                                              "p50": _percentile(seconds, 0.5),
+                                              "p95": _percentile(seconds, 0.95),
+                                              "max": max(seconds)},
+                                  "commands": {"mean": round(sum(commands) / len(commands), 1),
+                                               "p50": _percentile(commands, 0.5),
+                                               "p95": _percentile(commands, 0.95),
+                                               "max": max(commands)}}
+        if self.profiler:
+            report["profile"] = {"samples": self.profiler.samples, "top": self.profiler.top()}
+        return report
+
+    def prometheus(self, prefix: str = "scraper") -> str:
+        """
+        The totals in the Prometheus text exposition format, e.g. for the textfile collector of node_exporter.
+        """
+        metrics = [("commands_total", "counter", "Webdriver commands sent, by command.", "command", self.command_calls),
+                   ("command_seconds_total", "counter", "Seconds spent in webdriver commands, by command.", "command",
+                    self.command_seconds),
+                   ("phase_calls_total", "counter", "Calls of each scrape phase.", "phase", self.phase_calls),
+                   ("phase_seconds_total", "counter", "Seconds spent in each scrape phase (nested phases overlap).",
+                    "phase", self.phase_seconds),
+                   ("phase_commands_total", "counter", "Webdriver commands sent directly within each phase.", "phase",
+                    self.phase_commands)]
+        lines = []
+        for name, kind, help_text, label, values in metrics:
+            lines += [f"# HELP {prefix}_{name} {help_text}", f"# TYPE {prefix}_{name} {kind}"]
+            lines += [f'{prefix}_{name}{{{label}="{_escape(key)}"}} {value:g}' for key, value in sorted(values.items())]
+
+        lines += [f"# HELP {prefix}_posts_total Posts extracted.", f"# TYPE {prefix}_posts_total counter",
+                  f"{prefix}_posts_total {self.post_count}"]
+        if self._driver is not None:
+            lines += [f"# HELP {prefix}_errors_total Error counters of the driver.",
+                      f"# TYPE {prefix}_errors_total counter"]
+            lines += [f'{prefix}_errors_total{{counter="{counter}"}} {count}'
+                      for counter, count in self._driver.errors().items()]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        """
+        Write the report to path + ".json" and path + ".prom", and the profile to path + ".folded" if profiling.
+        Each file is replaced atomically, so it can be read while the scrape is still running.
+        :param path: File name without extension.
+        """
+        report = self.report()
+        if self.keep_posts:
+            report["post_timings"] = self.posts
+        _write_atomic(path + ".json", json.dumps(report, indent=2))
+        _write_atomic(path + ".prom", self.prometheus())
+        if self.profiler:
+            self.profiler.write_folded(path + ".folded")
+
+
+def _write_atomic(path: str, text: str):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as file:
+        file.write(text)
+    os.replace(tmp, path)
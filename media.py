@@ -0,0 +1,309 @@
+"""
+Saving the images of posts. Instead of taking a screenshot of each image element on the driver thread, the original
+image files are downloaded in the background while the driver moves on to the next post.
+"""
+
+import base64
+import hashlib
+import os
+import sqlite3
+import tempfile
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from threading import BoundedSemaphore, Lock
+from urllib.parse import urlparse
+
+
+def extension(url: str, default: str = ".jpg") -> str:
+    """
+    File extension of an image URL (or data URL).
+    """
+    if url.startswith("data:"):
+        return "." + url[len("data:image/"):].split(";")[0].split(",")[0].replace("jpeg", "jpg")
+    return os.path.splitext(urlparse(url).path)[1] or default
+
+
+def file_stem(folder: str, author: str, timestamp: datetime) -> str:
+    """
+    File path of an image of a post, without the extension: the author (with underscores for spaces) and the time.
+    The same for every way an image is saved.
+    """
+    return f"{folder}/{author.replace(' ', '_')}_{timestamp.isoformat()}"
+
+
+def write_atomic(path: str, data: bytes):
+    """
+    Write a file under a temporary name first, so there are no half written files if the scrape is aborted. The
+    temporary file is unique, as several downloader threads may write the same image at once.
+    """
+    fd, tmp = tempfile.mkstemp(suffix=".part", dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def difference_hash(data: bytes):
+    """
+    64 bit perceptual (difference) hash of an image, as a hex string. Similar images have hashes that differ in few
+    bits. Requires Pillow; returns None without it.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    from io import BytesIO
+
+    image = Image.open(BytesIO(data)).convert("L").resize((9, 8))
+    pixels = list(image.getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return f"{bits:016x}"
+
+
+def reencode(data: bytes, ext: str):
+    """
+    Re-encode screenshots (PNG) as lossless WebP, which takes a fraction of the space. Requires Pillow; returns the
+    data unchanged without it.
+    :return: The data and its file extension.
+    """
+    if ext != ".png":
+        return data, ext
+    try:
+        from PIL import Image
+    except ImportError:
+        return data, ext
+    from io import BytesIO
+
+    output = BytesIO()
+    Image.open(BytesIO(data)).save(output, format="WEBP", lossless=True, quality=100, method=6)
+    if output.tell() < len(data):
+        return output.getvalue(), ".webp"
+    return data, ext
+
+
+class MediaStore:
+    def __init__(self, root: str = "media", near_duplicates: bool = False, max_distance: int = 6,
+                 optimize: bool = True):
+        """
+        Content addressed store for images and thumbnails. Each file is saved once under the SHA-256 of its content,
+        in subfolders by the first characters of the hash, no matter how many posts it appears in. An SQLite index
+        maps posts to the hashes of their images.
+        :param root: Folder of the store.
+        :param near_duplicates: Flag images that look like an image already in the store (requires Pillow).
+        :param max_distance: How many bits the perceptual hashes of near duplicates may differ in.
+        :param optimize: Re-encode screenshots as lossless WebP (requires Pillow).
+        """
+        self.root = root
+        self.near_duplicates = near_duplicates
+        self.max_distance = max_distance
+        self.optimize = optimize
+        os.makedirs(root, exist_ok=True)
+
+        # Downloads are saved from several threads.
+        self._lock = Lock()
+        self._index = sqlite3.connect(os.path.join(root, "index.sqlite"), check_same_thread=False)
+        self._index.executescript("""
+            CREATE TABLE IF NOT EXISTS media (hash TEXT PRIMARY KEY, path TEXT, size INTEGER, phash TEXT,
+                                              duplicate_of TEXT, created TEXT);
+            CREATE TABLE IF NOT EXISTS post_media (post_id TEXT, position INTEGER, hash TEXT,
+                                                   PRIMARY KEY (post_id, position));
+            CREATE INDEX IF NOT EXISTS post_media_hash ON post_media (hash);
+        """)
+
+    def path(self, digest: str, ext: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest + ext)
+
+    def put(self, data: bytes, ext: str, post_id: str = None, position: int = 0) -> str:
+        """
+        Save an image, unless the same image is already in the store.
+        :param data: The image file.
+        :param ext: Its file extension.
+        :param post_id: Post the image belongs to.
+        :param position: Position of the image within the post.
+        :return: Path of the image in the store.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            row = self._index.execute("SELECT path FROM media WHERE hash = ?", (digest,)).fetchone()
+        if row:
+            path = row[0]
+        else:
+            original = data
+            if self.optimize:
+                data, ext = reencode(data, ext)
+            path = self.path(digest, ext)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_atomic(path, data)
+
+            phash = difference_hash(original) if self.near_duplicates else None
+            with self._lock:
+                duplicate_of = self._similar(phash, digest) if phash else None
+                self._index.execute("INSERT OR IGNORE INTO media VALUES (?, ?, ?, ?, ?, ?)",
+                                    (digest, path, len(data), phash, duplicate_of, datetime.now().isoformat()))
+                self._index.commit()
+
+        if post_id:
+            with self._lock:
+                self._index.execute("INSERT OR REPLACE INTO post_media VALUES (?, ?, ?)", (post_id, position, digest))
+                self._index.commit()
+        return path
+
+    def _similar(self, phash: str, digest: str):
+        bits = int(phash, 16)
+        for other, other_phash in self._index.execute("SELECT hash, phash FROM media WHERE phash IS NOT NULL"):
+            if other != digest and bin(bits ^ int(other_phash, 16)).count("1") <= self.max_distance:
+                return other
+        return None
+
+    def post_media(self, post_id: str) -> list:
+        """
+        Paths of the images of a post, in order.
+        """
+        with self._lock:
+            return [path for path, in self._index.execute(
+                "SELECT m.path FROM post_media p JOIN media m ON p.hash = m.hash WHERE p.post_id = ? "
+                "ORDER BY p.position", (post_id,))]
+
+    def near_duplicate_posts(self):
+        """
+        Posts with images that were flagged as near duplicates of an earlier image, e.g. a repost of a photo.
+        :return: List of (post_id, hash, duplicate_of).
+        """
+        with self._lock:
+            return self._index.execute(
+                "SELECT p.post_id, m.hash, m.duplicate_of FROM post_media p JOIN media m ON p.hash = m.hash "
+                "WHERE m.duplicate_of IS NOT NULL").fetchall()
+
+    def close(self):
+        self._index.close()
+
+
+class ImageDownloader:
+    def __init__(self, cookies: list = None, workers: int = 4, max_pending: int = 32, timeout: float = 30,
+                 session=None, store: MediaStore = None):
+        """
+        Downloads images with a pool of background threads sharing one pooled HTTP session.
+        :param cookies: Cookies of the logged in browser session (from get_cookies).
+        :param workers: Number of download threads, and of pooled connections.
+        :param max_pending: How many downloads may be queued before submit blocks.
+        :param timeout: Timeout of each request in seconds.
+        :param session: requests.Session to use instead of a new one.
+        :param store: Save the images to a MediaStore, instead of under the given file names.
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.session = session or requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        for cookie in cookies or []:
+            self.session.cookies.set(cookie['name'], cookie['value'], domain=cookie.get('domain'),
+                                     path=cookie.get('path', '/'))
+
+        self.timeout = timeout
+        self.store = store
+        self.downloaded = 0
+        self.failed = 0
+        self._counter_lock = Lock()
+        self._slots = BoundedSemaphore(max_pending)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="download")
+
+    def submit(self, url: str, filename: str = None, post_id: str = None, position: int = 0):
+        """
+        Queue an image for download. Blocks while max_pending downloads are already queued.
+        :param url: URL (or data URL) of the image.
+        :param filename: Where to save it, if there is no store.
+        :param post_id: Post the image belongs to, for the store.
+        :param position: Position of the image within the post, for the store.
+        :return: A future of the file name.
+        """
+        self._slots.acquire()
+        future = self._executor.submit(self._download, url, filename, post_id, position)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _download(self, url: str, filename: str, post_id: str, position: int) -> str:
+        try:
+            if url.startswith("data:"):
+                data = base64.b64decode(url.split(",", 1)[1])
+            else:
+                response = self.session.get(url, timeout=self.timeout)
+                response.raise_for_status()
+                data = response.content
+
+            if self.store:
+                filename = self.store.put(data, extension(url), post_id=post_id, position=position)
+            else:
+                write_atomic(filename, data)
+        except Exception:
+            with self._counter_lock:
+                self.failed += 1
+            raise
+
+        with self._counter_lock:
+            self.downloaded += 1
+        return filename
+
+    def close(self, wait: bool = True):
+        """
+        Stop the download threads, by default after all queued downloads are done.
+        """
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def media_ready(content: dict) -> bool:
+    """
+    Whether all images of a post have finished downloading.
+    """
+    return all(value.done() for value in content.values() if isinstance(value, Future))
+
+
+def resolve(content: dict, pump=None) -> dict:
+    """
+    Replace the pending downloads in the contents of a post with the file paths (or None where the download failed).
+    A pending future of several entries (e.g. the image_N of a gallery going through in a tab, see gallery.py) is
+    replaced with those entries.
+    :param pump: Called while a future is not done yet, to get it along, until it returns False.
+    """
+    for key, value in list(content.items()):
+        if isinstance(value, Future):
+            while pump and not value.done() and pump():
+                pass
+            result = value.result() if not value.exception() else None
+            if isinstance(result, dict):
+                del content[key]
+                content.update(resolve(result, pump))
+            else:
+                content[key] = result
+    return content
+
+
+def resolve_in_order(posts, lookahead: int = 5, pump=None):
+    """
+    Yield posts in order as their images finish downloading, while up to `lookahead` later posts are being scraped.
+    :param posts: Iterable of post dictionaries, possibly with pending downloads.
+    :param pump: See resolve.
+    """
+    pending = deque()
+    for post in posts:
+        pending.append(post)
+        while pending and (len(pending) > lookahead or media_ready(pending[0])):
+            yield resolve(pending.popleft(), pump)
+    while pending:
+        yield resolve(pending.popleft(), pump)
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Scrape all of parameters.pages at once, with a pool of FaceBookDriver workers in separate processes. The login is done
+once and its cookies are shared with the workers, and all workers together stay below a global request rate.
+"""
+
+import json
+import multiprocessing
+import os
+import queue
+from datetime import datetime
+from time import sleep, time
+
+from selenium.common.exceptions import WebDriverException
+
+import media
+from scrape import FaceBookDriver, Pacing, SessionCache, ERROR_COUNTERS, chrome_options, scrape_to_file
+from archive import CaptureArchive
+from registry import SelectorRegistry
+from store import ResultStore
+
+
+class RateLimiter:
+    def __init__(self, rate: float):
+        """
+        Spaces out requests across processes, so that all of them together make at most `rate` requests per second.
+        Has to be created before the worker processes are started.
+        :param rate: Requests per second.
+        """
+        self.interval = 1 / rate
+        self._lock = multiprocessing.Lock()
+        self._next = multiprocessing.Value('d', 0.0, lock=False)
+
+    def acquire(self):
+        """
+        Wait until the next request is allowed.
+        """
+        with self._lock:
+            now = time()
+            wait = self._next.value - now
+            self._next.value = max(now, self._next.value) + self.interval
+        if wait > 0:
+            sleep(wait)
+
+
+def _start_driver(cookies: list, limiter: RateLimiter, driver_kwargs: dict) -> FaceBookDriver:
+    import parameters
+
+    # The same settings as scrape.main, unless given otherwise.
+    driver_kwargs = dict({"download_images": True,
+                          "media_store": media.MediaStore(parameters.media) if parameters.media else None,
+                          "gallery_tabs": parameters.gallery_tabs,
+                          "blocked": parameters.blocked if parameters.lean else None,
+                          "capture": CaptureArchive(parameters.archive) if parameters.archive else None},
+                         **driver_kwargs)
+    return FaceBookDriver(executable_path=parameters.chrome_location,
+                          chrome_options=chrome_options(lean=parameters.lean),
+                          username=None, password=None, cookies=cookies, pacing=Pacing(limiter=limiter),
+                          selectors=SelectorRegistry(parameters.selectors, parameters.selector_stats), **driver_kwargs)
+
+
+def _worker(tasks, results, cookies: list, limiter: RateLimiter, driver_kwargs: dict, destination: str,
+            checkpoints: str, store_path: str = None):
+    """
+    Scrape pages from the task queue until it hands out None. Each worker keeps one chrome instance for all its pages,
+    and its own connection to the result store.
+    """
+    driver = None
+    store = None
+    while True:
+        page = tasks.get()
+        if page is None:
+            break
+
+        start = time()
+        summary = {"name": page['name'], "id": page['id']}
+        try:
+            if store is None and store_path:
+                store = ResultStore(store_path)
+            if driver is None:
+                driver = _start_driver(cookies, limiter, driver_kwargs)
+            added = store.added if store else 0
+            summary['file'], summary['errors'] = scrape_to_file(driver, page=page, destination=destination,
+                                                                checkpoints=checkpoints, store=store)
+            if store:
+                summary['new_posts'] = store.added - added
+        except Exception as e:
+            summary['failed'] = f"{type(e).__name__}: {e}"
+            # A broken browser session is replaced for the next page.
+            if isinstance(e, WebDriverException) and driver is not None:
+                try:
+                    driver.quit()
+                except WebDriverException:
+                    pass
+                driver = None
+        summary['seconds'] = round(time() - start, 1)
+        results.put(summary)
+
+    if driver is not None:
+        driver.quit()
+    if store:
+        store.close()
+
+
+def login(username: str, password: str) -> list:
+    """
+    Log in once (or restore the cached session) and return the cookies of the session, for the workers to share.
+    """
+    import parameters
+
+    session_cache = SessionCache(parameters.session)
+    cookies = session_cache.load()
+    if cookies:
+        return cookies
+
+    driver = FaceBookDriver(executable_path=parameters.chrome_location, chrome_options=chrome_options(),
+                            username=username, password=password, session_cache=session_cache)
+    try:
+        return driver.get_cookies()
+    finally:
+        driver.quit()
+
+
+def _collect(results, processes: list, pages: list, poll: float = 5) -> list:
+    """
+    The summaries of the pages from the result queue, as the workers finish them. If all workers are gone (e.g. a
+    chrome crash took one down, or it was killed for running out of memory) before every page came back, the missing
+    pages are reported as failed, instead of waiting for them forever.
+    """
+    summaries = []
+    while len(summaries) < len(pages):
+        try:
+            summaries.append(results.get(timeout=poll))
+            continue
+        except queue.Empty:
+            pass
+        if any(process.is_alive() for process in processes):
+            continue
+        # What the workers put in the queue before they exited is there by now.
+        try:
+            while len(summaries) < len(pages):
+                summaries.append(results.get(timeout=1))
+        except queue.Empty:
+            pass
+        codes = sorted({process.exitcode for process in processes if process.exitcode})
+        done = {summary['id'] for summary in summaries}
+        summaries += [{"name": page['name'], "id": page['id'], "seconds": 0.0,
+                       "failed": f"The worker process died (exit codes {codes})."}
+                      for page in pages if page['id'] not in done]
+    return summaries
+
+
+def scrape_pages(pages: list, cookies: list, workers: int = 2, rate: float = 1, destination: str = "results",
+                 checkpoints: str = "checkpoints", store: str = None, **driver_kwargs) -> dict:
+    """
+    Scrape a list of pages with several workers, each with its own headless chrome. The results of each page are
+    written to the destination folder as with main(), together with a summary of the run.
+    :param pages: Entries of parameters.pages.
+    :param cookies: Cookies of a logged in session, see login.
+    :param workers: Number of worker processes.
+    :param rate: Maximum number of requests per second, across all workers.
+    :param destination: Folder to write the results and the summary to.
+    :param checkpoints: Folder to keep the checkpoints in.
+    :param store: SQLite file of a ResultStore to also write the posts to.
+    :param driver_kwargs: Further arguments to FaceBookDriver.
+    :return: The run summary.
+    """
+    limiter = RateLimiter(rate)
+    tasks = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    for page in pages:
+        tasks.put(page)
+
+    workers = min(workers, len(pages))
+    processes = []
+    for _ in range(workers):
+        tasks.put(None)
+        process = multiprocessing.Process(target=_worker, args=(tasks, results, cookies, limiter, driver_kwargs,
+                                                                destination, checkpoints, store))
+        process.start()
+        processes.append(process)
+
+    start = time()
+    summaries = _collect(results, processes, pages)
+    for process in processes:
+        process.join()
+
+    summary = {"started": datetime.fromtimestamp(start).isoformat(),
+               "seconds": round(time() - start, 1),
+               "workers": workers,
+               "pages": summaries,
+               "errors": {counter: sum(page.get('errors', {}).get(counter, 0) for page in summaries)
+                          for counter in ERROR_COUNTERS},
+               "new_posts": sum(page.get('new_posts', 0) for page in summaries),
+               "failed": [page['name'] for page in summaries if 'failed' in page]}
+
+    os.makedirs(destination, exist_ok=True)
+    with open(f"{destination}/run_{datetime.fromtimestamp(start).strftime('%Y-%m-%dT%H-%M-%S')}.json", "w") as file:
+        json.dump(summary, file, indent=2)
+
+    return summary
+
+
+def main():
+    import argparse
+    import parameters
+    from acct import username, password
+
+    parser = argparse.ArgumentParser(description="Scrape all pages in parameters.pages in parallel.")
+    parser.add_argument("--workers", type=int, default=2, help="Number of chrome instances.")
+    parser.add_argument("--rate", type=float, default=1, help="Maximum requests per second across all workers.")
+    args = parser.parse_args()
+
+    summary = scrape_pages(parameters.pages, cookies=login(username, password), workers=args.workers,
+                           rate=args.rate, destination=parameters.destination, checkpoints=parameters.checkpoints,
+                           store=parameters.store)
+
+    for page in summary['pages']:
+        status = page.get('failed') or ", ".join(f"{counter}: {count}" for counter, count in page['errors'].items())
+        print(f"{page['name']} ({page['seconds']}s): {status}")
+    print(f"Done in {summary['seconds']}s, {summary['new_posts']} new posts.")
+
+
+if __name__ == "__main__":
+    main()
@@ -15,4 +15,29 @@ pages = [{"name": "Keepers of the Callan", "type": "page", "id": "keepersoftheca
          {"name": "Callan River Wildlife Group", "type": "group", "id": "368961080430162"},
          {"name": "Friends of the Callan River", "type": "group", "id": "1896044603829394"}]
 
-destination = "results"
\ No newline at end of file
+destination = "results"
+checkpoints = "checkpoints"
+session = "session.json"
+media = "media"
+# Outputs derived from the Parquet export of the results, "csv" and/or "xlsx".
+export_formats = ["csv", "xlsx"]
+# SQLite store of the posts of all pages and runs.
+store = "results/posts.sqlite"
+# Selector chains, and the order and statistics the scraper learned for them (see registry.py).
+selectors = "selectors.json"
+selector_stats = "selector_stats.json"
+# Sample the python stack while scraping, to see where the time goes beyond the timed phases (see instrument.py).
+profile = False
+# Go through the galleries of this many posts at a time, each in a tab of its own (see gallery.py). 0 for one at a time
+# in the feed tab.
+gallery_tabs = 3
+# Run chrome without videos, web fonts and trackers, and without images where they are downloaded anyway (see
+# scrape.BLOCKS). Entries of blocked are kinds of BLOCKS or URL patterns.
+lean = True
+blocked = ["video", "font", "image", "tracking"]
+# Folder to archive the HTML of every scraped chunk in, to extract it again later with reextract.py. None to not
+# archive.
+archive = None
+# The job queue of the scheduler, and the socket it takes commands on (see daemon.py).
+scheduler = "scheduler.sqlite"
+scheduler_socket = "scheduler.sock"
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Extract the posts of a capture archive (see archive.py) again, with the current extraction, on all cores and without
+the network. The posts are written like the results of a scrape (a .jsonl file and its Parquet/CSV/XLSX export), and
+can be upserted into the result store, which keeps the images it already has.
+
+    python reextract.py --since 2020-03-01 --store
+"""
+
+import multiprocessing
+import os
+from datetime import datetime
+from functools import partial
+from time import time
+
+import extract
+from archive import archive_files, read_chunks
+
+
+def _extract_chunk(chunk: dict, max_comments: int = None) -> tuple:
+    """
+    Extract the entries of one chunk of the archive. Runs in the worker processes.
+    :param max_comments: Comment limit for chunks that do not record the one of their scrape.
+    :return: The posts, and the number of entries that could not be extracted.
+    """
+    posts, failed = [], 0
+    max_comments = chunk.get('max_comments', max_comments)
+    for html in chunk['entries']:
+        try:
+            content = extract.parse_entry(html, _type=chunk['type'], max_comments=max_comments, page=chunk['page'])
+        except (extract.ExtractionError, ValueError):
+            failed += 1
+            continue
+        content['page'] = chunk['page']
+        content['captured'] = chunk['captured']
+        posts.append(content)
+    return posts, failed
+
+
+def _chunks(files: list):
+    """
+    The chunks of archive files, newest first: the files in the given order (newest first), and the chunks of each file
+    from its last to its first. A file holds a single day, so it is read into memory whole.
+    """
+    for path in files:
+        yield from reversed(list(read_chunks(path)))
+
+
+def reextract(files: list, sink, names: dict = None, workers: int = None, store=None, max_comments=25) -> dict:
+    """
+    Extract the posts of archive files with a pool of processes. A post that was captured on more than one day is taken
+    from the latest of them.
+    :param files: Archive files, oldest first, see archive.archive_files.
+    :param sink: Sink to write the posts to.
+    :param names: Names of the pages by their link, for the page field of the posts (as parameters.pages).
+    :param workers: Number of processes, by default one per core.
+    :param store: ResultStore to also upsert the posts into.
+    :param max_comments: Comment limit for chunks archived before the scrape's limit was recorded with them.
+    :return: Counts of the chunks, posts, duplicate captures and entries that failed.
+    """
+    names = names or {}
+    counts = {"chunks": 0, "posts": 0, "duplicates": 0, "failed": 0}
+    seen = set()
+    with multiprocessing.Pool(workers) as pool:
+        # Newest captures first, so the first capture of a post that comes back is its latest.
+        extract_chunk = partial(_extract_chunk, max_comments=max_comments)
+        for posts, failed in pool.imap(extract_chunk, _chunks(list(reversed(files))), chunksize=4):
+            counts["chunks"] += 1
+            counts["failed"] += failed
+            for post in posts:
+                if post['post_id'] in seen:
+                    counts["duplicates"] += 1
+                    continue
+                seen.add(post['post_id'])
+                post['page'] = names.get(post['page'], post['page'])
+                sink.write(post)
+                if store:
+                    store.write(post)
+                counts["posts"] += 1
+    sink.flush()
+    if store:
+        store.flush()
+    return counts
+
+
+def main():
+    import argparse
+    import parameters
+    from export import export_results
+    from scrape import find_page, page_url
+    from sinks import JsonlSink
+    from store import ResultStore
+
+    parser = argparse.ArgumentParser(description="Extract the posts of the capture archive again, offline.")
+    parser.add_argument("--archive", default=parameters.archive or "archive", help="Folder of the archive.")
+    parser.add_argument("--page", help="Only this page of parameters.pages (name or id).")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="Only captures from this day on (YYYY-MM-DD).")
+    parser.add_argument("--workers", type=int, default=None, help="Number of processes, by default one per core.")
+    parser.add_argument("--output", help="File name of the results, without extension.")
+    parser.add_argument("--store", action="store_true", help="Also upsert the posts into parameters.store.")
+    parser.add_argument("--max-comments", type=int, default=25,
+                        help="Comment limit for captures that do not record the one of their scrape.")
+    args = parser.parse_args()
+
+    files = archive_files(args.archive, page=page_url(find_page(parameters.pages, args.page)) if args.page else None,
+                          since=args.since)
+    output = args.output or f"{parameters.destination}/reextracted_{datetime.today().date().isoformat()}"
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    store = ResultStore(parameters.store) if args.store else None
+
+    start = time()
+    with JsonlSink(output + ".jsonl", append=False) as sink:
+        counts = reextract(files, sink, names={page_url(page): page['name'] for page in parameters.pages},
+                           workers=args.workers, store=store, max_comments=args.max_comments)
+    export_results(output, formats=parameters.export_formats)
+    if store:
+        print(f"Store: {store.added} new posts, {store.updated} updated.")
+        store.close()
+    print(f"{counts['posts']} posts from {counts['chunks']} chunks in {len(files)} files ({counts['duplicates']} "
+          f"captured more than once, {counts['failed']} failed) in {time() - start:.1f}s: {output}.jsonl")
+
+
+if __name__ == "__main__":
+    main()
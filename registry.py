@@ -0,0 +1,178 @@
+"""
+Registry of the selectors the driver uses, with fallback chains that adapt to the markup facebook serves. Each chain is
+a list of XPaths for the same thing, by layout ("group" or "page"). The chains are tried in order, and whichever
+selector worked last moves to the front, so a change of the markup costs the failed lookups once and not on every
+post. The learned order and the hit and miss counts of each selector persist between runs.
+"""
+
+import json
+import os
+import tempfile
+from copy import deepcopy
+from datetime import datetime
+from threading import Lock
+
+import extract
+
+# Chains shared by all layouts, e.g. the photo theater. A layout can override a chain with its own.
+COMMON = "common"
+
+# The built-in chains, and the only full copy of them: the config file (parameters.selectors) holds overrides only.
+DEFAULTS = {COMMON: {"theater_timestamp": ["//span[@id='fbPhotoSnowliftTimestamp']//abbr"],
+                     "theater_author": ["//div[@id='fbPhotoSnowliftAuthorName']/a[1]"],
+                     "theater_next": ["//a[@title = 'Next']"]},
+            "group": {"entries": [extract.XPATHS["group"]["entries"]],
+                      "thumbnail": extract.XPATHS["group"]["thumbnail"],
+                      "link": [extract.LINK["group"]]},
+            "page": {"entries": [extract.XPATHS["page"]["entries"]],
+                     "thumbnail": extract.XPATHS["page"]["thumbnail"],
+                     "link": [extract.LINK["page"]]},
+            # The static pages of the basic mobile site, for http_backend.py (groups and pages alike).
+            "mbasic": {"entries": ["//article[@data-ft]", "//div[@role='article'][@data-ft]"],
+                       "author": [".//header//h3//a", ".//h3//strong/a"],
+                       "text": [".//div[contains(@data-ft, '\"*s\"')]", ".//p/.."],
+                       "link": [".//a[contains(@href, 'l.php?u=')]/@href"],
+                       "images": [".//a[contains(@href, '/photo.php')]/img/@src",
+                                  ".//a[contains(@href, '/photos/')]/img/@src"],
+                       "thumbnail": [".//a[contains(@href, '/video_redirect/')]//img/@src"],
+                       "full_story": [".//footer//a[text() = 'Full Story']/@href",
+                                      ".//a[contains(@href, '/story')]/@href"],
+                       "more_posts": ["//div[@id = 'm_more_item']//a/@href",
+                                      "//a[contains(text(), 'See More Posts')]/@href",
+                                      "//a[contains(text(), 'See more stories')]/@href"],
+                       "comments": ["//div[@data-sigil = 'comment']", "//div[starts-with(@id, 'ufi_')]/div[@id]"],
+                       "comment_author": [".//h3/a"],
+                       "comment_body": [".//div[@data-sigil = 'comment-body']", ".//h3/following-sibling::div[1]"],
+                       "comment_time": [".//abbr[@data-utime]/@data-utime"],
+                       "comment_likes": [".//span[contains(concat(' ', @class, ' '), ' _1lld ')]"],
+                       "more_comments": ["//div[starts-with(@id, 'see_next')]/a/@href"],
+                       "replies": [".//div[starts-with(@id, 'comment_replies_more')]/a/@href"]}}
+
+
+def _xpath(context, xpath: str) -> list:
+    # Works on selenium elements (and the driver) as well as on lxml elements.
+    if hasattr(context, "find_elements_by_xpath"):
+        return context.find_elements_by_xpath(xpath)
+    return context.xpath(xpath)
+
+
+class SelectorRegistry:
+    def __init__(self, config: str = None, stats: str = None):
+        """
+        :param config: JSON file with the chains, as {layout: {name: [xpath, ...]}}, where layout is "group", "page"
+        or "common". Chains it leaves out fall back to DEFAULTS.
+        :param stats: JSON file the learned order and the statistics are kept in. Without it, nothing is persisted.
+        """
+        self.config = config
+        self.stats_path = stats
+        self.chains = deepcopy(DEFAULTS)
+        if config and os.path.exists(config):
+            with open(config, encoding="utf-8") as file:
+                for layout, chains in json.load(file).items():
+                    self.chains.setdefault(layout, {}).update(chains)
+
+        # Hit and miss counts by layout, chain and selector.
+        self.stats = {}
+        # The chains and counts are updated from the threads of http_backend.py.
+        self._lock = Lock()
+        if stats and os.path.exists(stats):
+            with open(stats, encoding="utf-8") as file:
+                state = json.load(file)
+            self.stats = state.get("stats", {})
+            for layout, chains in state.get("order", {}).items():
+                for name, order in chains.items():
+                    if name in self.chains.get(layout, {}) or name in self.chains[COMMON]:
+                        self._reorder(layout, name, order)
+
+    def _reorder(self, layout: str, name: str, order: list):
+        # Selectors removed from the config since are dropped, new ones go to the end.
+        chain = self.chain(layout, name)
+        learned = [xpath for xpath in order if xpath in chain]
+        self.chains.setdefault(layout, {})[name] = learned + [xpath for xpath in chain if xpath not in learned]
+
+    def chain(self, layout: str, name: str) -> list:
+        """
+        The selectors of a chain, in the order they should be tried.
+        """
+        chains = self.chains.get(layout, {})
+        if name in chains:
+            return chains[name]
+        if name in self.chains[COMMON]:
+            return self.chains[COMMON][name]
+        raise KeyError(f"No selector chain {name} for {layout}.")
+
+    def first(self, layout: str, name: str) -> str:
+        """
+        The selector of a chain that worked last.
+        """
+        return self.chain(layout, name)[0]
+
+    def _count(self, layout: str, name: str, xpath: str, outcome: str):
+        # Called with the lock held.
+        counts = self.stats.setdefault(layout, {}).setdefault(name, {}).setdefault(xpath, {"hits": 0, "misses": 0})
+        counts[outcome] += 1
+        if outcome == "hits":
+            counts["last_hit"] = datetime.now().isoformat(timespec="seconds")
+
+    def hit(self, layout: str, name: str, xpath: str):
+        """
+        Record that a selector worked, and move it to the front of its chain.
+        """
+        with self._lock:
+            self._count(layout, name, xpath, "hits")
+            chain = self.chain(layout, name)
+            if chain[0] != xpath and xpath in chain:
+                # A layout that shares the common chain gets its own order from now on.
+                self.chains.setdefault(layout, {})[name] = [xpath] + [other for other in chain if other != xpath]
+
+    def miss(self, layout: str, name: str, xpath: str):
+        """
+        Record that a selector found nothing (or something unusable).
+        """
+        with self._lock:
+            self._count(layout, name, xpath, "misses")
+
+    def find_all(self, context, layout: str, name: str) -> list:
+        """
+        Find the elements of the first selector of a chain that matches anything.
+        :param context: Selenium element or driver, or lxml element, to search in.
+        :return: List of the elements, empty if no selector matched.
+        """
+        for xpath in list(self.chain(layout, name)):
+            elements = _xpath(context, xpath)
+            if elements:
+                self.hit(layout, name, xpath)
+                return elements
+            self.miss(layout, name, xpath)
+        return []
+
+    def find(self, context, layout: str, name: str):
+        """
+        Like find_all, but only the first element, or None.
+        """
+        elements = self.find_all(context, layout, name)
+        return elements[0] if elements else None
+
+    def report(self) -> dict:
+        """
+        The current order of each chain and the statistics of its selectors.
+        """
+        return {layout: {name: [dict(self.stats.get(layout, {}).get(name, {}).get(xpath, {"hits": 0, "misses": 0}),
+                                     xpath=xpath)
+                                for xpath in chain]
+                         for name, chain in chains.items()}
+                for layout, chains in self.chains.items()}
+
+    def save(self):
+        """
+        Write the learned order and the statistics to the stats file, atomically.
+        """
+        if not self.stats_path:
+            return
+        with self._lock:
+            state = json.loads(json.dumps({"order": self.chains, "stats": self.stats}))
+        # Unique temporary file, as drivers in threads of one process (daemon.py) may save at the same time.
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(self.stats_path) or ".")
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            json.dump(state, file, indent=2)
+        os.replace(tmp, self.stats_path)
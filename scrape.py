@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 
 from selenium import webdriver
-from time import sleep
+from time import sleep, time
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver import ActionChains
 from selenium.common.exceptions import NoSuchElementException, TimeoutException, ElementClickInterceptedException, \
@@ -9,10 +9,19 @@ from selenium.common.exceptions import NoSuchElementException, TimeoutException,
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from functools import partial
-import re
+from urllib.parse import urljoin
+
+import extract
+import media
+from archive import CaptureArchive
+from checkpoint import Checkpoint
+from gallery import GalleryTabs
+from instrument import Instrumentation
+from registry import SelectorRegistry
+from store import ResultStore
 
 Wait = partial(WebDriverWait, timeout=15)
 
@@ -21,13 +30,210 @@ class TooManyAttemptsError(TimeoutException):
     pass
 
 
-def random_sleep(sec: float):
+def random_sleep(sec: float, jitter: float = 0.1):
     """
     Adds a random amount of time to the sleep to avoid detection.
     :param sec: (minimum) seconds to sleep.
+    :param jitter: Maximum share of sec that is added on top.
     """
     from random import random
-    sleep(sec + (random() * 0.1 * sec))
+    sleep(sec + (random() * jitter * sec))
+
+
+# Minimum seconds to wait after each kind of action, before the jitter is added.
+DELAYS = {"login": 1,      # After the login form appeared.
+          "load": 1,       # After loading a page, and once the first entries are there.
+          "scroll": 0.5,   # Before each scroll, on top of waiting for the new entries.
+          "click": 0.5,    # After scrolling to an element that is about to be clicked.
+          "hover": 0.1,    # After moving the mouse somewhere.
+          "comments": 3,   # After clicking "more comments".
+          "theater": 2,    # After the photo theater opened.
+          "gallery": 1,    # Between the steps of going through a gallery.
+          "retry": 5}      # Before loading a page again that did not load, doubled with each attempt.
+
+
+class Pacing:
+    def __init__(self, delays: dict = None, jitter: float = 0.1, min_timeout: float = 5, max_timeout: float = 15,
+                 factor: float = 4, smoothing: float = 0.3, limiter=None, expand_timeout: float = 30):
+        """
+        Decides how long the driver waits between actions, and how long it waits for new entries to load before it
+        concludes that the end of the page has been reached. The timeout adapts to how fast each page loads.
+        :param delays: Minimum delays by kind of action, overriding the defaults in DELAYS.
+        :param jitter: Maximum share of each delay that is randomly added on top.
+        :param min_timeout: Shortest time to wait for new entries.
+        :param max_timeout: Longest time to wait for new entries, also used for pages without any measurements yet.
+        :param factor: The timeout is this many times the typical load time of the page.
+        :param smoothing: Weight of the latest load time in the running average.
+        :param limiter: Shared rate limit on requests to facebook, with an acquire() method (see parallel.RateLimiter).
+        :param expand_timeout: Longest time to wait for the collapsed text and comments of a chunk of entries to open.
+        """
+        self.delays = dict(DELAYS, **(delays or {}))
+        self.jitter = jitter
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.factor = factor
+        self.smoothing = smoothing
+        self.limiter = limiter
+        self.expand_timeout = expand_timeout
+        self.load_times = {}
+
+    def backoff(self, attempt: int, cap: float = 60) -> float:
+        """
+        How long to wait before the given attempt at something that failed: the retry delay, doubled with each
+        attempt, up to cap seconds, with jitter.
+        """
+        from random import random
+        delay = min(self.delays["retry"] * 2 ** (attempt - 1), cap)
+        return delay * (1 + random() * self.jitter)
+
+    def pause(self, kind: str):
+        """
+        Sleep for the (jittered) minimum delay of a kind of action.
+        """
+        random_sleep(self.delays[kind], jitter=self.jitter)
+
+    def throttle(self):
+        """
+        Wait for the rate limiter (if any) before making a request to facebook.
+        """
+        if self.limiter:
+            self.limiter.acquire()
+
+    def timeout(self, page: str) -> float:
+        """
+        How long to wait for new entries on a page.
+        """
+        if page not in self.load_times:
+            return self.max_timeout
+        return min(max(self.factor * self.load_times[page], self.min_timeout), self.max_timeout)
+
+    def record(self, page: str, seconds: float):
+        """
+        Learn from how long new entries took to appear on a page.
+        """
+        previous = self.load_times.get(page, seconds)
+        self.load_times[page] = self.smoothing * seconds + (1 - self.smoothing) * previous
+
+
+# Scrolls to the bottom, then waits until there are more entries than before (or a timeout), and returns the number of
+# entries. Runs as an async script so that the waiting happens in the browser, without polling from selenium.
+SCROLL_AND_WAIT = """
+var xpath = arguments[0], previous = arguments[1], timeout = arguments[2], done = arguments[arguments.length - 1];
+function count() {
+    return document.evaluate("count(" + xpath + ")", document, null, XPathResult.NUMBER_TYPE, null).numberValue;
+}
+window.scrollTo(0, document.body.scrollHeight);
+if (count() > previous) { done(count()); return; }
+var timer;
+var observer = new MutationObserver(function () {
+    var n = count();
+    if (n > previous) { observer.disconnect(); clearTimeout(timer); done(n); }
+});
+timer = setTimeout(function () { observer.disconnect(); done(count()); }, timeout * 1000);
+observer.observe(document.body, {childList: true, subtree: true});
+"""
+
+# Walks the comment tree of an entry and returns one record per comment, replies following the comment they reply to.
+# Works like extract.parse_comments, see there and extract.comment_record for the fields.
+COMMENT_TREE = """
+var records = [];
+function first(node, selector) { return node.querySelector(selector); }
+function text(node) { return node ? node.innerText.trim() : null; }
+function commentId(article) {
+    var link = first(article, "a[href*='comment_id=']");
+    var match = link && (/reply_comment_id=(\\d+)/.exec(link.href) || /comment_id=(\\d+)/.exec(link.href));
+    return match ? match[1] : null;
+}
+function walk(list, depth, parent) {
+    for (var i = 0; i < list.children.length; i++) {
+        var item = list.children[i];
+        if (item.tagName != 'LI') { continue; }
+        var article = first(item, ':scope > div[role=article]') || item;
+        var body = first(article, 'span._3l3x'), time = first(article, 'abbr[data-utime]');
+        records.push({comment_id: commentId(article), author: text(first(article, 'a._6qw4')), text: text(body),
+                      likes: text(first(article, 'span._1lld')), utime: time ? time.getAttribute('data-utime') : null,
+                      depth: depth, parent: parent, full_text: body ? null : text(article)});
+        var position = records.length - 1;
+        var replies = item.querySelectorAll(':scope > div > ul');
+        for (var j = 0; j < replies.length; j++) { walk(replies[j], depth + 1, position); }
+    }
+}
+var lists = arguments[0].querySelectorAll('ul._7791');
+for (var k = 0; k < lists.length; k++) {
+    if (!lists[k].parentElement.closest('ul._7791')) { walk(lists[k], 0, null); }
+}
+return records;
+"""
+
+# Source of an image element, or of the first image inside an element.
+IMAGE_SOURCE = """
+var img = arguments[0].tagName == 'IMG' ? arguments[0] : arguments[0].querySelector('img');
+return img ? (img.currentSrc || img.src || null) : null;
+"""
+
+# Clicks every "See More", "more comments" and reply pager in a list of entries at once, and keeps clicking the ones
+# that appear as comments load, until none is left or the timeout is reached. Expanders that are still there a while
+# after they were clicked are clicked again. Returns the positions of the entries that still have expanders.
+EXPAND_ENTRIES = """
+var entries = arguments[0], xpaths = arguments[1], timeout = arguments[2], retry = arguments[3];
+var done = arguments[arguments.length - 1], deadline = Date.now() + timeout * 1000;
+function expanders(entry) {
+    var found = [];
+    xpaths.forEach(function (xpath) {
+        var result = document.evaluate(xpath, entry, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+        for (var i = 0; i < result.snapshotLength; i++) { found.push(result.snapshotItem(i)); }
+    });
+    return found;
+}
+function round() {
+    var incomplete = [];
+    entries.forEach(function (entry, position) {
+        var found = expanders(entry);
+        if (found.length) { incomplete.push(position); }
+        found.forEach(function (expander) {
+            var clicked = +(expander.getAttribute('data-clicked') || 0);
+            if (Date.now() - clicked > retry * 1000) {
+                expander.setAttribute('data-clicked', Date.now());
+                expander.click();
+            }
+        });
+    });
+    if (!incomplete.length || Date.now() > deadline) { done(incomplete); return; }
+    setTimeout(round, 250);
+}
+round();
+"""
+
+# The entries of the feed together with a stable key for each: the mall_post_ id of the element (groups), else the
+# permalink of the post, else a hash of its author, timestamp and the start of its text. Keys that occur more than once
+# get a suffix, in feed order. Works like extract.entry_key.
+ENTRY_KEYS = """
+var found = document.evaluate(arguments[0], document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+var entries = [], keys = [], counts = {};
+function hash(s) {
+    var h = 0x811c9dc5;
+    for (var i = 0; i < s.length; i++) { h = Math.imul(h ^ s.charCodeAt(i), 0x01000193) >>> 0; }
+    return ('0000000' + h.toString(16)).slice(-8);
+}
+for (var i = 0; i < found.snapshotLength; i++) {
+    var entry = found.snapshotItem(i), key;
+    var stamp = entry.querySelector("[class^='_5ptz']"), link = stamp && stamp.closest('a[href]');
+    if (entry.id && entry.id.indexOf('mall_post_') == 0) {
+        key = entry.id;
+    } else if (link && link.getAttribute('href') != '#') {
+        key = 'link:' + link.getAttribute('href').split('?')[0];
+    } else {
+        var author = entry.querySelector("span[class^='fwb'] > a");
+        var text = entry.querySelector("[data-testid='post_message']");
+        key = 'hash:' + hash([author ? author.textContent : '', stamp ? stamp.getAttribute('title') : '',
+                              text ? text.textContent.slice(0, 80) : ''].join('|'));
+    }
+    counts[key] = (counts[key] || 0) + 1;
+    entries.push(entry);
+    keys.push(counts[key] > 1 ? key + '#' + counts[key] : key);
+}
+return [entries, keys];
+"""
 
 
 def access_group(driver: webdriver, name: str):
@@ -43,11 +249,74 @@ def access_group(driver: webdriver, name: str):
     Wait(driver).until(EC.presence_of_element_located((By.ID, "newsFeedHeading")))
 
 
+class SessionCache:
+    def __init__(self, path: str = "session.json", max_age: timedelta = timedelta(days=7)):
+        """
+        Keeps the cookies of a logged in session on disk, so that the next start of the driver does not need to log in
+        again.
+        :param path: File to keep the cookies in.
+        :param max_age: How long a saved session is trusted before logging in again.
+        """
+        self.path = path
+        self.max_age = max_age
+
+    def load(self):
+        """
+        :return: The saved cookies, or None if there are none or they are too old.
+        """
+        import json
+        import os
+
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, encoding="utf-8") as file:
+            session = json.load(file)
+        if datetime.now() - datetime.fromisoformat(session["saved"]) > self.max_age:
+            return None
+        return session["cookies"]
+
+    def save(self, cookies: list):
+        import json
+        import os
+        import tempfile
+
+        # The cookies are as good as the password, so the file is never readable by others, not even while it is being
+        # written (mkstemp creates it for the owner only). The temporary file is unique, since the workers of daemon.py
+        # and parallel.py may save the session at the same time.
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(self.path) or ".")
+        os.chmod(tmp, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            json.dump({"saved": datetime.now().isoformat(), "cookies": cookies}, file)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        import os
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# URL patterns (as in the DevTools Network.setBlockedURLs) of what a lean driver does not load, by kind. Images are only
+# blocked when they are downloaded rather than screenshot, since the downloads take the image URL from the page.
+BLOCKS = {"video": ["*.mp4*", "*.webm*", "*.m3u8*", "*.mpd*", "*video*.fbcdn.net/*"],
+          "font": ["*.woff*", "*.woff2*", "*.ttf*", "*.otf*"],
+          "image": ["*.jpg*", "*.jpeg*", "*.png*", "*.gif*", "*.webp*"],
+          "tracking": ["*doubleclick.net/*", "*google-analytics.com/*", "*googletagmanager.com/*",
+                       "*connect.facebook.net/*", "*facebook.com/tr?*", "*facebook.com/ajax/bz*"]}
+
+ERROR_COUNTERS = ("screenshot_error", "no_screenshot", "preview_issue", "image_issue", "download_issue", "incomplete",
+                  "skipped_videos")
+
+
 class FaceBookDriver(webdriver.Chrome):
     def __init__(self, username: str, password: str, executable_path='./chromedriver', port=0, options=None,
                  service_args=None, desired_capabilities=None, service_log_path=None, chrome_options=None,
                  keep_alive=True, images_folder: str = "./images", thumbnails_folder: str = "./thumbnails",
-                 max_comments=25, max_images=10, max_scroll_depth=None, max_attempts=10):
+                 max_comments=25, max_images=10, max_scroll_depth=None, max_attempts=10, extraction: str = "live",
+                 pacing: Pacing = None, cookies: list = None, session_cache: SessionCache = None,
+                 download_images: bool = False, media_store: media.MediaStore = None,
+                 base_url: str = "http://www.facebook.com", selectors: SelectorRegistry = None,
+                 gallery_tabs: int = 0, blocked: list = None, capture=None, enumerate_galleries: bool = True):
         """
         An instance of the firefox webdriver with some added methods for navigating facebook.
         :param username: Facebook username as a string.
@@ -56,7 +325,29 @@ class FaceBookDriver(webdriver.Chrome):
         :param max_comments: Maximum numbers of comments to be extracted per post.
         :param max_images: Maximum of numbers to be scraped per post.
         :param max_scroll_depth: How often should selenium scroll to the bottom of the page to load more posts?
+        :param extraction: "live" to read every field from the webdriver, "snapshot" to pull the HTML of a chunk of
+        entries once and parse it offline (only clicks and screenshots go through the webdriver).
+        :param pacing: How long to wait between actions and for new entries, see Pacing.
+        :param cookies: Cookies of a logged in session (from get_cookies), to reuse instead of logging in again.
+        :param session_cache: Where to restore the session from, and save it to after logging in.
+        :param download_images: Download the original images in the background, instead of taking screenshots.
+        :param media_store: Save images and thumbnails to a content addressed store, instead of the images and
+        thumbnails folders.
+        :param base_url: Where facebook is, e.g. a local stand-in server for testing (see fixtures.py).
+        :param selectors: Registry of the selectors with their fallbacks, see registry.py.
+        :param gallery_tabs: Go through the galleries of up to this many posts at a time, each in a tab of its own,
+        while the feed is scraped on, see gallery.py. With 0, galleries are gone through one after the other in the
+        feed tab.
+        :param blocked: What not to load, as kinds of BLOCKS ("video", "font", "image", "tracking") and/or URL
+        patterns. Use with chrome_options(lean=True).
+        :param capture: CaptureArchive to save the expanded HTML of every chunk of entries to, for reextract.py.
+        :param enumerate_galleries: With download_images, take the photos of a gallery from the markup of the post
+        (and, if it does not show all of them, from the page of its photo set) and download them all at once, instead
+        of clicking through the photo theater. Videos in a gallery are skipped.
         """
+        # Number of commands sent to chromedriver, i.e. round trips. Set before the session is started.
+        self.command_count = 0
+        self.base_url = base_url
         super().__init__(executable_path, port, options, service_args, desired_capabilities, service_log_path,
                          chrome_options, keep_alive)
         self.__username = username
@@ -72,32 +363,87 @@ class FaceBookDriver(webdriver.Chrome):
         self.no_screenshot = 0
         self.preview_issue = 0
         self.image_issue = 0
+        # Entries that were still collapsed after expand_entries.
+        self.incomplete = 0
+        # Videos in galleries, which are not saved.
+        self.skipped_videos = 0
+        self.enumerate_galleries = enumerate_galleries
         self.the_end = False
-
-        self.xpaths = {"group": {"entries": "//div[starts-with(@id, 'mall_post_')]",
-                                 "thumbnail": [".//img[starts-with(@class, '_1445')]",
-                                               ".//img[@class = 'scaledImageFitWidth img']",
-                                               ".//a/div/img"]},
-                       "page": {"entries": "//div[@id = 'pagelet_timeline_main_column']//div[@class = '_4-u2 _4-u8']",
-                                "thumbnail": [".//img[@class = 'scaledImageFitWidth img']",
-                                              ".//a/div/img"]}
-                       }
-        # For tracking whether we ar currently scraping a page or a  group.
+        self.extraction = extraction
+        # How many posts in a row may be older than the last run before an incremental scrape stops.
+        self.stale_limit = 3
+        # How many entries before each chunk of stable_scrape are looked at again, in case the feed shifted.
+        self.overlap = 5
+        self.pacing = pacing or Pacing()
+        self.blocked = []
+        if blocked:
+            self.block(blocked, images=download_images)
+        self.set_script_timeout(max(self.pacing.max_timeout, self.pacing.expand_timeout) + 5)
+
+        self.selectors = selectors or SelectorRegistry()
+        # For tracking whether we ar currently scraping a page or a  group, and which one.
         self._type = None
-
-        self.login_fb()
+        self._page = None
+        # Entries handed to extraction since the page was loaded, i.e. the offset of the next chunk in the feed.
+        self._offset = 0
+        self.capture = capture
+
+        if cookies:
+            self.restore_cookies(cookies)
+        elif not (session_cache and self.restore_session(session_cache)):
+            self.login_fb()
+            self.wait_for_login()
+            if session_cache:
+                self.save_session(session_cache)
+
+        self.media_store = media_store
+        self.downloader = media.ImageDownloader(cookies=self.get_cookies(), store=media_store) \
+            if download_images else None
+        self.galleries = GalleryTabs(self, tabs=gallery_tabs) if gallery_tabs else None
+
+    def quit(self):
+        if getattr(self, "galleries", None):
+            self.galleries.close()
+        if getattr(self, "downloader", None):
+            self.downloader.close()
+        if getattr(self, "selectors", None):
+            self.selectors.save()
+        super().quit()
+
+    def block(self, blocked: list, images: bool = True) -> list:
+        """
+        Keep the browser from loading what the scrape does not use, through the DevTools network blocking.
+        :param blocked: Kinds of BLOCKS and/or URL patterns, with * as wildcard. An empty list lifts the blocking.
+        :param images: Whether images may be blocked too. They are needed in the page for screenshots.
+        :return: The blocked URL patterns.
+        """
+        patterns = []
+        for item in blocked:
+            if item == "image" and not images:
+                continue
+            patterns.extend(BLOCKS.get(item, [item]))
+        self.execute_cdp_cmd("Network.enable", {})
+        self.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
+        self.blocked = patterns
+        return patterns
+
+    def execute(self, driver_command, params=None):
+        self.command_count += 1
+        return super().execute(driver_command, params)
 
     def login_fb(self):
         """
         Logs into facebook for you.
         """
-        self.get("http://www.facebook.com")
+        self.get(self.base_url)
 
-        random_sleep(5)
+        # Both versions of the login form have a field named "email", so wait for that instead of a fixed time.
+        Wait(self).until(EC.presence_of_element_located((By.NAME, "email")))
+        self.pacing.pause("login")
 
-        if 'id="loginbutton"' in self.page_source:
+        if self.find_elements_by_id("loginbutton"):
             login_type = 0
-        elif 'name="login"' in self.page_source:
+        else:
             login_type = 1
 
         # This approach doesn't really use login_type if its not 0, but it seems to be the most comprehendible (and
@@ -112,40 +458,153 @@ class FaceBookDriver(webdriver.Chrome):
 
         # Wait(self).until(EC.presence_of_element_located((By.ID, "newsFeedHeading")))
 
+    def restore_cookies(self, cookies: list):
+        """
+        Log in by restoring the cookies of another session, e.g. one that was logged in with login_fb.
+        :param cookies: List of cookies, as returned by get_cookies.
+        """
+        # Cookies can only be set for the domain that is currently loaded.
+        self.get(self.base_url)
+        for cookie in cookies:
+            cookie = {key: value for key, value in cookie.items() if key != "expiry" or isinstance(value, int)}
+            self.add_cookie(cookie)
+
+    def restore_session(self, session_cache: SessionCache) -> bool:
+        """
+        Log in with the cookies saved in the session cache, if they are still valid.
+        :return: Whether the driver is logged in now.
+        """
+        cookies = session_cache.load()
+        if not cookies:
+            return False
+        self.restore_cookies(cookies)
+        if self.logged_in():
+            return True
+        session_cache.clear()
+        self.delete_all_cookies()
+        return False
+
+    def save_session(self, session_cache: SessionCache):
+        """
+        Save the cookies of the session, once the login went through (see wait_for_login).
+        """
+        session_cache.save(self.get_cookies())
+
+    def wait_for_login(self):
+        """
+        Wait until the login went through, so that the cookies of the session (which the image downloads need too) are
+        all there. The page is only reloaded to check once the session cookie is set, not to cut the login short.
+        """
+        Wait(self).until(lambda driver: driver.get_cookie("c_user"))
+        Wait(self).until(lambda driver: driver.logged_in())
+
+    def logged_in(self) -> bool:
+        """
+        Load facebook once and check that it does not ask to log in.
+        """
+        self.get(self.base_url)
+        return bool(self.get_cookie("c_user")) and not self.find_elements_by_name("pass")
+
+    @property
+    def download_issue(self) -> int:
+        """
+        Number of images that failed to download in the background.
+        """
+        return self.downloader.failed if self.downloader else 0
+
+    def errors(self) -> dict:
+        """
+        The error counters of the driver.
+        """
+        return {counter: getattr(self, counter) for counter in ERROR_COUNTERS}
+
     def load_page(self, page: str):
         """
-        Load a page.
+        Load a page. If its entries do not appear, it is loaded again after a delay that doubles with each attempt, up
+        to max_attempts times.
         :param page: Link to the site.
         """
-        if self.attempts > self.max_attempts:
-            raise TooManyAttemptsError
+        self._page = page
+        self._offset = 0
+        self.attempts = 0
+        chain = self.selectors.chain(self._type, "entries")
+        while True:
+            self.pacing.throttle()
+            self.get(page)
+            self.pacing.pause("load")
+            try:
+                Wait(self).until(EC.presence_of_element_located((By.XPATH, " | ".join(chain))))
+                break
+            except TimeoutException:
+                self.attempts += 1
+                if self.attempts > self.max_attempts:
+                    raise TooManyAttemptsError(f"{page} did not load after {self.attempts} attempts.")
+                sleep(self.pacing.backoff(self.attempts))
 
-        self.get(page)
-        random_sleep(1)
+        self.match_entries(chain)
+        self.pacing.pause("load")
 
-        try:
-            Wait(self).until(EC.presence_of_element_located((By.XPATH, self.xpaths[self._type]["entries"])))
-            random_sleep(1)
-        except TimeoutException:
-            self.attempts += 1
-            self.load_page(page=page)
+    @property
+    def entries_xpath(self) -> str:
+        """
+        The selector of the entries of the feed that matched when the page was loaded.
+        """
+        return self.selectors.first(self._type, "entries")
 
-    def scrape_page(self, page: str, _type: str, chunk_size: int = None):
+    def match_entries(self, chain: list):
+        """
+        Find out which selector of the chain of entries matches the loaded page, and put it first.
+        """
+        if len(chain) == 1:
+            self.selectors.hit(self._type, "entries", chain[0])
+            return
+        for xpath in list(chain):
+            if self.count_entries(xpath):
+                self.selectors.hit(self._type, "entries", xpath)
+                return
+            self.selectors.miss(self._type, "entries", xpath)
+
+    def scrape_page(self, page: str, _type: str, chunk_size: int = None, stream: bool = False,
+                    checkpoint: Checkpoint = None, incremental: bool = False, mode: str = None):
         """
         Scrapea a specific facebook group or page that is linked. If no chunk size is specified, will call easy_scrape,
-        with chunk size specified will call stable_scrape.
+        with chunk size specified will call stable_scrape (or prune_scrape, with mode="prune").
+        :param page: Link to the facebook group or page to be scraped.
+        :param _type: Whether the link to be scraped is a group or a page.
+        :param chunk_size: How many posts to scrape at once.
+        :param stream: Return a generator that yields each post as soon as it is extracted, instead of a list.
+        :param checkpoint: Checkpoint to save progress to and resume from (only with chunk_size).
+        :param incremental: Stop at the posts collected in the last complete run of the checkpoint.
+        :param mode: "easy", "stable" or "prune"; by default "stable" with a chunk size and "easy" without.
+        :return: List (or generator) with the contents of the page.
+        """
+        contents = self.iter_page(page=page, _type=_type, chunk_size=chunk_size, checkpoint=checkpoint,
+                                  incremental=incremental, mode=mode)
+        if stream:
+            return contents
+
+        return list(contents)
+
+    def iter_page(self, page: str, _type: str, chunk_size: int = None, checkpoint: Checkpoint = None,
+                  incremental: bool = False, mode: str = None):
+        """
+        Generator version of scrape_page, yields the contents of each post as soon as it is extracted.
         :param page: Link to the facebook group or page to be scraped.
         :param _type: Whether the link to be scraped is a group or a page.
         :param chunk_size: How many posts to scrape at once.
-        :return: Dictionary with the contents of the page.
+        :param checkpoint: Checkpoint to save progress to and resume from (only with chunk_size).
+        :param incremental: Stop at the posts collected in the last complete run of the checkpoint.
+        :param mode: "easy", "stable" or "prune"; by default "stable" with a chunk size and "easy" without.
         """
         self._type = _type
-        if chunk_size:
-            contents = self.stable_scrape(page=page, chunk_size=chunk_size)
+        since = checkpoint.since if (incremental and checkpoint) else None
+        mode = mode or ("stable" if chunk_size else "easy")
+        if mode == "prune":
+            yield from self.prune_scrape(page=page, chunk_size=chunk_size or 25, checkpoint=checkpoint, since=since)
+        elif mode == "stable":
+            yield from self.stable_scrape(page=page, chunk_size=chunk_size, checkpoint=checkpoint, since=since)
         else:
-            contents = self.easy_scrape(page=page)
-
-        return contents
+            yield from self.easy_scrape(page=page)
 
     def easy_scrape(self, page: str):
         """
@@ -153,46 +612,51 @@ class FaceBookDriver(webdriver.Chrome):
         but it can run into trouble when the page or group to be scraped is relatively long, and many objects need to be
         loaded into memory.
         :param page: Link to the facebook group or page to be scraped.
-        :return: Dictionary with the contents of the page.
+        :return: Generator of dictionaries with the contents of each post.
         """
-        contents = []
-
         self.load_page(page=page)
         self.scroll_to_bottom()
 
-        entries = self.find_elements_by_xpath(self.xpaths[self._type]["entries"])
-
-        for entry in entries:
-            contents = contents + [self.scrape_entry(entry=entry)]
-
-        return contents
+        entries = self.find_elements_by_xpath(self.entries_xpath)
+        yield from self.scrape_entries(entries)
 
-    def stable_scrape(self, page: str, chunk_size: int):
+    def stable_scrape(self, page: str, chunk_size: int, checkpoint: Checkpoint = None, since: datetime = None):
         """
         Load and scrape one specific facebook group or page. This scrape method is designed to be more robust than the
         easy_scrape method above.
         :param page: Link to the facebook group or page to be scraped.
         :param chunk_size: How many entries are supposed to be scraped at once.
-        :return: Dictionary with the contents of the page.
+        :param checkpoint: Checkpoint to save the progress to after every chunk. If it is in progress, the scrape
+        resumes where it stopped.
+        :param since: Stop once posts are reached that are no newer than this (a few in a row, since pinned posts
+        are out of order).
+        :return: Generator of dictionaries with the contents of each post.
         """
-        contents = []
-
         self.load_page(page=page)
 
-        entries = self.find_elements_by_xpath(self.xpaths[self._type]["entries"])
-        first_post = entries[0].find_element_by_xpath(".//*[starts-with(@class, '_5ptz')]").get_attribute('title')
+        # Keys of the entries scraped so far (see ENTRY_KEYS). The window of each chunk starts a few entries early, and
+        # the entries that were already scraped are skipped, so that nothing is lost or scraped twice if the feed
+        # shifted since the last chunk.
+        if checkpoint and checkpoint.in_progress:
+            first_post, n, seen = checkpoint.first_post, checkpoint.n, set(checkpoint.seen)
+        else:
+            first_post, n, seen = self.entry_keys()[1][0], 0, set()
 
-        n = 0
+        stale = [0]
         while True:
             self.load_entries(m=n + chunk_size)
-            entries = self.find_elements_by_xpath(self.xpaths[self._type]["entries"])
-            start_from = [first_post in entry.get_attribute("innerHTML") for entry in entries].index(True)
-            scrape_from = start_from + n
-            end_with = scrape_from + chunk_size
-            end_with = end_with if end_with < len(entries) else len(entries)
-
-            for entry in entries[scrape_from:end_with]:
-                contents = contents + [self.scrape_entry(entry=entry)]
+            entries, keys = self.entry_keys()
+            # Chunks are counted from the first post, which may have moved down if posts were added on top. A first
+            # post that is gone (or a checkpoint from before the keys) counts from the top of the feed.
+            start_from = keys.index(first_post) if first_post in keys else 0
+            scrape_from = max(start_from + n - self.overlap, start_from)
+            end_with = min(start_from + n + chunk_size, len(entries))
+            chunk = [(entry, key) for entry, key in zip(entries[scrape_from:end_with], keys[scrape_from:end_with])
+                     if key not in seen]
+            seen.update(key for _, key in chunk)
+
+            yield from self._until(self.scrape_entries([entry for entry, _ in chunk]), since=since,
+                                   checkpoint=checkpoint, stale=stale)
 
             if self.the_end:
                 self.the_end = False
@@ -200,7 +664,101 @@ class FaceBookDriver(webdriver.Chrome):
 
             self.refresh()
             n += chunk_size
-        return contents
+            if checkpoint:
+                checkpoint.advance(first_post=first_post, n=n, seen=keys[max(end_with - self.overlap, 0):end_with])
+
+        if checkpoint:
+            checkpoint.complete()
+
+    def entry_keys(self):
+        """
+        The entries of the feed and a stable key for each, see ENTRY_KEYS. One call to the webdriver for all of them.
+        :return: List of the web elements, and list of their keys.
+        """
+        entries, keys = self.execute_script(ENTRY_KEYS, self.entries_xpath)
+        return entries, keys
+
+    def prune_scrape(self, page: str, chunk_size: int, checkpoint: Checkpoint = None, since: datetime = None):
+        """
+        Load and scrape one specific facebook group or page without ever refreshing it. Entries that have been scraped
+        are hollowed out (emptied, but kept at their height so the feed does not jump), and scrolling continues from
+        where it is. Unlike easy_scrape, the browser does not fill up with the whole feed, and unlike stable_scrape, the
+        feed is not scrolled through again from the top for every chunk, so each chunk takes about the same time.
+        :param page: Link to the facebook group or page to be scraped.
+        :param chunk_size: How many entries are supposed to be scraped at once.
+        :param checkpoint: Checkpoint to save the progress to after every chunk. If it is in progress, the entries that
+        were already scraped are skipped (by count, without extracting them).
+        :param since: Stop once posts are reached that are no newer than this.
+        :return: Generator of dictionaries with the contents of each post.
+        """
+        self.load_page(page=page)
+
+        pending = self.entries_xpath + "[not(@data-scraped)]"
+        first_post = self.entry_keys()[1][0]
+        n = 0
+        count = self.count_entries()
+        skip = checkpoint.n if (checkpoint and checkpoint.in_progress) else 0
+        scrolled = 0
+        stale = [0]
+        while True:
+            entries = self.find_elements_by_xpath(pending)[:max(chunk_size, skip)]
+            if len(entries) < max(chunk_size, skip) and not self.the_end:
+                previous = count
+                count = self.scroll_and_wait(previous=previous)
+                scrolled += 1
+                if count <= previous or (self.max_scroll_depth and scrolled == self.max_scroll_depth):
+                    self.the_end = True
+                continue
+
+            if skip:
+                self.prune(entries[:skip])
+                n, skip = skip, 0
+                continue
+
+            if not entries:
+                break
+
+            yield from self._until(self.scrape_entries(entries), since=since, checkpoint=checkpoint, stale=stale)
+            self.prune(entries)
+            n += len(entries)
+            if checkpoint:
+                checkpoint.advance(first_post=first_post, n=n)
+
+            if stale[0] >= self.stale_limit:
+                break
+
+        self.the_end = False
+        if checkpoint:
+            checkpoint.complete()
+
+    def prune(self, entries: list):
+        """
+        Hollow out entries that have been scraped, to free the browser's memory. The emptied elements keep their
+        height, so that the scroll position and facebook's loading of further posts are not thrown off.
+        :param entries: Web elements of the entries.
+        """
+        if entries:
+            self.execute_script("arguments[0].forEach(function (e) {"
+                                "e.style.height = e.offsetHeight + 'px'; e.innerHTML = '';"
+                                "e.setAttribute('data-scraped', '1');});", entries)
+
+    def _until(self, posts, since: datetime, checkpoint: Checkpoint, stale: list):
+        """
+        Hand on posts until a few in a row are no newer than `since` (pinned posts are out of order), and record the
+        newest post in the checkpoint.
+        :param stale: One-element list with the number of old posts in a row so far, carried over between chunks.
+        """
+        for content in posts:
+            if since and content['timestamp'] <= since:
+                stale[0] += 1
+                if stale[0] >= self.stale_limit:
+                    self.the_end = True
+                    return
+                continue
+            stale[0] = 0
+            if checkpoint:
+                checkpoint.update(content['timestamp'])
+            yield content
 
     def load_entries(self, m: int):
         """
@@ -209,19 +767,17 @@ class FaceBookDriver(webdriver.Chrome):
         :param m: Final entry to be loaded.
         """
         scrolled = 0
+        count = self.count_entries()
         while True:
-            len_previous = len(self.page_source)
-
-            self.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-            random_sleep(3)
+            previous = count
+            count = self.scroll_and_wait(previous=previous)
 
-            end_page = len(self.page_source) == len_previous
+            end_page = count <= previous
             if end_page:
                 self.the_end = True
                 break
 
-            entries = self.find_elements_by_xpath(self.xpaths[self._type]["entries"])
-            end_chunk = len(entries) > m + 5
+            end_chunk = count > m + 5
             if end_chunk:
                 break
 
@@ -235,23 +791,137 @@ class FaceBookDriver(webdriver.Chrome):
         Scroll to bottom of current page.
         """
         scrolled = 0
+        count = self.count_entries()
         while True:
-            len_previous = len(self.page_source)
+            previous = count
+            count = self.scroll_and_wait(previous=previous)
 
-            self.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-            random_sleep(3)
-
-            if len(self.page_source) == len_previous:
+            if count <= previous:
                 break
 
             scrolled += 1
             if self.max_scroll_depth and scrolled == self.max_scroll_depth:
                 break
 
-    def scrape_entry(self, entry):
+    def count_entries(self, xpath: str = None) -> int:
+        """
+        Number of entries currently loaded on the page.
+        :param xpath: Selector of the entries, by default the one that matched when the page was loaded.
+        """
+        return int(self.execute_script(
+            "return document.evaluate('count(' + arguments[0] + ')', document, null, XPathResult.NUMBER_TYPE, null)"
+            ".numberValue;", xpath or self.entries_xpath))
+
+    def scroll_and_wait(self, previous: int) -> int:
+        """
+        Scroll to the bottom of the page and wait until new entries appeared, or until the timeout for the page ran
+        out. Returns as soon as the new entries are there, and learns how long that typically takes.
+        :param previous: Number of entries loaded before scrolling.
+        :return: Number of entries loaded now.
+        """
+        self.pacing.pause("scroll")
+        self.pacing.throttle()
+        start = time()
+        count = int(self.execute_async_script(SCROLL_AND_WAIT, self.entries_xpath, previous,
+                                              self.pacing.timeout(self._page)))
+        if count > previous:
+            self.pacing.record(self._page, time() - start)
+        return count
+
+    def scrape_entries(self, entries: list):
+        """
+        Extract the contents of a list of posts, with the extraction method the driver was set up with.
+        :param entries: Web elements of the entries, obtained through the drivers find_element(s) method.
+        :return: Generator of dictionaries with the contents of each post.
+        """
+        # Images that are still downloading (or galleries still going through in their tabs) are filled in before a
+        # post is handed on.
+        if self.galleries:
+            yield from media.resolve_in_order(self._scrape_entries(entries), lookahead=max(5, 2 * self.galleries.tabs),
+                                              pump=self.galleries.pump)
+        else:
+            yield from media.resolve_in_order(self._scrape_entries(entries))
+
+    def _scrape_entries(self, entries: list):
+        # Only the entries that are still collapsed after this are expanded one by one while they are extracted.
+        incomplete = self.expand_entries(entries)
+        htmls = self.snapshot_entries(entries) if self.extraction == "snapshot" or self.capture else None
+        if self.capture:
+            self.capture.write(self._page, self._type, self._offset, htmls, max_comments=self.max_comments)
+        self._offset += len(entries)
+
+        if self.extraction == "snapshot":
+            for entry, html in zip(entries, htmls):
+                yield self.scrape_entry_snapshot(entry=entry, html=html)
+                if self.galleries:
+                    self.galleries.step()
+        else:
+            for entry in entries:
+                yield self.scrape_entry(entry=entry, expand=entry in incomplete)
+                if self.galleries:
+                    self.galleries.step()
+
+    def expand_entries(self, entries: list) -> list:
+        """
+        Open the collapsed text, comments and replies of a list of entries at once, see EXPAND_ENTRIES. Facebook loads
+        the comments of all of them in parallel, instead of one post after the other.
+        :param entries: Web elements of the entries.
+        :return: The entries that still have something collapsed after the timeout.
+        """
+        if not entries:
+            return []
+        self.pacing.throttle()
+        incomplete = self.execute_async_script(
+            EXPAND_ENTRIES, entries, [extract.SEE_MORE, extract.MORE_COMMENTS, extract.REPLY_PAGER],
+            self.pacing.expand_timeout, self.pacing.delays["comments"])
+        self.incomplete += len(incomplete)
+        return [entries[position] for position in incomplete]
+
+    def snapshot_entries(self, entries: list):
+        """
+        Pull the HTML of a list of entries in one call to the webdriver.
+        :param entries: Web elements of the entries.
+        :return: List of the outerHTML of each entry.
+        """
+        if not entries:
+            return []
+        return self.execute_script("return arguments[0].map(function (e) {return e.outerHTML;});", entries)
+
+    def scrape_entry_snapshot(self, entry, html: str):
+        """
+        Extract the contents of one individual post from a snapshot of its HTML. The webdriver is only used to click
+        open collapsed text and comments, for links that only appear on hover, and to save images.
+        :param entry: Web element of the entry, obtained through the drivers find_element(s) method.
+        :param html: The outerHTML of the entry, obtained through snapshot_entries.
+        :return: Entries of the post as a dictionary.
+        """
+        tree = extract.parse_html(html)
+        if extract.needs_expansion(tree):
+            if tree.xpath(extract.SEE_MORE):
+                try:
+                    entry.find_element_by_xpath(extract.SEE_MORE).click()
+                except ElementClickInterceptedException:
+                    pass
+            if tree.xpath(extract.MORE_COMMENTS) or tree.xpath(extract.REPLY_PAGER):
+                self.show_all_comments(entry=entry)
+            tree = extract.parse_html(self.execute_script("return arguments[0].outerHTML;", entry))
+
+        content = extract.parse_entry(tree, _type=self._type, max_comments=self.max_comments, page=self._page)
+        # In groups, the link only appears in the markup once the mouse is moved over the post.
+        if content['link'] is None and self._type == "group":
+            content['link'] = self.scrape_link(entry=entry)
+
+        if extract.has_media(tree, _type=self._type, thumbnails=self.selectors.chain(self._type, "thumbnail")):
+            self.scrape_media(entry=entry, content=content, tree=tree)
+
+        return content
+
+    def scrape_entry(self, entry, expand: bool = True):
         """
         Extract the contents of one individual post on facebook.
         :param entry: Web element of the entry, obtained through the drivers find_element(s) method.
+        :param expand: Whether the comments may still have to be loaded. False for entries that expand_entries opened
+        all the way, which saves the scrolling and waiting of show_all_comments.
         :return: Entries of the post as a pandas dataframe row.
         """
         # ToDo: Handle text-only post.
@@ -260,13 +930,18 @@ class FaceBookDriver(webdriver.Chrome):
 
         content['unavailable'] = bool("This content isn't available right now" in entry.text)
 
-        content['author'] = entry.find_element_by_xpath(".//span[starts-with(@class, 'fwb')]/a").text
-        timestamp = entry.find_element_by_xpath(".//*[starts-with(@class, '_5ptz')]").get_attribute('title')
-        content['timestamp'] = datetime.strptime(timestamp, "%m/%d/%y, %H:%M %p")
-        comments = self.scrape_comments(entry)
-        if comments:
-            for num, comment in enumerate(comments[: self.max_comments]):
-                content['comment_' + str(num)] = comment
+        content['author'] = entry.find_element_by_xpath(extract.AUTHOR).text
+        timestamp = entry.find_element_by_xpath(extract.TIMESTAMP).get_attribute('title')
+        content['timestamp'] = datetime.strptime(timestamp, extract.TIMESTAMP_FORMAT)
+        entry_id = entry.get_attribute('id')
+        permalink = None
+        if not extract.post_number(entry_id):
+            links = entry.find_elements_by_xpath(extract.PERMALINK)
+            permalink = links[0].get_attribute('href') if links else None
+            permalink = None if permalink and permalink.endswith("#") else permalink
+        content['post_id'] = extract.post_identity(entry_id, content['author'], content['timestamp'], self._page,
+                                                   permalink=permalink)
+        content['comments'] = self.scrape_comments(entry, expand=expand)[: self.max_comments]
         content['text'] = self.scrape_text(entry)
 
         content['link'] = ""
@@ -275,10 +950,21 @@ class FaceBookDriver(webdriver.Chrome):
         if ("shared a link" in entry.text) or (self._type == "page"):
             content['link'] = self.scrape_link(entry=entry)
 
+        self.scrape_media(entry=entry, content=content)
+
+        return content
+
+    def scrape_media(self, entry, content: dict, tree=None):
+        """
+        Save the images of a post, or the thumbnail if it is a video, and add the file paths to its contents.
+        :param entry: Web element of the entry, obtained through the drivers find_element(s) method.
+        :param content: The contents of the post extracted so far, with author and timestamp.
+        :param tree: The entry parsed from a snapshot, if there is one.
+        """
         # See if there is image in post.
         images = None
         try:
-            images = entry.find_elements_by_xpath(".//*[@rel = 'theater']")
+            images = entry.find_elements_by_xpath(extract.THEATER)
         # If there is no image, get thumbnail.
         except NoSuchElementException:
             pass
@@ -288,14 +974,21 @@ class FaceBookDriver(webdriver.Chrome):
         if images:
             if len(images) == 1 and images[0].is_displayed():
                 try:
-                    filename = f"{self.images_folder}/{content['author']}_{content['timestamp'].isoformat()}.png"
-                    content["image_0"] = filename
-                    images[0].screenshot(filename)
+                    content["image_0"] = self.save_image(
+                        images[0], media.file_stem(self.images_folder, content['author'], content['timestamp']),
+                        post_id=content['post_id'])
                 except TimeoutException:
                     self.preview_issue += 1
 
+            elif len(images) > 1 and images[0].is_displayed() and self.enumerate_galleries and self.downloader and \
+                    self.enumerate_gallery(entry, content, tree=tree):
+                pass
+
+            elif len(images) > 1 and images[0].is_displayed() and self.galleries:
+                content['gallery'] = self.galleries.submit(entry, post_id=content['post_id'])
+
             elif len(images) > 1 and images[0].is_displayed():
-                images = self.scrape_images(entry)
+                images = self.scrape_images(entry, post_id=content['post_id'])
                 if images:
                     for num, image in enumerate(images[: self.max_images]):
                         content['image_' + str(num)] = image
@@ -303,11 +996,88 @@ class FaceBookDriver(webdriver.Chrome):
         else:
             try:
                 content['image_0'] = self.scrape_thumbnail(entry=entry, author=content['author'],
-                                                           date=content['timestamp'].isoformat())
+                                                           timestamp=content['timestamp'], post_id=content['post_id'])
             except NoSuchElementException:
                 pass
 
-        return content
+    def enumerate_gallery(self, entry, content: dict, tree=None) -> bool:
+        """
+        Download the photos of a gallery, found in the markup of the post, without opening the theater. If the post does
+        not show all of them, they are taken from the page of the photo set instead, fetched with one request.
+        :param entry: Web element of the entry.
+        :param content: The contents of the post, to add image_0, image_1, ... to.
+        :param tree: The entry parsed from a snapshot. Without it, the markup is pulled in one call to the webdriver.
+        :return: Whether any photos were found. If not, the theater has to be gone through instead.
+        """
+        if tree is None:
+            tree = extract.parse_html(self.execute_script("return arguments[0].outerHTML;", entry))
+        base_url = self.current_url
+        items = extract.gallery_items(tree, base_url=base_url)
+        photos = [item for item in items if item['kind'] == "photo" and item['src']]
+        if extract.hidden_items(tree) and (self.max_images is None or len(photos) < self.max_images):
+            items = self.photo_set_items(extract.photo_set(items), base_url) or items
+
+        photos = [item for item in items if item['kind'] == "photo" and item['src']][: self.max_images]
+        self.skipped_videos += sum(item['kind'] == "video" for item in items)
+        if not photos:
+            return False
+        stem = media.file_stem(self.images_folder, content['author'], content['timestamp'])
+        for position, item in enumerate(photos):
+            content[f"image_{position}"] = self.save_image_url(item['src'], f"{stem}_{position}",
+                                                               post_id=content['post_id'], position=position)
+        return True
+
+    def photo_set_items(self, photo_set: str, base_url: str) -> list:
+        """
+        All items of a photo set, from its page, fetched with the session of the downloader.
+        :return: List of the items (see extract.gallery_items), or None if the page could not be had.
+        """
+        import requests
+
+        if not photo_set:
+            return None
+        url = urljoin(base_url, f"/media/set/?set={photo_set}")
+        self.pacing.throttle()
+        try:
+            response = self.downloader.session.get(url, timeout=self.downloader.timeout)
+            response.raise_for_status()
+        except requests.RequestException:
+            self.image_issue += 1
+            return None
+        return extract.gallery_items(extract.parse_html(response.text), base_url=response.url)
+
+    def save_image_url(self, src: str, stem: str, post_id: str = None, position: int = 0):
+        """
+        Download an image in the background, see save_image.
+        :param src: URL of the image.
+        :return: A future of the file path (None if the download fails, see media.resolve), so that the post is only
+        handed on once its file is there.
+        """
+        if self.media_store:
+            return self.downloader.submit(src, post_id=post_id, position=position)
+        return self.downloader.submit(src, stem + media.extension(src))
+
+    def save_image(self, element, stem: str, post_id: str = None, position: int = 0):
+        """
+        Save an image. With a downloader, the original image file is downloaded in the background; otherwise, or if
+        the element has no image source, a screenshot of the element is taken. With a media store, the image is saved
+        there instead of under the given file name.
+        :param element: The img element, or an element that contains it.
+        :param stem: File path to save to, without the extension.
+        :param post_id: Post the image belongs to, for the media store.
+        :param position: Position of the image within the post, for the media store.
+        :return: The file path, or a future of it while the image is downloading.
+        """
+        if self.downloader:
+            src = self.execute_script(IMAGE_SOURCE, element)
+            if src:
+                return self.save_image_url(src, stem, post_id=post_id, position=position)
+
+        if self.media_store:
+            return self.media_store.put(element.screenshot_as_png, ".png", post_id=post_id, position=position)
+        filename = stem + ".png"
+        element.screenshot(filename)
+        return filename
 
     def scrape_text(self, entry):
         """
@@ -317,11 +1087,11 @@ class FaceBookDriver(webdriver.Chrome):
         """
         if "See More" in entry.text:
             try:
-                entry.find_element_by_xpath(".//*[text()='See More']").click()
+                entry.find_element_by_xpath(extract.SEE_MORE).click()
             except ElementClickInterceptedException:
                 pass
         try:
-            text = entry.find_element_by_xpath(".//*[@data-testid='post_message']").text
+            text = entry.find_element_by_xpath(extract.TEXT).text
         except NoSuchElementException:
             text = ''
         return text
@@ -336,37 +1106,44 @@ class FaceBookDriver(webdriver.Chrome):
             # Make link appear by moving mouse to it.
             self.execute_script("arguments[0].scrollIntoView();", entry)
             ActionChains(self).move_to_element(entry).perform()
-            link = entry.find_element_by_xpath(".//div[@class='mtm']//a").get_attribute("href")
+            link = self.find_selector(entry, "link").get_attribute("href")
 
         elif self._type == "page":
-            try:
-                link = entry.find_element_by_xpath(".//a[@class = '_52c6']")
-            except NoSuchElementException:
+            link = self.selectors.find(entry, self._type, "link")
+            if link is None:
                 return None
             if link.is_displayed():
                 # Make link appear by moving mouse to it.
                 self.execute_script("arguments[0].scrollIntoView();", link)
                 ActionChains(self).move_to_element(link).perform()
-                return entry.find_element_by_xpath(".//a[@class = '_52c6']").get_attribute('href')
+                return link.get_attribute('href')
             else:
                 return None
 
         return link
 
-    def scrape_images(self, entry):
+    def gallery_size(self, entry) -> int:
+        """
+        How many images the gallery of a post has, counting the ones behind the "+N" on the last photo.
+        :param entry: Web element of the entry.
+        """
+        try:
+            return int(entry.find_element_by_xpath(extract.HIDDEN_ITEMS).text.strip('+')) + 3
+        except NoSuchElementException:
+            return len(entry.find_elements_by_xpath(extract.THEATER))
+
+    def scrape_images(self, entry, post_id: str = None):
         # ToDo: Scrape comments to photos.
         """
         Scroll through all the available images and download each image to the provided images_folder. Requires for
         the image to be maximized in the webdriver.
+        :param post_id: Post the images belong to, for the media store.
         :return: A list of the file paths.
         """
 
-        try:
-            n_images = int(entry.find_element_by_xpath(".//*[@class='_52db']").text.strip('+')) + 3
-        except NoSuchElementException:
-            n_images = len(entry.find_elements_by_xpath(".//*[@rel = 'theater']"))
+        n_images = self.gallery_size(entry)
 
-        for image in entry.find_elements_by_xpath(".//*[@rel = 'theater']"):
+        for image in entry.find_elements_by_xpath(extract.THEATER):
             try:
                 image.click()
                 break
@@ -380,110 +1157,125 @@ class FaceBookDriver(webdriver.Chrome):
         except TimeoutException:
             ActionChains(self).send_keys(Keys.ESCAPE).perform()
             self.image_issue += 1
-            random_sleep(1)
+            self.pacing.pause("gallery")
             return None
 
-        random_sleep(2)
+        self.pacing.pause("theater")
 
         image_count = 1
-        timestamp = self.find_element_by_xpath("//span[@id='fbPhotoSnowliftTimestamp']//abbr").get_attribute('title')
+        timestamp = self.find_selector(self, "theater_timestamp").get_attribute('title')
         post_date = datetime.strptime(timestamp, "%A, %B %d, %Y at %I:%M %p").date().isoformat()
         filenames = []
 
         for _ in range(n_images - 1):  # -1 because we need one click to go from first to second image.
             # In some cases, facebook allows users to click through galeries and access previous image posts. Prevent!
-            timestamp = self.find_element_by_xpath(
-                "//span[@id='fbPhotoSnowliftTimestamp']//abbr").get_attribute('title')
+            timestamp = self.find_selector(self, "theater_timestamp").get_attribute('title')
             image_time = datetime.strptime(timestamp, "%A, %B %d, %Y at %I:%M %p")
             image_date = image_time.date().isoformat()
             if image_date != post_date:
                 break
 
-            author = self.find_element_by_xpath("//div[@id='fbPhotoSnowliftAuthorName']/a[1]").get_attribute('title')
+            author_link = self.find_selector(self, "theater_author")
+            author = author_link.get_attribute('title')
             # Author might be an organization, which will not be found by the above line, emptry string is returned.
             if not author:
-                author = self.find_element_by_xpath("//div[@id='fbPhotoSnowliftAuthorName']/a[1]").text
-            author = author.replace(" ", "_")
+                author = author_link.text
 
-            filename = f"{self.images_folder}/{author}_{image_time.isoformat()}.png"
-
-            image = self.find_element_by_class_name("spotlight")
+            # A video in the gallery has no spotlight image; it is skipped.
+            spotlight = self.find_elements_by_class_name("spotlight")
+            image = spotlight[0] if spotlight else None
             if image:
                 try:
-                    image.screenshot(filename)
+                    filename = self.save_image(image, media.file_stem(self.images_folder, author, image_time),
+                                               post_id=post_id, position=image_count - 1)
 
                     filenames = filenames + [filename]
 
                     image_count += 1
 
-                    random_sleep(1)
+                    # A screenshot needs the image to settle; a download does not.
+                    if not self.downloader:
+                        self.pacing.pause("gallery")
                     ActionChains(self).move_to_element(image).perform()
-                    random_sleep(1)
+                    if not self.downloader:
+                        self.pacing.pause("gallery")
 
-                    if image_count > self.max_images:
+                    if self.max_images is not None and image_count > self.max_images:
                         break
 
                 except WebDriverException:
                     self.screenshot_error += 1
             else:
-                self.no_screenshot += 1
+                self.skipped_videos += 1
 
             # Load next if possible.
-            try:
-                next_button = self.find_element_by_xpath("//a[@title = 'Next']")
-            except NoSuchElementException:
+            next_button = self.selectors.find(self, self._type, "theater_next")
+            if next_button is None:
                 break
             if next_button.is_displayed():
                 ActionChains(self).move_to_element(next_button).perform()
+                self.pacing.throttle()
                 next_button.click()
-                random_sleep(1)
+                self.pacing.pause("gallery")
             else:
                 break
 
         ActionChains(self).send_keys(Keys.ESCAPE).perform()
-        random_sleep(1)
+        self.pacing.pause("gallery")
         return filenames
 
-    def scrape_thumbnail(self, entry, author, date):
+    def scrape_thumbnail(self, entry, author, timestamp: datetime, post_id: str = None):
         """
         Obtain the thumbnail of a video in a facebook post.
         :param entry: Web element of the entry, obtained through the drivers find_element(s) method.
         :param author: Author of the post, to be written to the filename.
-        :param date: Date of the post, to be written to the filename.
+        :param timestamp: Time of the post, to be written to the filename.
+        :param post_id: Post the thumbnail belongs to, for the media store.
         :return: File path of the video thumbnail.
         """
-        author = author.replace(" ", "_")
-        xpaths = self.xpaths[self._type]['thumbnail']
-        filename = f"{self.thumbnails_folder}/{author}_{date}.png"
-        for xpath in xpaths:
-            try:
-                entry.find_element_by_xpath(xpath).screenshot(filename)
-                return filename
-            except (NoSuchElementException, WebDriverException) as e:
-                pass
+        # An element that is found but cannot be saved counts as a miss too, so the next post tries another selector
+        # first.
+        for xpath in list(self.selectors.chain(self._type, "thumbnail")):
+            elements = entry.find_elements_by_xpath(xpath)
+            if elements:
+                try:
+                    filename = self.save_image(elements[0], media.file_stem(self.thumbnails_folder, author, timestamp),
+                                               post_id=post_id)
+                    self.selectors.hit(self._type, "thumbnail", xpath)
+                    return filename
+                except WebDriverException:
+                    pass
+            self.selectors.miss(self._type, "thumbnail", xpath)
 
         return
 
-    def scrape_comments(self, entry):
+    def find_selector(self, context, name: str):
+        """
+        Find an element with a chain of selectors of the registry.
+        :param context: Element (or the driver) to search in.
+        :param name: Name of the chain.
+        :return: The first element found by the first selector that matches.
+        """
+        element = self.selectors.find(context, self._type, name)
+        if element is None:
+            raise NoSuchElementException(f"No selector of {name} matched.")
+        return element
+
+    def scrape_comments(self, entry, expand: bool = True):
         """
-        Load all comments and return a list of comment text.
+        Load all comments and return them with their author, likes, timestamp and position in the comment tree.
+        The whole tree is read in one call to the webdriver.
         :param entry: The webelement of a facebook post with comments.
-        :return: List of all comments.
+        :param expand: Whether the comments may still have to be loaded, see scrape_entry.
+        :return: List of all comments, as dictionaries (see extract.comment_record).
         """
         comments = []
         if 'Reply' in entry.text:
-            self.show_all_comments(entry=entry)
+            if expand:
+                self.show_all_comments(entry=entry)
 
             # Finds both first level and second level comments
-            comments = entry.find_elements_by_xpath(".//ul[@class='_7791']/li|.//ul[@class='_7791']/li/div/ul/li")
-            comments = [comment.text for comment in comments]
-
-            tail = r"\nLike\n · Reply ·.*"
-            likes = r"\n\d$"
-            comments = [re.sub(tail, "", comment, flags=re.DOTALL) for comment in comments]
-            comments = [re.sub(likes, "", comment, flags=re.DOTALL) for comment in comments]
-            comments = [comment.strip() for comment in comments]
-            comments = [comment.strip("\nHide or report this") for comment in comments]
+            comments = [extract.comment_record(comment) for comment in self.execute_script(COMMENT_TREE, entry)]
 
         return comments
 
@@ -494,69 +1286,156 @@ class FaceBookDriver(webdriver.Chrome):
         """
         self.execute_script("arguments[0].scrollIntoView();", entry)
         ActionChains(self).move_to_element(entry).perform()
-        sleep(0.5)
+        self.pacing.pause("click")
 
         while "more comments" in entry.text:
             self.execute_script("window.scrollTo(0, 0);")
-            sleep(0.5)
-            entry.find_element_by_xpath(".//*[contains(text(), 'more comments')]").click()
-            random_sleep(3)
+            self.pacing.pause("click")
+            self.pacing.throttle()
+            entry.find_element_by_xpath(extract.MORE_COMMENTS).click()
+            self.pacing.pause("comments")
 
-        for button in entry.find_elements_by_xpath(
-                ".//*[@data-testid = 'UFI2CommentsPagerRenderer/pager_depth_1' and @role = 'button']"):
+        for button in entry.find_elements_by_xpath(extract.REPLY_PAGER):
             self.execute_script("window.scrollTo(0, 0);")
             ActionChains(self).move_to_element(self.find_element_by_link_text("Facebook")).perform()
-            random_sleep(0.1)
+            self.pacing.pause("hover")
             button.click()
 
 
-def main():
-    import parameters
-    from acct import username, password
+def chrome_options(headless: bool = True, profile_dir: str = None, lean: bool = False):
+    """
+    Chrome options for scraping: headless and without notifications.
+    :param profile_dir: Chrome profile directory to keep the session (and cache) in between runs.
+    :param lean: Also keep chrome from playing videos, loading web fonts and plugins, and from background traffic
+    of its own. See FaceBookDriver(blocked=...) for what else not to load.
+    """
     from selenium import webdriver
 
-    # Importing pandas is kind of overkill, since we only really need it to parse the timestamp into the .csv output.
-    # But we we will do it anyways, since elegance (and, by extension, hassle-free development) is more important to us
-    # than performance.
-    from pandas import DataFrame as df
-
-    # Run headless and without notification
     _chrome_options = webdriver.ChromeOptions()
-    _chrome_options.add_argument("--headless")
+    if headless:
+        _chrome_options.add_argument("--headless")
+    if profile_dir:
+        _chrome_options.add_argument(f"--user-data-dir={profile_dir}")
     prefs = {"profile.default_content_setting_values.notifications": 2}
+    if lean:
+        for argument in ["--autoplay-policy=user-gesture-required", "--mute-audio", "--disable-remote-fonts",
+                         "--disable-background-networking", "--disable-component-update", "--disable-extensions",
+                         "--disable-features=MediaRouter,PreloadMediaEngagementData"]:
+            _chrome_options.add_argument(argument)
+        prefs.update({"profile.default_content_setting_values.plugins": 2,
+                      "profile.default_content_setting_values.geolocation": 2,
+                      "profile.default_content_setting_values.media_stream": 2,
+                      "profile.default_content_setting_values.automatic_downloads": 2})
     _chrome_options.add_experimental_option("prefs", prefs)
+    return _chrome_options
 
-    driver = FaceBookDriver(executable_path=parameters.chrome_location, chrome_options=_chrome_options,
-                            # max_scroll_depth=9,
-                            username=username, password=password)
 
-    results = []
+def page_url(page: dict, base_url: str = "https://www.facebook.com") -> str:
+    """
+    Link to an entry of parameters.pages.
+    """
+    if page['type'] == 'group':
+        return f"{base_url}/groups/{page['id']}"
+    return f"{base_url}/{page['id']}/posts/"
+
+
+def scrape_to_file(driver: FaceBookDriver, page: dict, destination: str, checkpoints: str, chunk_size: int = 150,
+                   formats: list = ("csv", "xlsx"), store=None):
+    """
+    Scrape an entry of parameters.pages and write the results to the destination folder.
+    :param driver: Logged in FaceBookDriver.
+    :param page: Dictionary with the name, type and id of the page or group.
+    :param destination: Folder to write the results to.
+    :param checkpoints: Folder to keep the checkpoints in.
+    :param chunk_size: How many posts to scrape at once in groups.
+    :param formats: Outputs to derive from the Parquet export besides it, "csv" and/or "xlsx".
+    :param store: ResultStore to also write the posts to.
+    :return: File name of the results (without extension), and the error counters of this page.
+    """
+    from export import export_results
+    from sinks import JsonlSink, Tee
 
-    page = parameters.pages[3]
+    errors = driver.errors()
+    checkpoint = Checkpoint.for_page(checkpoints, page['id'])
+    file_name = f"{destination}/{page['name'].replace(' ', '_')}_{datetime.today().date().isoformat()}"
 
     if page['type'] == 'group':
-        result = driver.scrape_page(f"https://www.facebook.com/groups/{page['id']}", _type="group", chunk_size=150)
+        result = driver.scrape_page(page_url(page), _type="group", chunk_size=chunk_size, stream=True,
+                                    checkpoint=checkpoint, incremental=True)
 
     elif page['type'] == 'page':
-        result = driver.scrape_page(f"https://www.facebook.com/{page['id']}/posts/", _type="page")
+        result = driver.scrape_page(page_url(page), _type="page", stream=True)
+
+    # Posts are written out while scraping, so that nothing is lost if the scrape crashes halfway. The file of the day
+    # is always appended to: when resuming, the posts from before the crash are already in it, and an earlier
+    # (incremental) run of the same day has the posts this one stops short of. The export takes each post once.
+    with JsonlSink(file_name + ".jsonl", append=True) as sink:
+        checkpoint.sink = Tee(sink, store) if store else sink
+        for entry in result:
+            entry.update({'page': page['name']})
+            checkpoint.sink.write(entry)
+        checkpoint.sink.flush()
 
-    for entry in result:
-        entry.update({'page': page['name']})
-    results = results + result
+    export_results(file_name, formats=formats)
 
-    file_name = f"{parameters.destination}/{page['name'].replace(' ', '_')}_{datetime.today().date().isoformat()}"
-    results_df = df(results)
-    results_df.to_csv(file_name + ".csv", index=False, encoding='utf-16')
-    results_df = results_df.applymap(lambda x: x.encode('unicode_escape').decode('utf-8') if isinstance(x, str) else x)
-    results_df.to_excel(file_name + ".xlsx", index=False)
+    return file_name, {counter: count - errors[counter] for counter, count in driver.errors().items()}
 
-    print(f"""Scraping {page['name']} complete.
-    Screenshot errors: {driver.screenshot_error}
-    No screenshot:     {driver.no_screenshot}
-    Preview issues:    {driver.preview_issue}
-    Image issues:      {driver.image_issue}""")
 
-    driver.close()
+def find_page(pages: list, key: str) -> dict:
+    """
+    The entry of parameters.pages with the given name or id.
+    """
+    for page in pages:
+        if key in (page['name'], page['id']):
+            return page
+    raise KeyError(f"No page or group {key} in parameters.pages.")
+
+
+def main():
+    import argparse
+    import parameters
+    from acct import username, password
+
+    parser = argparse.ArgumentParser(description="Scrape pages of parameters.pages, one after the other. See daemon.py "
+                                                 "to keep scraping them on a schedule.")
+    parser.add_argument("pages", nargs="*", default=[parameters.pages[3]['id']], help="Names or ids of the pages.")
+    args = parser.parse_args()
+    pages = [find_page(parameters.pages, key) for key in args.pages]
+
+    driver = FaceBookDriver(executable_path=parameters.chrome_location,
+                            chrome_options=chrome_options(lean=parameters.lean),
+                            # max_scroll_depth=9,
+                            username=username, password=password, session_cache=SessionCache(parameters.session),
+                            download_images=True, media_store=media.MediaStore(parameters.media),
+                            selectors=SelectorRegistry(parameters.selectors, parameters.selector_stats),
+                            gallery_tabs=parameters.gallery_tabs,
+                            blocked=parameters.blocked if parameters.lean else None,
+                            capture=CaptureArchive(parameters.archive) if parameters.archive else None)
+
+    # All runs go to the same store as well, which only adds the posts that are new (see store.py).
+    store = ResultStore(parameters.store)
+    for page in pages:
+        added, updated = store.added, store.updated
+        # Time every webdriver command and each phase of the scrape of this page, see instrument.py.
+        with Instrumentation(profile=parameters.profile).attach(driver) as instrumentation:
+            file_name, errors = scrape_to_file(driver, page=page, destination=parameters.destination,
+                                               checkpoints=parameters.checkpoints, formats=parameters.export_formats,
+                                               store=store)
+        instrumentation.write(file_name + "_timings")
+
+        print(f"""Scraping {page['name']} complete.
+    Screenshot errors: {errors['screenshot_error']}
+    No screenshot:     {errors['no_screenshot']}
+    Preview issues:    {errors['preview_issue']}
+    Image issues:      {errors['image_issue']}
+    Download issues:   {errors['download_issue']}
+    Still collapsed:   {errors['incomplete']}
+    Skipped videos:    {errors['skipped_videos']}
+    Timings:           {file_name}_timings.json
+    New posts:         {store.added - added} ({store.updated - updated} updated)""")
+    store.close()
+
+    driver.quit()
 
 if __name__ == "__main__":
-    pass
+    main()
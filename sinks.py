@@ -0,0 +1,127 @@
+"""
+Sinks that write scraped posts to disk while the scrape is still running, so that a crash does not lose everything
+that was collected so far and memory does not grow with the size of the feed.
+"""
+
+import json
+import os
+from datetime import datetime, date
+
+
+def _default(obj):
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class Sink:
+    """
+    Base class for sinks. Posts are buffered and handed to _write_batch every batch_size posts.
+    """
+    def __init__(self, batch_size: int = 50):
+        self.batch_size = batch_size
+        self.written = 0
+        self._buffer = []
+
+    def write(self, post: dict):
+        """
+        Add one post to the sink.
+        :param post: Dictionary with the contents of the post.
+        """
+        self._buffer.append(post)
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def write_all(self, posts):
+        """
+        Write all posts from an iterable (e.g. the generator returned by FaceBookDriver.iter_page).
+        :param posts: Iterable of post dictionaries.
+        """
+        for post in posts:
+            self.write(post)
+
+    def flush(self):
+        """
+        Write all buffered posts.
+        """
+        if self._buffer:
+            self._write_batch(self._buffer)
+            self.written += len(self._buffer)
+            self._buffer = []
+
+    def _write_batch(self, posts: list):
+        raise NotImplementedError
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class JsonlSink(Sink):
+    def __init__(self, path: str, batch_size: int = 50, fsync: bool = True, append: bool = True):
+        """
+        Writes one post per line as JSON. Timestamps are written in ISO format.
+        :param path: File to write to.
+        :param batch_size: How many posts to buffer before writing them out.
+        :param fsync: Whether to force each batch to disk.
+        :param append: Whether to append to an existing file, or start a new one.
+        """
+        super().__init__(batch_size=batch_size)
+        self.path = path
+        self.fsync = fsync
+        self._file = open(path, "a" if append else "w", encoding="utf-8")
+
+    def _write_batch(self, posts: list):
+        self._file.write("".join(json.dumps(post, default=_default, ensure_ascii=False) + "\n" for post in posts))
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        super().close()
+        self._file.close()
+
+
+class Tee(Sink):
+    def __init__(self, *sinks: Sink):
+        """
+        Writes posts to several sinks at once, e.g. to a JsonlSink and a ResultStore. Flushing the tee flushes all
+        of them. Closing it does not close them, since they may outlive it.
+        """
+        super().__init__(batch_size=1)
+        self.sinks = sinks
+
+    def write(self, post: dict):
+        for sink in self.sinks:
+            sink.write(post)
+        self.written += 1
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+
+
+def read_jsonl(path: str, latest: bool = False):
+    """
+    Read back the posts written by a JsonlSink, one at a time.
+    :param path: File to read.
+    :param latest: Read each post only once, as it was last written, where it was written more than once (e.g. by two
+    runs on the same day, which append to the same file). Takes one more pass over the file, not more memory per post.
+    """
+    last = None
+    if latest:
+        last = {}
+        with open(path, encoding="utf-8") as file:
+            for number, line in enumerate(file):
+                if line.strip():
+                    last[json.loads(line).get("post_id") or number] = number
+        last = set(last.values())
+    with open(path, encoding="utf-8") as file:
+        for number, line in enumerate(file):
+            if line.strip() and (last is None or number in last):
+                yield json.loads(line)
@@ -0,0 +1,169 @@
+"""
+A local SQLite store of the scraped posts of all pages and all runs. Posts are keyed by their post_id (see
+extract.post_identity), so scraping a page again only adds the posts that are new and updates the ones that changed,
+instead of writing another full copy of the page.
+"""
+
+import os
+import sqlite3
+from datetime import datetime
+
+from sinks import Sink
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS posts (post_id TEXT PRIMARY KEY, page TEXT, author TEXT, timestamp TEXT, text TEXT,
+                                      link TEXT, unavailable INTEGER, n_comments INTEGER, first_seen TEXT,
+                                      last_seen TEXT);
+    CREATE INDEX IF NOT EXISTS posts_page_timestamp ON posts (page, timestamp);
+    CREATE INDEX IF NOT EXISTS posts_timestamp ON posts (timestamp);
+    CREATE INDEX IF NOT EXISTS posts_author ON posts (author);
+    CREATE TABLE IF NOT EXISTS comments (post_id TEXT, position INTEGER, comment_id TEXT, author TEXT, text TEXT,
+                                         likes INTEGER, timestamp TEXT, depth INTEGER, parent INTEGER,
+                                         PRIMARY KEY (post_id, position));
+    CREATE TABLE IF NOT EXISTS media (post_id TEXT, position INTEGER, path TEXT, PRIMARY KEY (post_id, position));
+"""
+
+UPSERT_POST = """
+    INSERT INTO posts VALUES (:post_id, :page, :author, :timestamp, :text, :link, :unavailable, :n_comments, :seen,
+                              :seen)
+    ON CONFLICT (post_id) DO UPDATE SET
+        text = excluded.text,
+        link = COALESCE(NULLIF(excluded.link, ''), posts.link),
+        unavailable = excluded.unavailable,
+        n_comments = MAX(posts.n_comments, excluded.n_comments),
+        last_seen = excluded.last_seen
+"""
+
+UPSERT_MEDIA = """
+    INSERT INTO media VALUES (?, ?, ?)
+    ON CONFLICT (post_id, position) DO UPDATE SET path = COALESCE(excluded.path, media.path)
+"""
+
+
+def _iso(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _datetime(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+class ResultStore(Sink):
+    def __init__(self, path: str = "results/posts.sqlite", batch_size: int = 50):
+        """
+        SQLite store of scraped posts, in WAL mode so that it can be read (and written by parallel workers) while a
+        scrape is running. Can be used as a sink: posts are buffered and upserted batch_size at a time, in one
+        transaction.
+        :param path: The database file. Created if it does not exist.
+        :param batch_size: How many posts to buffer before writing them out.
+        """
+        super().__init__(batch_size=batch_size)
+        self.path = path
+        # Posts that were new to the store, and posts that were already in it.
+        self.added = 0
+        self.updated = 0
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._db = sqlite3.connect(path, timeout=30)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def _write_batch(self, posts: list):
+        seen = datetime.now().isoformat(timespec="seconds")
+        ids = [post['post_id'] for post in posts]
+        with self._db:
+            stored = dict(self._db.execute(
+                f"SELECT post_id, n_comments FROM posts WHERE post_id IN ({','.join('?' * len(ids))})", ids))
+
+            self._db.executemany(UPSERT_POST, [
+                {"post_id": post['post_id'], "page": post.get('page'), "author": post.get('author'),
+                 "timestamp": _iso(post.get('timestamp')), "text": post.get('text'), "link": post.get('link'),
+                 "unavailable": post.get('unavailable'), "n_comments": len(post.get('comments') or []), "seen": seen}
+                for post in posts])
+
+            # The comments of a post are replaced unless fewer were scraped this time than are already stored (e.g.
+            # with a lower max_comments), so the stored comment list only ever grows.
+            renewed = [post for post in posts
+                       if len(post.get('comments') or []) >= (stored.get(post['post_id']) or 0)]
+            self._db.executemany("DELETE FROM comments WHERE post_id = ?", [(post['post_id'],) for post in renewed])
+            self._db.executemany("INSERT INTO comments VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", [
+                (post['post_id'], position, comment.get('comment_id'), comment.get('author'), comment.get('text'),
+                 comment.get('likes'), _iso(comment.get('timestamp')), comment.get('depth'), comment.get('parent'))
+                for post in renewed for position, comment in enumerate(post.get('comments') or [])])
+
+            self._db.executemany(UPSERT_MEDIA, [
+                (post['post_id'], int(key[len("image_"):]), value)
+                for post in posts for key, value in post.items() if key.startswith("image_")])
+
+        self.updated += len(stored)
+        self.added += len(posts) - len(stored)
+
+    def _where(self, page: str = None, since: datetime = None, until: datetime = None, author: str = None):
+        conditions, params = [], []
+        for condition, value in [("page = ?", page), ("timestamp >= ?", _iso(since)), ("timestamp < ?", _iso(until)),
+                                 ("author = ?", author)]:
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+    def count(self, page: str = None, since: datetime = None, until: datetime = None, author: str = None) -> int:
+        """
+        Number of stored posts, optionally only those of a page, an author, or a time range.
+        """
+        self.flush()
+        where, params = self._where(page, since, until, author)
+        return self._db.execute(f"SELECT COUNT(*) FROM posts{where}", params).fetchone()[0]
+
+    def posts(self, page: str = None, since: datetime = None, until: datetime = None, author: str = None,
+              batch: int = 500):
+        """
+        Read posts from the store, newest first, in the same form as they were scraped (with their comments, and
+        their images as image_0, image_1, ...).
+        :param page: Only posts of this page (its name, as in parameters.pages).
+        :param since: Only posts from this time on.
+        :param until: Only posts before this time.
+        :param author: Only posts of this author.
+        :param batch: How many posts to read at a time.
+        :return: Generator of post dictionaries.
+        """
+        self.flush()
+        where, params = self._where(page, since, until, author)
+        cursor = self._db.execute(f"SELECT post_id, page, author, timestamp, text, link, unavailable FROM posts{where} "
+                                  f"ORDER BY timestamp DESC", params)
+        while True:
+            rows = cursor.fetchmany(batch)
+            if not rows:
+                break
+            posts = {row[0]: {"post_id": row[0], "page": row[1], "author": row[2], "timestamp": _datetime(row[3]),
+                              "text": row[4], "link": row[5], "unavailable": bool(row[6]), "comments": []}
+                     for row in rows}
+            marks = ",".join("?" * len(posts))
+            for post_id, comment_id, author_, text, likes, timestamp, depth, parent in self._db.execute(
+                    f"SELECT post_id, comment_id, author, text, likes, timestamp, depth, parent FROM comments "
+                    f"WHERE post_id IN ({marks}) ORDER BY post_id, position", list(posts)):
+                posts[post_id]["comments"].append({"comment_id": comment_id, "author": author_, "text": text,
+                                                   "likes": likes, "timestamp": _datetime(timestamp), "depth": depth,
+                                                   "parent": parent})
+            for post_id, position, path in self._db.execute(
+                    f"SELECT post_id, position, path FROM media WHERE post_id IN ({marks}) ORDER BY post_id, position",
+                    list(posts)):
+                posts[post_id][f"image_{position}"] = path
+            yield from posts.values()
+
+    def export(self, file_name: str, formats: list = ("csv", "xlsx"), page: str = None, since: datetime = None,
+               until: datetime = None, author: str = None) -> dict:
+        """
+        Export stored posts to Parquet (and CSV/XLSX) tables of posts, comments and media, see export.export_posts.
+        :return: Number of rows of each table.
+        """
+        from export import export_posts
+
+        return export_posts(self.posts(page=page, since=since, until=until, author=author), file_name,
+                            formats=formats)
+
+    def close(self):
+        super().close()
+        self._db.close()
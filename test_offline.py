@@ -0,0 +1,159 @@
+"""
+Offline checks of the scrapers against the synthetic feeds of fixtures.py, without facebook and without a browser.
+
+    python -m pytest -q test_offline.py
+"""
+
+import sqlite3
+from datetime import datetime, timedelta
+from time import sleep, time
+
+import pyarrow.parquet
+import pytest
+import requests
+
+import extract
+import fixtures
+from checkpoint import Checkpoint
+from http_backend import HttpScraper
+from media import ImageDownloader
+from sinks import read_jsonl
+
+
+class FeedDriver:
+    """
+    Stands in for a logged in FaceBookDriver: each scrape of a page hands out the next of a list of feeds, given as the
+    indices of fixtures.Post. The posts of a feed marked as new are dated just after the scrape started.
+    """
+    def __init__(self, feeds: list):
+        self.feeds = feeds
+        self.runs = 0
+
+    def errors(self) -> dict:
+        return {}
+
+    def logged_in(self) -> bool:
+        return True
+
+    def quit(self):
+        pass
+
+    def scrape_page(self, page: str, _type: str, stream: bool = False, **kwargs):
+        indices, new = self.feeds[min(self.runs, len(self.feeds) - 1)]
+        self.runs += 1
+        for index in indices:
+            content = extract.parse_entry(fixtures.Post(index).html(_type), _type, page=page)
+            if new:
+                content['timestamp'] = datetime.now().replace(microsecond=0) + timedelta(seconds=1)
+            yield content
+
+
+def test_scheduled_runs_on_one_day_keep_the_posts_of_both(tmp_path, monkeypatch):
+    import daemon
+    import parallel
+
+    # The first visit finds posts 5-9, the second one five newer posts 0-4 (and stops at the posts it had).
+    driver = FeedDriver([(range(5, 10), False), (range(0, 7), True)])
+    monkeypatch.setattr(parallel, "_start_driver", lambda *args: driver)
+    (tmp_path / "results").mkdir()
+    queue = daemon.JobQueue(str(tmp_path / "queue.sqlite"))
+    queue.add({"id": "10", "name": "River group", "type": "group"})
+    scheduler = daemon.Scheduler(queue, login=lambda: [], destination=str(tmp_path / "results"),
+                                 checkpoints=str(tmp_path / "checkpoints"), formats=())
+
+    def wait_for_runs(runs: int):
+        deadline = time() + 30
+        while queue.status()[0]['runs'] < runs:
+            assert time() < deadline, queue.status()
+            sleep(0.05)
+
+    scheduler.start()
+    try:
+        wait_for_runs(1)
+        queue.run_now("10")
+        scheduler.wake()
+        wait_for_runs(2)
+    finally:
+        scheduler.stop()
+        queue.close()
+
+    file_name = str(tmp_path / "results" / f"River_group_{datetime.today().date().isoformat()}")
+    posts = list(read_jsonl(file_name + ".jsonl", latest=True))
+    assert sorted(post['post_id'] for post in posts) == sorted(fixtures.Post(index).id[len("mall_post_"):]
+                                                               for index in range(10))
+    assert pyarrow.parquet.read_table(file_name + "_posts.parquet").num_rows == 10
+    # The first visit says nothing about the rate; the second one counts its new posts, once each, and not the posts of
+    # the first visit that are in the file as well.
+    with sqlite3.connect(tmp_path / "queue.sqlite") as db:
+        assert [row[0] for row in db.execute("SELECT new_posts FROM runs ORDER BY started")] == [0, 7]
+
+
+@pytest.fixture(scope="module")
+def server():
+    server = fixtures.serve(batch=10)
+    yield server
+    server.shutdown()
+
+
+def http_scraper(server, tmp_path, **kwargs) -> HttpScraper:
+    # The stand-in server only wants the c_user cookie of a logged in session.
+    cookies = [{"name": "c_user", "value": "100001", "domain": "127.0.0.1"}]
+    return HttpScraper(cookies, base_url=server.url + "/m", images_folder=str(tmp_path / "images"),
+                       thumbnails_folder=str(tmp_path / "thumbnails"), **kwargs)
+
+
+def test_http_scraper_matches_the_ground_truth(server, tmp_path):
+    truth = requests.get(server.url + "/posts.json", params={"n": 25}).json()
+    scraper = http_scraper(server, tmp_path, max_comments=None, max_images=None)
+    try:
+        posts = scraper.scrape_page(server.url + "/groups/25", "group")
+    finally:
+        scraper.quit()
+
+    assert not any(scraper.errors().values()), scraper.errors()
+    assert [post['post_id'] for post in posts] == [post['post_id'][len("mall_post_"):] for post in truth]
+    assert [post['author'] for post in posts] == [post['author'] for post in truth]
+    assert [post['timestamp'].isoformat() for post in posts] == [post['timestamp'] for post in truth]
+    # All comments and replies, through the pages of comments of the full stories (max_comments=None).
+    assert [len(post['comments']) for post in posts] == [post['comments'] for post in truth]
+    # Videos only have a thumbnail, which goes to the thumbnails folder.
+    images = [[value for key, value in post.items() if key.startswith("image_") and "images" in value]
+              for post in posts]
+    assert [len(files) for files in images] == [post['images'] for post in truth]
+    assert all(open(file, "rb").read(8) == b"\x89PNG\r\n\x1a\n" for files in images for file in files)
+
+
+def test_http_scraper_stops_at_the_posts_of_the_last_run(server, tmp_path):
+    truth = requests.get(server.url + "/posts.json", params={"n": 30}).json()
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.json"))
+    # The last run got up to post 10; the feed is newest first.
+    checkpoint.since = datetime.fromisoformat(truth[10]['timestamp'])
+    scraper = http_scraper(server, tmp_path, max_images=0)
+    fetch, fetched = scraper.fetch, []
+    scraper.fetch = lambda url, page=None: fetched.append(url) or fetch(url, page)
+    try:
+        posts = scraper.scrape_page(server.url + "/groups/30", "group", checkpoint=checkpoint, incremental=True)
+        assert [post['author'] for post in posts] == [post['author'] for post in truth[:10]]
+        # It stops on the second page of the feed, after stale_limit older posts, and leaves the third one alone.
+        assert [url for url in fetched if "/groups/" in url] == [server.url + "/m/groups/30",
+                                                                server.url + "/m/groups/30?cursor=10"]
+        assert checkpoint.since == datetime.fromisoformat(truth[0]['timestamp'])
+        # Nothing is new on the next run.
+        assert scraper.scrape_page(server.url + "/groups/30", "group", checkpoint=checkpoint, incremental=True) == []
+    finally:
+        scraper.quit()
+
+
+def test_image_downloader_saves_the_images(server, tmp_path):
+    files = [str(tmp_path / f"{index}.png") for index in range(6)]
+    with ImageDownloader(workers=3) as downloader:
+        futures = [downloader.submit(f"{server.url}/images/{index}_0.png", file) for index, file in enumerate(files)]
+        missing = downloader.submit(f"{server.url}/nothing.png", str(tmp_path / "missing.png"))
+        assert [future.result() for future in futures] == files
+        with pytest.raises(requests.HTTPError):
+            missing.result()
+
+    assert (downloader.downloaded, downloader.failed) == (6, 1)
+    assert all(open(file, "rb").read() == requests.get(f"{server.url}/images/{index}_0.png").content
+               for index, file in enumerate(files))
+    assert not (tmp_path / "missing.png").exists()